@@ -0,0 +1,89 @@
+"""Run the benchmarks and save the results as JSON, or compare two runs.
+
+Run with:
+    python -m benchmarks --output results.json [benchmark ...]
+    python -m benchmarks --compare before.json after.json
+"""
+import argparse
+import datetime
+import importlib
+import json
+import platform
+import sys
+import typing
+
+BENCHMARKS = (
+    "bench_conditional",
+    "bench_dispatch",
+    "bench_filter_generator",
+    "bench_hookclass",
+    "bench_instances",
+    "bench_registration",
+    "bench_scope",
+    "bench_threading",
+)
+
+
+def run(names: typing.Sequence[str]) -> typing.Dict[str, typing.Any]:
+    benchmarks = {}
+    for name in names:
+        print(f"# {name}")
+        module = importlib.import_module(f"benchmarks.{name}")
+        benchmarks[name] = {"unit": module.UNIT, "results": module.main()}  # type: ignore
+        print()
+    return {
+        "python": sys.version.split()[0],
+        "implementation": platform.python_implementation(),
+        "gil": getattr(sys, "_is_gil_enabled", lambda: True)(),
+        "platform": platform.platform(),
+        "date": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "benchmarks": benchmarks,
+    }
+
+
+def compare(
+    before: typing.Dict[str, typing.Any], after: typing.Dict[str, typing.Any]
+) -> None:
+    """Print the results of both runs, a ratio above 1 is a regression"""
+    print(f"before: Python {before['python']}, {before['date']}")
+    print(f"after:  Python {after['python']}, {after['date']}")
+    for name, benchmark in after["benchmarks"].items():
+        if name not in before["benchmarks"]:
+            continue
+        print(f"\n# {name} ({benchmark['unit']})")
+        before_results = before["benchmarks"][name]["results"]
+        for key, value in benchmark["results"].items():
+            if key not in before_results:
+                continue
+            ratio = value / before_results[key]
+            # the throughputs are better when higher
+            if benchmark["unit"].endswith("/s"):
+                ratio = 1 / ratio
+            print(
+                f"{key:<32} {before_results[key]:>14,.3f} {value:>14,.3f} {ratio:>7.2f}x"
+            )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks", description=__doc__)
+    parser.add_argument("benchmark", nargs="*", help=", ".join(BENCHMARKS))
+    parser.add_argument("--output", help="JSON file where the results are saved")
+    parser.add_argument("--compare", nargs=2, metavar=("BEFORE", "AFTER"))
+    args = parser.parse_args()
+
+    if args.compare:
+        with open(args.compare[0]) as before, open(args.compare[1]) as after:
+            compare(json.load(before), json.load(after))
+        return
+
+    for name in args.benchmark:
+        if name not in BENCHMARKS:
+            parser.error(f"unknown benchmark {name!r}")
+    results = run(args.benchmark or BENCHMARKS)
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(results, output, indent=2)
+
+
+if __name__ == "__main__":
+    main()
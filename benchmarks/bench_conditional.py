@@ -0,0 +1,61 @@
+"""PreHook callbacks which apply to one value of an argument: a test in each callback
+compared to a when condition.
+
+Run with: python -m benchmarks.bench_conditional
+"""
+import timeit
+import typing
+
+from yapyhook import Hook, PreHook
+
+UNIT = "µs"
+NUMBER = 20_000
+# number of PreHook callbacks, one per value of the argument
+CALLBACK_COUNTS = (10, 50)
+
+
+def raw(kind: int) -> int:
+    return kind
+
+
+def create_hook(
+    callback_count: int, indexed: bool
+) -> typing.Tuple[typing.Callable, typing.List[typing.Callable]]:
+    """Return the hooked function and the callbacks, which must be kept alive"""
+    name = f"bench_conditional_{'when' if indexed else 'test'}_{callback_count}"
+    f = Hook(name)(raw)
+    callbacks: typing.List[typing.Callable] = []
+    for value in range(callback_count):
+
+        def pre(kind: int, value: int = value) -> None:
+            if kind != value:
+                return
+
+        if indexed:
+            PreHook(name, when={"kind": value})(pre)
+        else:
+            PreHook(name)(pre)
+        callbacks.append(pre)
+    return f, callbacks
+
+
+def run(f: typing.Callable, number: int) -> float:
+    """Return the time in µs of a call"""
+    return timeit.timeit(lambda: f(1), number=number) / number * 1e6
+
+
+def main() -> typing.Dict[str, float]:
+    results = {}
+    for callback_count in CALLBACK_COUNTS:
+        for indexed in (False, True):
+            f, callbacks = create_hook(callback_count, indexed)
+            name = f"{'when' if indexed else 'test'} callbacks={callback_count}"
+            results[name] = run(f, NUMBER)
+            del f, callbacks
+    for name, value in results.items():
+        print(f"{name:<24} {value:>8.3f} µs per call")
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""Call overhead of a hook point compared to a raw call, sync and async, and of a
+frozen hook point compared to a hand-written wrapper.
+
+Run with: python -m benchmarks.bench_dispatch
+"""
+import asyncio
+import time
+import timeit
+import typing
+
+from yapyhook import FilterHook, Hook, PostHook, PreHook
+
+UNIT = "µs"
+NUMBER = 20_000
+# number of callbacks per hook type
+CALLBACK_COUNTS = (0, 1, 10, 100)
+
+
+def raw(x: int) -> int:
+    return x
+
+
+async def raw_async(x: int) -> int:
+    return x
+
+
+def pre(x: int) -> None:
+    pass
+
+
+def filter(result: int, x: int) -> int:
+    return result
+
+
+def post(result: int, x: int) -> None:
+    pass
+
+
+def hand_written(x: int) -> int:
+    """The wrapper calling one callback of each hook type without a hook"""
+    r = pre(x)
+    if r is not None and r[0] is True:
+        result = r[1]
+    else:
+        result = raw(x)
+    result = filter(result, x)
+    post(result, x)
+    return result
+
+
+def create_hook(
+    callback_count: int, is_async: bool, weak: bool = True, frozen: bool = False
+) -> typing.Tuple[typing.Callable, typing.List[typing.Callable]]:
+    """Return the hooked function and the callbacks, which must be kept alive"""
+    name = f"bench_dispatch_{'async' if is_async else 'sync'}_{callback_count}"
+    if not weak:
+        name += "_strong"
+    if frozen:
+        name += "_frozen"
+    f = Hook(name)(raw_async if is_async else raw)
+    callbacks: typing.List[typing.Callable] = []
+    for _ in range(callback_count):
+
+        def pre(x: int) -> None:
+            pass
+
+        def filter(result: int, x: int) -> int:
+            return result
+
+        def post(result: int, x: int) -> None:
+            pass
+
+        PreHook(name, weak=weak)(pre)
+        FilterHook(name, weak=weak)(filter)
+        PostHook(name, weak=weak)(post)
+        callbacks.extend((pre, filter, post))
+    if frozen:
+        Hook.HOOKS[name].freeze()
+    return f, callbacks
+
+
+def run_sync(f: typing.Callable, number: int) -> float:
+    """Return the time in µs of a call"""
+    return timeit.timeit(lambda: f(1), number=number) / number * 1e6
+
+
+def run_async(f: typing.Callable, number: int) -> float:
+    """Return the time in µs of a call, awaited from a coroutine"""
+
+    async def loop() -> float:
+        start = time.perf_counter()
+        for _ in range(number):
+            await f(1)
+        return time.perf_counter() - start
+
+    # asyncio.run needs Python 3.7
+    event_loop = asyncio.new_event_loop()
+    try:
+        return event_loop.run_until_complete(loop()) / number * 1e6
+    finally:
+        event_loop.close()
+
+
+def main() -> typing.Dict[str, float]:
+    results = {
+        "sync raw": run_sync(raw, NUMBER),
+        "async raw": run_async(raw_async, NUMBER),
+    }
+    for is_async in (False, True):
+        run = run_async if is_async else run_sync
+        for callback_count in CALLBACK_COUNTS:
+            f, callbacks = create_hook(callback_count, is_async)
+            # keep the cost of a run roughly constant
+            number = NUMBER // max(1, callback_count // 10)
+            name = f"{'async' if is_async else 'sync'} callbacks={callback_count}"
+            results[name] = run(f, number)
+            del f, callbacks
+    # the callbacks registered with weak=False are read without a weakref call
+    for callback_count in CALLBACK_COUNTS[1:]:
+        f, callbacks = create_hook(callback_count, False, weak=False)
+        number = NUMBER // max(1, callback_count // 10)
+        results[f"sync weak=False callbacks={callback_count}"] = run_sync(f, number)
+        del f, callbacks
+    results["sync hand-written callbacks=1"] = run_sync(hand_written, NUMBER)
+    for callback_count in CALLBACK_COUNTS[1:]:
+        f, callbacks = create_hook(callback_count, False, frozen=True)
+        number = NUMBER // max(1, callback_count // 10)
+        results[f"sync frozen callbacks={callback_count}"] = run_sync(f, number)
+        del f, callbacks
+    for name, value in results.items():
+        print(f"{name:<24} {value:>8.3f} µs per call")
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""Generator results going through nested FilterHook callbacks,
+compared to ItemFilterHook callbacks fused in a single loop.
+
+Run with: python -m benchmarks.bench_filter_generator
+"""
+import timeit
+import typing
+
+from yapyhook import FilterHook, Hook, ItemFilterHook
+
+UNIT = "µs"
+NUMBER = 2_000
+# number of values produced by the hooked generator
+SIZE = 100
+DEPTHS = (0, 1, 5, 20)
+
+
+def values(size: int) -> typing.Iterator[int]:
+    return iter(range(size))
+
+
+def create_hook(
+    depth: int,
+) -> typing.Tuple[typing.Callable, typing.List[typing.Callable]]:
+    """Return the hooked function and the FilterHook callbacks wrapping its result"""
+    name = f"bench_filter_generator_{depth}"
+    f = Hook(name)(values)
+    callbacks = []
+    for _ in range(depth):
+
+        def add_one(x: int, size: int) -> int:
+            return x + 1
+
+        def increment(
+            result: typing.Iterator[int], size: int, add_one: typing.Callable = add_one
+        ) -> typing.Iterator[int]:
+            # one call per item, like ItemFilterHook
+            return (add_one(x, size) for x in result)
+
+        FilterHook(name)(increment)
+        callbacks.append(increment)
+    return f, callbacks
+
+
+def create_item_hook(
+    depth: int,
+) -> typing.Tuple[typing.Callable, typing.List[typing.Callable]]:
+    """Return the hooked function and the ItemFilterHook callbacks"""
+    name = f"bench_filter_generator_items_{depth}"
+    f = Hook(name)(values)
+    callbacks = []
+    for _ in range(depth):
+
+        def increment(x: int, size: int) -> int:
+            return x + 1
+
+        ItemFilterHook(name)(increment)
+        callbacks.append(increment)
+    return f, callbacks
+
+
+def run(f: typing.Callable) -> float:
+    """Return the time in µs to call f and consume the generator"""
+    return timeit.timeit(lambda: sum(f(SIZE)), number=NUMBER) / NUMBER * 1e6
+
+
+def main() -> typing.Dict[str, float]:
+    results = {"raw": run(values)}
+    for depth in DEPTHS:
+        f, callbacks = create_hook(depth)
+        results[f"filters={depth}"] = run(f)
+        del f, callbacks
+    for depth in DEPTHS[1:]:
+        f, callbacks = create_item_hook(depth)
+        results[f"item_filters={depth}"] = run(f)
+        del f, callbacks
+    for name, value in results.items():
+        print(f"{name:<16} {value:>8.2f} µs per call of {SIZE} values")
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""Instantiation cost of a @HookClass class compared to a plain class,
+as the number of live instances grows.
+
+Run with: python -m benchmarks.bench_hookclass
+"""
+import timeit
+import typing
+
+from yapyhook import Hook, HookClass, PostHook, PreHook
+
+UNIT = "µs"
+# number of instances created, all instances are kept alive
+INSTANCE_COUNTS = (100, 1_000, 5_000)
+
+
+@Hook("bench_hookclass")
+def f(x: int) -> int:
+    return x
+
+
+class Plain:
+    def __init__(self, value: int) -> None:
+        self.value = value
+
+    @property
+    def double(self) -> int:
+        return self.value * 2
+
+    def method(self) -> int:
+        return self.value
+
+
+@HookClass
+class NoHook(Plain):
+    pass
+
+
+@HookClass
+class OneHook(Plain):
+    @PreHook("bench_hookclass")
+    def pre(self, x: int) -> None:
+        pass
+
+
+@HookClass
+class TwoHooks(OneHook):
+    @PostHook("bench_hookclass")
+    def post(self, result: int, x: int) -> None:
+        pass
+
+
+def run(cls: type, number: int) -> float:
+    """Return the mean time in µs to create an instance, all instances are kept alive"""
+    instances = []
+
+    def create() -> None:
+        instances.append(cls(1))
+
+    return timeit.timeit(create, number=number) / number * 1e6
+
+
+def main() -> typing.Dict[str, float]:
+    results = {}
+    for cls in (Plain, NoHook, OneHook, TwoHooks):
+        for number in INSTANCE_COUNTS:
+            name = f"{cls.__name__} instances={number}"
+            results[name] = run(cls, number)
+            print(f"{name:<26} {results[name]:>8.2f} µs per instance")
+    return results
+
+
+if __name__ == "__main__":
+    main()
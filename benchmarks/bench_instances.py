@@ -0,0 +1,82 @@
+"""Call cost of a method hooked by the instances of a @HookClass class, as the number
+of live instances grows: callbacks called for all the calls (each callback checks its
+instance) compared to per_instance=True callbacks and to anonymous hooks on instances.
+
+Run with: python -m benchmarks.bench_instances
+"""
+import timeit
+import typing
+
+from yapyhook import FilterHook, Hook, HookClass, PreHook
+
+UNIT = "µs"
+NUMBER = 2_000
+# number of live instances with a callback
+INSTANCE_COUNTS = (100, 1_000, 5_000)
+
+
+@HookClass
+class Broadcast:
+    @Hook("bench_instances_broadcast")
+    def method(self, x: int) -> int:
+        return x
+
+    @PreHook("bench_instances_broadcast")
+    def pre(self, other: "Broadcast", x: int) -> None:
+        if other is not self:
+            return
+
+
+@HookClass
+class PerInstance:
+    @Hook("bench_instances_per_instance")
+    def method(self, x: int) -> int:
+        return x
+
+    @PreHook("bench_instances_per_instance", per_instance=True)
+    def pre(self, x: int) -> None:
+        pass
+
+
+class Anonymous:
+    def method(self, x: int) -> int:
+        return x
+
+
+def create_anonymous() -> typing.Tuple[Anonymous, typing.Callable]:
+    instance = Anonymous()
+
+    @FilterHook(instance, "method")
+    def filter(result: int, x: int) -> int:
+        return result
+
+    return instance, filter
+
+
+def run(instance: typing.Any, number: int) -> float:
+    """Return the time in µs of a call of the method of instance"""
+    return timeit.timeit(lambda: instance.method(1), number=number) / number * 1e6
+
+
+def main() -> typing.Dict[str, float]:
+    results = {}
+    for count in INSTANCE_COUNTS:
+        for name, create in (
+            ("broadcast", Broadcast),
+            ("per_instance", PerInstance),
+            ("anonymous", create_anonymous),
+        ):
+            # the instances and the callbacks are kept alive
+            objects = [create() for _ in range(count)]
+            instance = objects[0][0] if name == "anonymous" else objects[0]
+            # a broadcast call costs a callback call per instance
+            number = NUMBER * 100 // count if name == "broadcast" else NUMBER
+            results[f"{name} instances={count}"] = run(instance, number)
+            del objects, instance
+    for name, value in results.items():
+        print(f"{name:<28} {value:>8.3f} µs per call")
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""Throughput of register/unregister on a hook point with registered callbacks, and
+cost of registering many callbacks one at a time or in a Hook.transaction().
+
+Run with: python -m benchmarks.bench_registration
+"""
+import contextlib
+import timeit
+import typing
+
+from yapyhook import Hook, PreHook
+
+UNIT = "µs"
+NUMBER = 2_000
+# number of callbacks already registered
+REGISTERED_COUNTS = (0, 10, 100, 1_000)
+# number of callbacks registered at once
+BULK_COUNT = 50
+BULK_NUMBER = 20
+
+
+def callback(x: int) -> None:
+    pass
+
+
+def run(registered_count: int) -> float:
+    """Return the time in µs to register then unregister a callback"""
+    name = f"bench_registration_{registered_count}"
+
+    @Hook(name)
+    def f(x: int) -> int:
+        return x
+
+    registered = []
+    for _ in range(registered_count):
+
+        def pre(x: int) -> None:
+            pass
+
+        PreHook(name)(pre)
+        registered.append(pre)
+
+    def register_unregister() -> None:
+        def transient(x: int) -> None:
+            pass
+
+        PreHook(name)(transient)
+        Hook.unregister(transient)
+
+    return timeit.timeit(register_unregister, number=NUMBER) / NUMBER * 1e6
+
+
+def run_bulk(transaction: bool) -> float:
+    """Return the time in µs to register BULK_COUNT callbacks then unregister them"""
+    name = f"bench_registration_bulk_{transaction}"
+
+    @Hook(name)
+    def f(x: int) -> int:
+        return x
+
+    def register_unregister() -> None:
+        callbacks = []
+        for _ in range(BULK_COUNT):
+
+            def pre(x: int) -> None:
+                pass
+
+            callbacks.append(pre)
+        with Hook.transaction() if transaction else contextlib.ExitStack():
+            for pre in callbacks:
+                PreHook(name)(pre)
+        with Hook.transaction() if transaction else contextlib.ExitStack():
+            for pre in callbacks:
+                Hook.unregister(pre)
+
+    return timeit.timeit(register_unregister, number=BULK_NUMBER) / BULK_NUMBER * 1e6
+
+
+def main() -> typing.Dict[str, float]:
+    results = {}
+    for registered_count in REGISTERED_COUNTS:
+        name = f"registered={registered_count}"
+        results[name] = run(registered_count)
+        print(f"{name:<16} {results[name]:>8.2f} µs per register and unregister")
+    for transaction in (False, True):
+        name = f"bulk={BULK_COUNT} transaction={transaction}"
+        results[name] = run_bulk(transaction)
+        print(f"{name:<16} {results[name]:>8.2f} µs per bulk register and unregister")
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""Cost of a request which needs its own callback: a callback registered and
+unregistered on the hook, compared to a callback registered in a Hook.scope(), and
+the call cost out of the scopes while a scope of another thread has a callback.
+
+Run with: python -m benchmarks.bench_scope
+"""
+import sys
+import threading
+import timeit
+import typing
+
+from yapyhook import FilterHook, Hook
+
+UNIT = "µs"
+NUMBER = 20_000
+# calls of the hooked function per request
+CALLS = 10
+
+
+@Hook("bench_scope")
+def function(x: int) -> int:
+    return x
+
+
+@FilterHook("bench_scope")
+def shared(result: int, x: int) -> int:
+    return result
+
+
+def global_request() -> None:
+    @FilterHook("bench_scope")
+    def filter(result: int, x: int) -> int:
+        return result
+
+    for i in range(CALLS):
+        function(i)
+    Hook.unregister(filter)
+
+
+def scope_request() -> None:
+    with Hook.scope():
+
+        @FilterHook("bench_scope")
+        def filter(result: int, x: int) -> int:
+            return result
+
+        for i in range(CALLS):
+            function(i)
+
+
+def run(f: typing.Callable[[], typing.Any], number: int) -> float:
+    """Return the time in µs of a call of f"""
+    return timeit.timeit(f, number=number) / number * 1e6
+
+
+def main() -> typing.Dict[str, float]:
+    if sys.version_info < (3, 7):
+        print("skipped: Hook.scope() requires Python 3.7")
+        return {}
+    results = {
+        "request global": run(global_request, NUMBER),
+        "request scope": run(scope_request, NUMBER),
+        "call": run(lambda: function(1), NUMBER * 10),
+    }
+    # a scope of another thread has a callback until stop is set
+    started, stop = threading.Event(), threading.Event()
+
+    def other_request() -> None:
+        with Hook.scope():
+
+            @FilterHook("bench_scope")
+            def filter(result: int, x: int) -> int:
+                return result
+
+            started.set()
+            stop.wait()
+
+    thread = threading.Thread(target=other_request)
+    thread.start()
+    started.wait()
+    results["call, scope in another thread"] = run(lambda: function(1), NUMBER * 10)
+    stop.set()
+    thread.join()
+    for name, value in results.items():
+        print(f"{name:<32} {value:>8.3f} µs per call")
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""Call throughput of a hook point from several threads.
+
+Run with: python -m benchmarks.bench_threading
+"""
+import sys
+import threading
+import time
+import typing
+
+from yapyhook import Hook, PostHook, PreHook
+
+UNIT = "calls/s"
+CALLS_PER_THREAD = 100_000
+
+
+@Hook("bench_threading")
+def f(x: int) -> int:
+    return x
+
+
+@PreHook("bench_threading")
+def pre(x: int) -> None:
+    pass
+
+
+@PostHook("bench_threading")
+def post(result: int, x: int) -> None:
+    pass
+
+
+def run(thread_count: int, with_writer: bool) -> float:
+    """Return the number of calls per second for all the threads"""
+    stop = threading.Event()
+
+    def caller() -> None:
+        for i in range(CALLS_PER_THREAD):
+            f(i)
+
+    def writer() -> None:
+        while not stop.is_set():
+
+            @PreHook("bench_threading")
+            def transient(x: int) -> None:
+                pass
+
+            Hook.unregister(transient)
+
+    threads = [threading.Thread(target=caller) for _ in range(thread_count)]
+    writer_thread = threading.Thread(target=writer) if with_writer else None
+    if writer_thread:
+        writer_thread.start()
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    duration = time.perf_counter() - start
+    stop.set()
+    if writer_thread:
+        writer_thread.join()
+    return thread_count * CALLS_PER_THREAD / duration
+
+
+def main() -> typing.Dict[str, float]:
+    gil = "enabled" if getattr(sys, "_is_gil_enabled", lambda: True)() else "disabled"
+    print(f"Python {sys.version.split()[0]}, GIL {gil}")
+    results = {}
+    for with_writer in (False, True):
+        for thread_count in (1, 2, 4, 8):
+            name = f"threads={thread_count} writer={with_writer}"
+            results[name] = run(thread_count, with_writer)
+            print(f"{name:<28} {results[name]:>14,.0f} calls/s")
+    return results
+
+
+if __name__ == "__main__":
+    main()
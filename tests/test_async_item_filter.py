@@ -0,0 +1,147 @@
+import asyncio
+import typing
+
+import pytest
+
+from yapyhook import Hook, ItemFilterHook
+
+
+@pytest.mark.asyncio
+async def test_ordered():
+    @Hook("test_async_item_filter_ordered")
+    async def f(n):
+        for i in range(n):
+            yield i
+
+    @ItemFilterHook("test_async_item_filter_ordered", concurrency=4)
+    async def double(item, n):
+        # the first items are the slowest ones
+        await asyncio.sleep(0.001 * (n - item))
+        return item * 2
+
+    @ItemFilterHook("test_async_item_filter_ordered", drop=True)
+    def drop_zero(item, n):
+        return item == 0
+
+    assert [item async for item in f(6)] == [2, 4, 6, 8, 10]
+
+
+@pytest.mark.asyncio
+async def test_unordered():
+    @Hook("test_async_item_filter_unordered")
+    async def f(delays):
+        return delays
+
+    @ItemFilterHook("test_async_item_filter_unordered", concurrency=3, ordered=False)
+    async def wait(item, delays):
+        await asyncio.sleep(item)
+        return item
+
+    @ItemFilterHook("test_async_item_filter_unordered", drop=True, concurrency=3)
+    async def drop_zero(item, delays):
+        return item == 0
+
+    # the list becomes an async iterator
+    result = await f([0.03, 0.01, 0.02, 0])
+    assert not isinstance(result, list)
+    assert [item async for item in result] == [0.01, 0.02, 0.03]
+
+
+@pytest.mark.asyncio
+async def test_concurrency():
+    in_flight: typing.List = []
+    max_in_flight = 0
+    reads = 0
+
+    @Hook("test_async_item_filter_concurrency")
+    async def f(n):
+        nonlocal reads
+        for i in range(n):
+            reads += 1
+            yield i
+
+    @ItemFilterHook("test_async_item_filter_concurrency", concurrency=3)
+    async def transform(item, n):
+        nonlocal max_in_flight
+        in_flight.append(item)
+        max_in_flight = max(max_in_flight, len(in_flight))
+        await asyncio.sleep(0.001)
+        in_flight.remove(item)
+        return item
+
+    result = f(10)
+    assert await result.__anext__() == 0
+    # a slow consumer: the source is read only up to the items in flight
+    await asyncio.sleep(0.01)
+    assert reads == 3
+    assert [item async for item in result] == list(range(1, 10))
+    assert max_in_flight == 3
+
+
+@pytest.mark.asyncio
+async def test_cancel():
+    started: typing.List = []
+    cancelled: typing.List = []
+    closed = False
+
+    @Hook("test_async_item_filter_cancel")
+    async def f():
+        nonlocal closed
+        try:
+            for i in range(100):
+                yield i
+        finally:
+            closed = True
+
+    @ItemFilterHook("test_async_item_filter_cancel", concurrency=4)
+    async def transform(item):
+        started.append(item)
+        try:
+            await asyncio.sleep(0 if item == 0 else 1)
+        except asyncio.CancelledError:
+            cancelled.append(item)
+            raise
+        return item
+
+    result = f()
+    assert await result.__anext__() == 0
+    await result.aclose()
+    assert started == [0, 1, 2, 3]
+    assert cancelled == [1, 2, 3]
+    assert closed
+
+
+@pytest.mark.asyncio
+async def test_error():
+    @Hook("test_async_item_filter_error")
+    async def f():
+        return range(5)
+
+    @ItemFilterHook("test_async_item_filter_error", concurrency=2)
+    async def transform(item):
+        if item == 2:
+            raise KeyError(item)
+        return item
+
+    result = await f()
+    assert [await result.__anext__(), await result.__anext__()] == [0, 1]
+    with pytest.raises(KeyError):
+        await result.__anext__()
+
+
+def test_invalid():
+    with pytest.raises(ValueError):
+        ItemFilterHook("test_async_item_filter_invalid", concurrency=0)
+
+    @Hook("test_async_item_filter_invalid")
+    def f(n):
+        return list(range(n))
+
+    # a sync function can't return an async iterator
+    with pytest.raises(ValueError):
+
+        @ItemFilterHook("test_async_item_filter_invalid")
+        async def transform(item, n):
+            return item
+
+    assert list(f(3)) == [0, 1, 2]
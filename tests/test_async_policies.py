@@ -0,0 +1,140 @@
+import asyncio
+import time
+import typing
+
+import pytest
+
+from yapyhook import DispatchPolicy, Hook, PostHook, PreHook
+
+
+@pytest.mark.asyncio
+async def test_concurrent_postcall():
+    called: typing.List[int] = []
+
+    @Hook("test_concurrent_postcall", postcall_policy=DispatchPolicy.CONCURRENT)
+    async def f(x):
+        return x
+
+    def make_post(i):
+        async def post(result, x):
+            await asyncio.sleep(0.1)
+            called.append(i)
+
+        return PostHook("test_concurrent_postcall")(post)
+
+    posts = [make_post(i) for i in range(5)]
+
+    start = time.perf_counter()
+    assert await f(1) == 1
+    assert time.perf_counter() - start < 0.3
+    assert sorted(called) == [0, 1, 2, 3, 4]
+    del posts
+
+
+@pytest.mark.asyncio
+async def test_concurrent_postcall_exception():
+    called: typing.List[str] = []
+
+    @Hook("test_concurrent_postcall_exc", postcall_policy=DispatchPolicy.CONCURRENT)
+    async def f(x):
+        return x
+
+    @PostHook("test_concurrent_postcall_exc")
+    async def first(result, x):
+        await asyncio.sleep(0.05)
+        raise KeyError("first")
+
+    @PostHook("test_concurrent_postcall_exc")
+    async def second(result, x):
+        raise ValueError("second")
+
+    @PostHook("test_concurrent_postcall_exc")
+    async def third(result, x):
+        await asyncio.sleep(0.1)
+        called.append("third")
+
+    # all the callbacks complete, the first exception of the chain is raised
+    with pytest.raises(KeyError):
+        await f(1)
+    assert called == ["third"]
+
+
+@pytest.mark.asyncio
+async def test_background_postcall():
+    called: typing.List[int] = []
+    errors: typing.List[typing.Dict] = []
+    asyncio.get_event_loop().set_exception_handler(lambda loop, c: errors.append(c))
+
+    @Hook("test_background_postcall", postcall_policy=DispatchPolicy.BACKGROUND)
+    async def f(x):
+        return x
+
+    @PostHook("test_background_postcall")
+    async def post(result, x):
+        await asyncio.sleep(0.05)
+        called.append(x)
+
+    @PostHook("test_background_postcall")
+    async def failing(result, x):
+        raise ValueError(x)
+
+    assert await f(1) == 1
+    assert called == []
+
+    hook = Hook.HOOKS["test_background_postcall"]
+    await hook.wait_background_tasks()
+    assert called == [1]
+    assert hook.background_tasks == set()
+    assert len(errors) == 1
+    assert isinstance(errors[0]["exception"], ValueError)
+
+    asyncio.get_event_loop().set_exception_handler(None)
+
+
+@pytest.mark.asyncio
+async def test_concurrent_precall():
+    cancelled = False
+
+    @Hook("test_concurrent_precall", precall_policy=DispatchPolicy.CONCURRENT)
+    async def f(x):
+        return x
+
+    @PreHook("test_concurrent_precall")
+    async def slow(x):
+        nonlocal cancelled
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled = True
+            raise
+
+    @PreHook("test_concurrent_precall")
+    async def nothing(x):
+        return None
+
+    @PreHook("test_concurrent_precall")
+    async def fast(x):
+        await asyncio.sleep(0.01)
+        if x < 0:
+            return (True, 0)
+
+    start = time.perf_counter()
+    assert await f(-1) == 0
+    assert time.perf_counter() - start < 1
+    assert cancelled is True
+
+    del slow
+    assert await f(2) == 2
+
+
+def test_policy_errors():
+    with pytest.raises(ValueError):
+        Hook("test_policy_errors", precall_policy=DispatchPolicy.BACKGROUND)
+
+    hook = Hook("test_policy_errors_sync", postcall_policy=DispatchPolicy.CONCURRENT)
+
+    def f(x):
+        return x
+
+    with pytest.raises(ValueError):
+        hook(f)
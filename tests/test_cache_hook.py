@@ -0,0 +1,287 @@
+import asyncio
+import threading
+import time
+import typing
+
+import pytest
+
+from yapyhook import CacheHook, DispatchPolicy, FilterHook, Hook, HookType, PreHook
+
+
+def test_hit_miss():
+    calls: typing.List = []
+
+    @Hook("test_cache_hook_hit_miss")
+    def f(x, y=0):
+        calls.append((x, y))
+        return x + y
+
+    @FilterHook("test_cache_hook_hit_miss")
+    def double(result, x, y=0):
+        return result * 2
+
+    cache = CacheHook("test_cache_hook_hit_miss")
+    assert f(1) == 2
+    assert f(1) == 2
+    assert f(1, y=1) == 4
+    assert f(1, y=1) == 4
+    # the cache stores the result before filtering
+    assert calls == [(1, 0), (1, 1)]
+    assert cache.stats() == {
+        "size": 2,
+        "hits": 2,
+        "misses": 2,
+        "evictions": 0,
+        "expirations": 0,
+    }
+
+    cache.unregister()
+    assert Hook.HOOKS["test_cache_hook_hit_miss"][HookType.PRECALL] == []
+    assert f(1) == 2
+    assert len(calls) == 3
+
+
+def test_lru():
+    calls: typing.List = []
+
+    @Hook("test_cache_hook_lru")
+    def f(x):
+        calls.append(x)
+        return x
+
+    cache = CacheHook("test_cache_hook_lru", maxsize=2)
+    f(1)
+    f(2)
+    f(1)
+    f(3)  # evicts 2
+    f(1)
+    f(2)
+    assert calls == [1, 2, 3, 2]
+    assert cache.stats()["evictions"] == 2
+
+
+def test_ttl(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr("yapyhook.time.monotonic", lambda: now[0])
+    calls: typing.List = []
+
+    @Hook("test_cache_hook_ttl")
+    def f(x):
+        calls.append(x)
+        return x
+
+    cache = CacheHook("test_cache_hook_ttl", ttl=10)
+    f(1)
+    now[0] = 9.0
+    f(1)
+    now[0] = 10.0
+    f(1)
+    assert calls == [1, 1]
+    assert cache.stats()["expirations"] == 1
+
+
+def test_invalidate():
+    calls: typing.List = []
+
+    @Hook("test_cache_hook_invalidate")
+    def f(x):
+        calls.append(x)
+        return x
+
+    cache = CacheHook("test_cache_hook_invalidate", key=lambda x: x)
+    for x in range(4):
+        f(x)
+    assert cache.invalidate(0) is True
+    assert cache.invalidate(0) is False
+    assert cache.invalidate_if(lambda key, value: value % 2 == 1) == 2
+    for x in range(4):
+        f(x)
+    assert calls == [0, 1, 2, 3, 0, 1, 3]
+
+    cache.clear()
+    assert cache.stats()["size"] == 0
+
+
+def test_exception():
+    calls: typing.List = []
+
+    @Hook("test_cache_hook_exception")
+    def f(x):
+        calls.append(x)
+        if len(calls) == 1:
+            raise RuntimeError()
+        return x
+
+    cache = CacheHook("test_cache_hook_exception")
+    with pytest.raises(RuntimeError):
+        f(1)
+    assert f(1) == 1
+    assert f(1) == 1
+    assert calls == [1, 1]
+    assert cache.pending == {}
+
+
+def test_concurrent_threads():
+    calls: typing.List = []
+    started = threading.Event()
+    release = threading.Event()
+
+    @Hook("test_cache_hook_concurrent_threads")
+    def f(x):
+        calls.append(x)
+        started.set()
+        release.wait()
+        return x * 10
+
+    cache = CacheHook("test_cache_hook_concurrent_threads")
+    results: typing.List = []
+    threads = [threading.Thread(target=lambda: results.append(f(1))) for _ in range(4)]
+    threads[0].start()
+    started.wait()
+    for thread in threads[1:]:
+        thread.start()
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert calls == [1]
+    assert results == [10] * 4
+    assert cache.stats()["misses"] == 1
+
+
+@pytest.mark.asyncio
+async def test_concurrent_tasks():
+    calls: typing.List = []
+
+    @Hook("test_cache_hook_concurrent_tasks")
+    async def f(x):
+        calls.append(x)
+        await asyncio.sleep(0.01)
+        return x * 10
+
+    cache = CacheHook("test_cache_hook_concurrent_tasks")
+    assert await asyncio.gather(f(1), f(1), f(2), f(1)) == [10, 10, 20, 10]
+    assert await f(2) == 20
+    # the order of the tasks of gather is not specified on Python 3.6
+    assert sorted(calls) == [1, 2]
+    assert cache.stats()["hits"] == 3
+
+
+def test_unhashable():
+    calls: typing.List = []
+
+    @Hook("test_cache_hook_unhashable")
+    def f(x):
+        calls.append(x)
+        return len(x)
+
+    @FilterHook("test_cache_hook_unhashable")
+    def double(result, x):
+        return result * 2
+
+    cache = CacheHook("test_cache_hook_unhashable")
+    # unhashable arguments run uncached, through the other callbacks
+    assert f([1, 2]) == 4
+    assert f([1, 2]) == 4
+    assert f((1, 2)) == 4
+    assert f((1, 2)) == 4
+    assert calls == [[1, 2], [1, 2], (1, 2)]
+    assert cache.stats() == {
+        "size": 1,
+        "hits": 1,
+        "misses": 3,
+        "evictions": 0,
+        "expirations": 0,
+    }
+
+
+@pytest.mark.asyncio
+async def test_unhashable_async():
+    @Hook("test_cache_hook_unhashable_async")
+    async def f(x):
+        return len(x)
+
+    cache = CacheHook("test_cache_hook_unhashable_async")
+    assert await f({1: 2}) == 1
+    assert await f({1: 2}) == 1
+    assert cache.stats()["misses"] == 2
+    assert cache.stats()["size"] == 0
+
+
+def test_concurrent_event_loops():
+    calls: typing.List = []
+    started = threading.Event()
+    release = threading.Event()
+
+    @Hook("test_cache_hook_concurrent_event_loops")
+    async def f(x):
+        calls.append(x)
+        started.set()
+        # blocks the event loop of the first thread only
+        release.wait()
+        return x * 10
+
+    cache = CacheHook("test_cache_hook_concurrent_event_loops")
+    results: typing.List = []
+
+    def run():
+        loop = asyncio.new_event_loop()
+        try:
+            results.append(loop.run_until_complete(f(1)))
+        finally:
+            loop.close()
+
+    threads = [threading.Thread(target=run, daemon=True) for _ in range(2)]
+    threads[0].start()
+    started.wait()
+    threads[1].start()
+    # the second thread waits for the result of the first one
+    time.sleep(0.05)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+        assert not thread.is_alive()
+
+    assert calls == [1]
+    assert results == [10, 10]
+    assert cache.stats()["misses"] == 1
+
+
+def test_runs_last():
+    @Hook("test_cache_hook_runs_last")
+    def f(x):
+        return x * 10
+
+    cache = CacheHook("test_cache_hook_runs_last")
+
+    @PreHook("test_cache_hook_runs_last", priority=10)
+    def deny(x):
+        if x < 0:
+            return (True, None)
+
+    # on a miss and on a hit
+    assert f(-1) is None
+    assert f(1) == 10
+    assert f(1) == 10
+    assert f(-1) is None
+    assert cache.stats()["size"] == 1
+    assert Hook.HOOKS["test_cache_hook_runs_last"][HookType.PRECALL][0] == deny
+
+
+def test_hook_without_function():
+    hook = Hook("test_cache_hook_without_function")
+    with pytest.raises(ValueError):
+        CacheHook("test_cache_hook_without_function")
+    with pytest.raises(ValueError):
+        CacheHook("test_cache_hook_unknown")
+
+    @Hook(
+        "test_cache_hook_concurrent_policy",
+        precall_policy=DispatchPolicy.CONCURRENT,
+    )
+    async def f(x):
+        return x
+
+    with pytest.raises(ValueError):
+        CacheHook("test_cache_hook_concurrent_policy")
+    del hook
@@ -0,0 +1,111 @@
+import typing
+
+import pytest
+
+from yapyhook import FilterHook, Hook, PostHook, PreHook
+
+
+def test_call_many():
+    calls: typing.List = []
+
+    @Hook("test_call_many")
+    def f(x, y=1):
+        return x * y
+
+    assert Hook.HOOKS["test_call_many"].call_many([(1,), (2,), (3,)]) == [1, 2, 3]
+
+    @PreHook("test_call_many")
+    def pre(x, y=1):
+        calls.append(("pre", x))
+        if x == 2:
+            return (True, -2)
+
+    @FilterHook("test_call_many")
+    def filter(result, x, y=1):
+        return result + 1
+
+    @PostHook("test_call_many")
+    def post(result, x, y=1):
+        calls.append(("post", x, result))
+
+    hook = Hook.HOOKS["test_call_many"]
+    assert hook.call_many([(1,), (2,), (3,)], y=10) == [11, -1, 31]
+    assert calls == [
+        ("pre", 1),
+        ("pre", 2),
+        ("pre", 3),
+        ("post", 1, 11),
+        ("post", 2, -1),
+        ("post", 3, 31),
+    ]
+
+
+def test_call_many_batch_callbacks():
+    calls: typing.List = []
+
+    @Hook("test_call_many_batch_callbacks")
+    def f(x):
+        return x
+
+    @PreHook("test_call_many_batch_callbacks", batch=True)
+    def pre(args_list):
+        calls.append(("pre", args_list))
+        return [(True, 0) if args == (0,) else None for args in args_list]
+
+    @FilterHook("test_call_many_batch_callbacks", batch=True)
+    def filter(results, args_list):
+        calls.append(("filter", list(results)))
+        return [r * 10 for r in results]
+
+    @PostHook("test_call_many_batch_callbacks", batch=True)
+    def post(results, args_list):
+        calls.append(("post", results, args_list))
+
+    hook = Hook.HOOKS["test_call_many_batch_callbacks"]
+    assert hook.call_many([(0,), (1,), (2,)]) == [0, 10, 20]
+    assert calls == [
+        ("pre", [(0,), (1,), (2,)]),
+        ("filter", [0, 1, 2]),
+        ("post", [0, 10, 20], [(0,), (1,), (2,)]),
+    ]
+
+    # a single call gives a batch of one call to the batch callbacks
+    calls.clear()
+    assert f(3) == 30
+    assert f(0) == 0
+    assert calls == [
+        ("pre", [(3,)]),
+        ("filter", [3]),
+        ("post", [30], [(3,)]),
+        ("pre", [(0,)]),
+        ("filter", [0]),
+        ("post", [0], [(0,)]),
+    ]
+
+
+def test_call_many_mixed_callbacks():
+    @Hook("test_call_many_mixed_callbacks")
+    def f(x):
+        return x
+
+    @FilterHook("test_call_many_mixed_callbacks", batch=True)
+    def to_tuple(results, args_list):
+        return tuple(results)
+
+    @FilterHook("test_call_many_mixed_callbacks")
+    def add_one(result, x):
+        return result + 1
+
+    hook = Hook.HOOKS["test_call_many_mixed_callbacks"]
+    assert hook.call_many([(1,), (2,)]) == [2, 3]
+    assert f(1) == 2
+
+
+@pytest.mark.asyncio
+async def test_call_many_async():
+    @Hook("test_call_many_async")
+    async def f(x):
+        return x
+
+    with pytest.raises(ValueError):
+        Hook.HOOKS["test_call_many_async"].call_many([(1,)])
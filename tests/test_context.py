@@ -0,0 +1,135 @@
+import asyncio
+import typing
+
+import pytest
+
+from yapyhook import (
+    DISPATCH_UNROLL_LIMIT,
+    CallContext,
+    DispatchPolicy,
+    FilterHook,
+    Hook,
+    PostHook,
+    PreHook,
+)
+
+
+@pytest.mark.parametrize("count", [1, DISPATCH_UNROLL_LIMIT + 1])
+def test_context(count):
+    name = f"test_context_{count}"
+    contexts: typing.List[CallContext] = []
+
+    @Hook(name)
+    def f(x, y=1):
+        return x * y
+
+    @PreHook(name, context=True)
+    def start(ctx):
+        ctx.scratch["start"] = ctx.args
+        contexts.append(ctx)
+
+    @FilterHook(name, context=True)
+    def increment(ctx):
+        return ctx.result + 1
+
+    # callbacks with the default calling convention
+    @FilterHook(name)
+    def double(result, x, y=1):
+        return result * 2
+
+    def make_post(i):
+        def post(ctx):
+            contexts.append(ctx)
+
+        return PostHook(name, context=True)(post)
+
+    posts = [make_post(i) for i in range(count)]
+
+    assert f(3, y=2) == 14
+    ctx = contexts[0]
+    # a single CallContext for the call
+    assert contexts == [ctx] * (count + 1)
+    assert (ctx.args, ctx.kwargs) == ((3,), {"y": 2})
+    assert ctx.result == 14
+    assert ctx.scratch == {"start": (3,)}
+
+    contexts.clear()
+    assert f(3) == 8
+    assert contexts[0] is not ctx
+    del posts
+
+
+def test_short_circuit():
+    @Hook("test_context_short_circuit")
+    def f(x):
+        return x
+
+    @PreHook("test_context_short_circuit", context=True)
+    def stop(ctx):
+        return (True, -ctx.args[0])
+
+    @FilterHook("test_context_short_circuit", context=True)
+    def increment(ctx):
+        return ctx.result + 1
+
+    assert f(3) == -2
+
+
+def test_call_many():
+    results: typing.List = []
+
+    @Hook("test_context_call_many")
+    def f(x):
+        return x
+
+    @PreHook("test_context_call_many", context=True)
+    def pre(ctx):
+        if ctx.args[0] == 0:
+            return (True, -1)
+        ctx.scratch["pre"] = True
+
+    @FilterHook("test_context_call_many", context=True)
+    def increment(ctx):
+        return ctx.result + 1
+
+    @PostHook("test_context_call_many", context=True)
+    def post(ctx):
+        results.append((ctx.result, ctx.scratch))
+
+    hook = Hook.HOOKS["test_context_call_many"]
+    assert hook.call_many([(0,), (1,), (2,)]) == [0, 2, 3]
+    assert results == [(0, {}), (2, {"pre": True}), (3, {"pre": True})]
+
+
+@pytest.mark.asyncio
+async def test_async():
+    results: typing.List = []
+
+    @Hook(
+        "test_context_async",
+        precall_policy=DispatchPolicy.CONCURRENT,
+        postcall_policy=DispatchPolicy.CONCURRENT,
+    )
+    async def f(x):
+        return x
+
+    @PreHook("test_context_async", context=True)
+    async def pre(ctx):
+        await asyncio.sleep(0)
+        ctx.scratch["pre"] = ctx.args
+
+    @FilterHook("test_context_async", context=True)
+    async def increment(ctx):
+        return ctx.result + 1
+
+    @PostHook("test_context_async", context=True)
+    async def post(ctx):
+        results.append((ctx.result, ctx.scratch))
+
+    assert await f(1) == 2
+    assert results == [(2, {"pre": (1,)})]
+
+
+def test_invalid():
+    with pytest.raises(ValueError):
+        PreHook("test_context_invalid", batch=True, context=True)
@@ -0,0 +1,106 @@
+import gc
+import weakref
+
+from yapyhook import Hook, HookClass, HookType, PostHook, PreHook
+
+
+def test_removed_on_delete():
+    @Hook("test_removed_on_delete")
+    def f():
+        return True
+
+    @PreHook("test_removed_on_delete")
+    def pre():
+        pass
+
+    hook = Hook.HOOKS["test_removed_on_delete"]
+    assert len(hook.hook_types[HookType.PRECALL]) == 1
+
+    del pre
+    # the dead callbacks are swept on the next call
+    assert f() is True
+    assert hook.hook_types[HookType.PRECALL] == ()
+
+
+def test_register_plain_weakref():
+    @Hook("test_register_plain_weakref")
+    def f():
+        return True
+
+    def post(result):
+        pass
+
+    hook = Hook.HOOKS["test_register_plain_weakref"]
+    hook.register(HookType.POSTCALL, weakref.ref(post))
+    assert hook[HookType.POSTCALL] == [post]
+
+    del post
+    assert f() is True
+    assert hook.hook_types[HookType.POSTCALL] == ()
+
+
+def test_batched_removal_during_gc():
+    @Hook("test_batched_removal_during_gc")
+    def f():
+        return True
+
+    @HookClass
+    class Intercept:
+        def __init__(self):
+            # reference cycle: only the garbage collector can free the instance
+            self.cycle = self
+
+        @PostHook("test_batched_removal_during_gc")
+        def post(self, result):
+            pass
+
+    gc.collect()
+    hook = Hook.HOOKS["test_batched_removal_during_gc"]
+    instances = [Intercept() for _ in range(50)]
+    assert len(hook[HookType.POSTCALL]) == 50
+
+    version = hook.version
+    del instances
+    assert len(hook[HookType.POSTCALL]) == 50
+    gc.collect()
+
+    assert f() is True
+    assert hook.hook_types[HookType.POSTCALL] == ()
+    # a single snapshot has been published for all the instances
+    assert hook.version == version + 1
+
+
+def test_batched_removal_by_refcount():
+    @Hook("test_batched_removal_by_refcount")
+    def f():
+        return True
+
+    @HookClass
+    class Intercept:
+        @PostHook("test_batched_removal_by_refcount")
+        def post(self, result):
+            pass
+
+    hook = Hook.HOOKS["test_batched_removal_by_refcount"]
+    instances = [Intercept() for _ in range(1000)]
+    assert len(hook[HookType.POSTCALL]) == 1000
+
+    version = hook.version
+    # the instances die one by one, without garbage collection
+    del instances
+    assert hook.version == version
+
+    assert f() is True
+    assert hook.hook_types[HookType.POSTCALL] == ()
+    assert hook.version == version + 1
+
+    # a publish also sweeps the dead callbacks
+    instances = [Intercept() for _ in range(2)]
+    assert f() is True
+    del instances[0]
+
+    @PostHook("test_batched_removal_by_refcount")
+    def post(result):
+        pass
+
+    assert len(hook.hook_types[HookType.POSTCALL]) == 2
@@ -0,0 +1,145 @@
+import threading
+import typing
+
+import pytest
+
+from yapyhook import (
+    Backpressure,
+    CallHook,
+    DeferredExecutor,
+    Hook,
+    HookType,
+    PostHook,
+)
+
+
+def test_deferred_posthook():
+    started = threading.Event()
+    release = threading.Event()
+    threads: typing.List[threading.Thread] = []
+
+    @Hook("test_deferred_posthook")
+    def f(x):
+        return x * 2
+
+    @PostHook("test_deferred_posthook", deferred=True)
+    def post(result, x):
+        threads.append(threading.current_thread())
+        started.set()
+        release.wait()
+
+    # the caller doesn't wait for the deferred callback
+    assert f(3) == 6
+    assert started.wait(5)
+    assert threads[0] is not threading.current_thread()
+
+    release.set()
+    assert Hook.DEFERRED_EXECUTOR.flush(5) is True
+    assert Hook.DEFERRED_EXECUTOR.stats()["queued"] == 0
+
+
+def make_blocked_executor(backpressure):
+    release = threading.Event()
+    done: typing.List[int] = []
+    executor = DeferredExecutor(
+        max_workers=1, max_queue_size=2, backpressure=backpressure
+    )
+    started = threading.Event()
+
+    def block():
+        started.set()
+        release.wait()
+
+    executor.submit(block, (), {})
+    assert started.wait(5)
+    return executor, release, done
+
+
+def test_drop_newest():
+    executor, release, done = make_blocked_executor(Backpressure.DROP_NEWEST)
+    assert executor.submit(done.append, (1,), {}) is True
+    assert executor.submit(done.append, (2,), {}) is True
+    assert executor.submit(done.append, (3,), {}) is False
+    release.set()
+    assert executor.flush(5) is True
+    assert done == [1, 2]
+    assert executor.stats()["dropped"] == 1
+    executor.shutdown()
+
+
+def test_drop_oldest():
+    executor, release, done = make_blocked_executor(Backpressure.DROP_OLDEST)
+    executor.submit(done.append, (1,), {})
+    executor.submit(done.append, (2,), {})
+    assert executor.submit(done.append, (3,), {}) is False
+    release.set()
+    assert executor.flush(5) is True
+    assert done == [2, 3]
+    assert executor.stats()["dropped"] == 1
+    executor.shutdown()
+
+
+def test_block():
+    executor, release, done = make_blocked_executor(Backpressure.BLOCK)
+    executor.submit(done.append, (1,), {})
+    executor.submit(done.append, (2,), {})
+    submitter = threading.Thread(target=executor.submit, args=(done.append, (3,), {}))
+    submitter.start()
+    submitter.join(0.1)
+    assert submitter.is_alive()
+    release.set()
+    submitter.join(5)
+    assert executor.flush(5) is True
+    assert done == [1, 2, 3]
+    assert executor.stats()["dropped"] == 0
+    executor.shutdown()
+    assert executor.threads == []
+
+
+def test_failed():
+    executor = DeferredExecutor()
+
+    def fail():
+        raise ValueError()
+
+    executor.submit(fail, (), {})
+    assert executor.flush(5) is True
+    assert executor.stats()["failed"] == 1
+    executor.shutdown()
+
+
+def test_shutdown_no_wait():
+    executor, release, done = make_blocked_executor(Backpressure.BLOCK)
+    executor.submit(done.append, (1,), {})
+    threads = list(executor.threads)
+    executor.shutdown(wait=False)
+    # the queued calls are completed, then the worker threads exit
+    release.set()
+    for thread in threads:
+        thread.join(5)
+        assert not thread.is_alive()
+    assert executor.threads == []
+    assert done == [1]
+
+    # started again by the next submit
+    executor.submit(done.append, (2,), {})
+    assert executor.flush(5) is True
+    assert done == [1, 2]
+    assert len(executor.threads) == 1
+    executor.shutdown()
+    assert executor.threads == []
+
+
+def test_deferred_errors():
+    @Hook("test_deferred_errors")
+    async def f():
+        return True
+
+    with pytest.raises(ValueError):
+        CallHook(HookType.PRECALL, "test_deferred_errors", deferred=True)
+
+    with pytest.raises(ValueError):
+
+        @PostHook("test_deferred_errors", deferred=True)
+        def post(result):
+            pass
@@ -0,0 +1,124 @@
+import typing
+
+import pytest
+
+from yapyhook import (
+    DISPATCH_UNROLL_LIMIT,
+    FilterHook,
+    Hook,
+    HookType,
+    PostHook,
+    PreHook,
+)
+
+
+def test_metadata():
+    @Hook("test_dispatch_metadata")
+    def f(x):
+        """docstring"""
+        return x
+
+    assert f.__name__ == "f"
+    assert f.__doc__ == "docstring"
+    assert f.__hookname__ == "test_dispatch_metadata"  # type: ignore
+    assert Hook.get_hook_name(f) == "test_dispatch_metadata"
+
+
+def test_kwargs():
+    calls: typing.List = []
+
+    @Hook("test_dispatch_kwargs")
+    def f(x, y=1):
+        return x * y
+
+    assert f(3) == 3
+    assert f(3, y=2) == 6
+
+    @PreHook("test_dispatch_kwargs")
+    def pre(*args, **kwargs):
+        calls.append(("pre", args, kwargs))
+
+    @PostHook("test_dispatch_kwargs")
+    def post(result, *args, **kwargs):
+        calls.append(("post", result, args, kwargs))
+
+    assert f(3) == 3
+    assert f(3, y=2) == 6
+    assert calls == [
+        ("pre", (3,), {}),
+        ("post", 3, (3,), {}),
+        ("pre", (3,), {"y": 2}),
+        ("post", 6, (3,), {"y": 2}),
+    ]
+
+
+@pytest.mark.parametrize(
+    "count", [1, 2, DISPATCH_UNROLL_LIMIT, DISPATCH_UNROLL_LIMIT + 1]
+)
+def test_callback_count(count):
+    name = f"test_dispatch_callback_count_{count}"
+    calls: typing.List = []
+
+    @Hook(name)
+    def f(x):
+        return x
+
+    def make_callbacks(i):
+        def pre(x):
+            calls.append(("pre", i))
+
+        def filter(result, x):
+            return result + 1
+
+        def post(result, x):
+            calls.append(("post", i, result))
+
+        return pre, filter, post
+
+    callbacks = [make_callbacks(i) for i in range(count)]
+    for pre, filter, post in callbacks:
+        PreHook(name)(pre)
+        FilterHook(name)(filter)
+        PostHook(name)(post)
+    del pre, filter, post
+
+    assert f(10) == 10 + count
+    assert calls == [("pre", i) for i in range(count)] + [
+        ("post", i, 10 + count) for i in range(count)
+    ]
+
+    # the last PreHook short-circuits the call, the previous ones are still called
+    calls.clear()
+
+    @PreHook(name)
+    def stop(x):
+        return (True, -1)
+
+    assert f(10) == -1 + count
+    assert calls[:count] == [("pre", i) for i in range(count)]
+
+    # the dispatch function is rebuilt when the chain changes
+    assert Hook.unregister(stop) is True
+    del callbacks[0]
+    calls.clear()
+    assert f(10) == 10 + count - 1
+    assert len(Hook.HOOKS[name][HookType.FILTERCALL]) == count - 1
+
+
+@pytest.mark.asyncio
+async def test_async_kwargs():
+    calls: typing.List = []
+
+    @Hook("test_dispatch_async_kwargs")
+    async def f(x, y=1):
+        return x * y
+
+    assert await f(3, y=2) == 6
+
+    @PreHook("test_dispatch_async_kwargs")
+    async def pre(*args, **kwargs):
+        calls.append(("pre", args, kwargs))
+
+    assert await f(3, y=2) == 6
+    assert calls == [("pre", (3,), {"y": 2})]
+    assert f.__hookname__ == "test_dispatch_async_kwargs"  # type: ignore
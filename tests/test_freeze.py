@@ -0,0 +1,137 @@
+import gc
+import typing
+import weakref
+
+import pytest
+
+from yapyhook import (
+    DISPATCH_UNROLL_LIMIT,
+    FilterHook,
+    Hook,
+    HookClass,
+    HookType,
+    PostHook,
+    PreHook,
+)
+
+
+@pytest.mark.parametrize("count", [1, DISPATCH_UNROLL_LIMIT + 1])
+def test_freeze(count):
+    name = f"test_freeze_{count}"
+    calls: typing.List = []
+
+    @Hook(name)
+    def f(x, y=1):
+        return x * y
+
+    def add(i):
+        @FilterHook(name)
+        def filter(result, x, y=1):
+            return result + i
+
+        return filter
+
+    @PostHook(name, context=True)
+    def post(ctx):
+        calls.append((ctx.args, ctx.kwargs, ctx.result))
+
+    callbacks = [add(1) for _ in range(count)]
+    refs = [weakref.ref(callback) for callback in callbacks]
+    hook = Hook.HOOKS[name]
+    hook.freeze()
+    assert hook.frozen
+    # the callbacks are referenced strongly
+    del callbacks
+    gc.collect()
+    assert f(2) == 2 + count
+    assert f(2, 3) == 6 + count
+    assert f(2, y=3) == 6 + count
+    assert calls == [
+        ((2,), {}, 2 + count),
+        ((2, 3), {}, 6 + count),
+        ((2,), {"y": 3}, 6 + count),
+    ]
+
+    with pytest.raises(ValueError):
+        PreHook(name)(lambda x: None)
+    with pytest.raises(ValueError):
+        Hook.unregister(post)
+
+    hook.thaw()
+    assert not hook.frozen
+    gc.collect()
+    assert all(ref() is None for ref in refs)
+    assert f(2) == 2
+    assert Hook.unregister(post) is True
+
+
+def test_freeze_all():
+    @Hook("test_freeze_all_a")
+    def a():
+        return 1
+
+    @Hook("test_freeze_all_b")
+    def b():
+        return 2
+
+    @PreHook("test_freeze_all_a")
+    def stop():
+        return (True, -1)
+
+    Hook.freeze_all()
+    try:
+        assert (
+            Hook.HOOKS["test_freeze_all_a"].frozen
+            and Hook.HOOKS["test_freeze_all_b"].frozen
+        )
+        assert a() == -1 and b() == 2
+        with pytest.raises(ValueError):
+            Hook.unregister(stop)
+    finally:
+        Hook.thaw_all()
+    assert Hook.unregister(stop) is True
+    assert a() == 1
+
+
+def test_per_instance():
+    @HookClass
+    class Counter:
+        def __init__(self):
+            self.calls = 0
+
+        @Hook("test_freeze_per_instance")
+        def method(self, x):
+            return x
+
+        @PreHook("test_freeze_per_instance", per_instance=True)
+        def pre(self, x):
+            self.calls += 1
+
+    counter = Counter()
+    Hook.HOOKS["test_freeze_per_instance"].freeze()
+    try:
+        assert counter.method(1) == 1
+        assert counter.calls == 1
+        # a new instance would register its callbacks
+        with pytest.raises(ValueError):
+            Counter()
+    finally:
+        Hook.HOOKS["test_freeze_per_instance"].thaw()
+    assert Counter().method(1) == 1
+    assert len(Hook.HOOKS["test_freeze_per_instance"][HookType.PRECALL]) == 0
+
+
+@pytest.mark.asyncio
+async def test_async():
+    @Hook("test_freeze_async")
+    async def f(x):
+        return x
+
+    @FilterHook("test_freeze_async")
+    async def double(result, x):
+        return result * 2
+
+    Hook.HOOKS["test_freeze_async"].freeze()
+    assert await f(2) == 4
+    Hook.HOOKS["test_freeze_async"].thaw()
+    assert await f(2) == 4
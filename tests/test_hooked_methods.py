@@ -0,0 +1,161 @@
+import typing
+
+from yapyhook import CallHook, FilterHook, Hook, HookClass, HookType, PostHook, PreHook
+
+
+def test_table_cached():
+    @Hook("test_table_cached")
+    def f():
+        return True
+
+    @HookClass
+    class Intercept:
+        @PreHook("test_table_cached")
+        def pre(self):
+            pass
+
+        def other(self):
+            pass
+
+    @HookClass
+    class SubIntercept(Intercept):
+        @PostHook("test_table_cached")
+        def post(self, result):
+            pass
+
+    table = CallHook.get_hooked_methods(SubIntercept)
+    assert [entry[:3] for entry in table] == [
+        ("post", "test_table_cached", HookType.POSTCALL),
+        ("pre", "test_table_cached", HookType.PRECALL),
+    ]
+    assert CallHook.get_hooked_methods(SubIntercept) is table
+    # the subclass does not share the table of the parent class
+    assert [entry[0] for entry in CallHook.get_hooked_methods(Intercept)] == ["pre"]
+
+    i = SubIntercept()
+    assert Hook.HOOKS["test_table_cached"][HookType.PRECALL] == [i.pre]
+    assert Hook.HOOKS["test_table_cached"][HookType.POSTCALL] == [i.post]
+
+
+def test_table_invalidated():
+    calls: typing.List[str] = []
+
+    @Hook("test_table_invalidated")
+    def f():
+        return True
+
+    @HookClass
+    class Intercept:
+        @PreHook("test_table_invalidated")
+        def pre(self):
+            calls.append("pre")
+
+    a = Intercept()
+    f()
+    assert calls == ["pre"]
+
+    # replace a hooked method with a method which is not hooked
+    def pre(self):
+        calls.append("not hooked")
+
+    Intercept.pre = pre  # type: ignore
+    calls.clear()
+    b = Intercept()
+    f()
+    assert calls == []
+
+    # add a new hooked method
+    @PostHook("test_table_invalidated")
+    def post(self, result):
+        calls.append("post")
+
+    Intercept.post = post  # type: ignore
+    calls.clear()
+    c = Intercept()
+    f()
+    assert calls == ["post"]
+
+    del a, b, c
+
+
+def test_table_method_added():
+    calls: typing.List[str] = []
+
+    @Hook("test_table_method_added")
+    def f():
+        return True
+
+    # hooked before the table of the class is built
+    @PreHook("test_table_method_added")
+    def extra(self):
+        calls.append("extra")
+
+    @HookClass
+    class Intercept:
+        pass
+
+    a = Intercept()
+    Intercept.extra = extra  # type: ignore
+    b = Intercept()
+    assert f() is True
+    assert calls == ["extra"]
+    assert Hook.HOOKS["test_table_method_added"][HookType.PRECALL] == [b.extra]  # type: ignore
+
+    del a, b
+
+
+def test_table_method_replaced():
+    calls: typing.List[str] = []
+
+    @Hook("test_table_method_replaced")
+    def f():
+        return True
+
+    @PreHook("test_table_method_replaced")
+    def extra(self):
+        calls.append("extra")
+
+    @HookClass
+    class Intercept:
+        def extra(self):
+            pass
+
+    a = Intercept()
+    # same number of attributes, the function is replaced by a hooked one
+    Intercept.extra = extra  # type: ignore
+    b = Intercept()
+    assert f() is True
+    assert calls == ["extra"]
+    assert Hook.HOOKS["test_table_method_replaced"][HookType.PRECALL] == [b.extra]
+
+    del a, b
+
+
+def test_registrations_published_once():
+    @Hook("test_registrations_published_once")
+    def f(x):
+        return x
+
+    @HookClass
+    class Intercept:
+        @FilterHook("test_registrations_published_once")
+        def add(self, result, x):
+            return result + 1
+
+        @PostHook("test_registrations_published_once")
+        def post(self, result, x):
+            pass
+
+    hook = Hook.HOOKS["test_registrations_published_once"]
+    version = hook.version
+    instances = [Intercept() for _ in range(1000)]
+    # the chains are published a few times while they grow, not once per instance
+    assert hook.version - version < 10
+    assert f(0) == 1000
+    assert len(hook.hook_types[HookType.POSTCALL]) == 1000
+
+    version = hook.version
+    instances.append(Intercept())
+    assert hook.version == version
+    assert f(0) == 1001
+    assert hook.version == version + 1
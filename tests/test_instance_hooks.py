@@ -0,0 +1,239 @@
+import gc
+import typing
+
+import pytest
+
+from yapyhook import FilterHook, Hook, HookClass, HookType, PostHook, PreHook
+
+
+class Text:
+    def __init__(self, text):
+        self.text = text
+
+    def reverse(self, prefix=""):
+        return prefix + self.text[::-1]
+
+
+def test_anonymous_instance_hook():
+    a = Text("abc")
+    b = Text("xyz")
+    c = Text("123")
+
+    @FilterHook(a, "reverse")
+    def filter_a(result, prefix=""):
+        return f"!{result}!"
+
+    @PreHook(b, "reverse")
+    def pre_b(prefix=""):
+        return (True, f"{prefix}stop")
+
+    assert a.reverse() == "!cba!"
+    assert b.reverse(">") == ">stop"
+    assert c.reverse() == "321"
+
+    # a single hook for the class, the callbacks are not in its chains
+    name = Hook.get_hook_name(Text.reverse)
+    assert name is not None
+    assert filter_a.__hook__ == (name, HookType.FILTERCALL)  # type: ignore
+    assert "reverse" not in vars(a)
+    assert Hook.HOOKS[name][HookType.FILTERCALL] == []
+    assert len(Hook.HOOKS[name].instances.entries) == 2
+
+    assert Hook.unregister(filter_a) is True
+    assert a.reverse() == "cba"
+
+    # the callbacks of an object are removed when the object dies
+    del b
+    gc.collect()
+    assert Hook.HOOKS[name].instances.entries == {}
+    del pre_b
+
+
+def test_callback_dies():
+    text = Text("abc")
+
+    @FilterHook(text, "reverse")
+    def filter(result, prefix=""):
+        return result.upper()
+
+    assert text.reverse() == "CBA"
+    del filter
+    gc.collect()
+    assert text.reverse() == "cba"
+
+
+def test_order():
+    calls: typing.List = []
+
+    class Counter:
+        def incr(self, x):
+            return x + 1
+
+    counter = Counter()
+
+    @PreHook(counter, "incr", priority=1)
+    def late(x):
+        calls.append("late")
+
+    @PreHook(counter, "incr", priority=-1)
+    def early(x):
+        calls.append("early")
+
+    name = Hook.get_hook_name(Counter.incr)
+
+    @PreHook(name)
+    def shared(obj, x):
+        calls.append("shared")
+
+    assert counter.incr(1) == 2
+    assert calls == ["early", "shared", "late"]
+    calls.clear()
+    assert Counter().incr(1) == 2
+    assert calls == ["shared"]
+
+
+def test_per_instance():
+    calls: typing.List = []
+
+    @HookClass
+    class Account:
+        def __init__(self, name):
+            self.name = name
+
+        @Hook("test_instance_hooks_per_instance")
+        def deposit(self, amount):
+            return amount
+
+        @PreHook("test_instance_hooks_per_instance", per_instance=True)
+        def check(self, amount):
+            calls.append((self.name, amount))
+            if amount < 0:
+                return (True, 0)
+
+        @PostHook("test_instance_hooks_per_instance", per_instance=True)
+        def post(self, result, amount):
+            calls.append((self.name, result))
+
+    accounts = [Account(i) for i in range(100)]
+    assert accounts[3].deposit(10) == 10
+    assert accounts[5].deposit(-1) == 0
+    assert calls == [(3, 10), (3, 10), (5, -1), (5, 0)]
+
+    hook = Hook.HOOKS["test_instance_hooks_per_instance"]
+    assert hook[HookType.PRECALL] == []
+    assert len(hook.instances.select(HookType.PRECALL, (), (accounts[3], 1))) == 1
+
+    calls.clear()
+    assert hook.call_many([(accounts[1], 1), (accounts[2], -1)]) == [1, 0]
+    assert calls == [(1, 1), (2, -1), (1, 1), (2, 0)]
+
+    del accounts
+    gc.collect()
+    assert hook.instances.entries == {}
+
+
+def test_static_and_class_methods():
+    class Maths:
+        @staticmethod
+        def double(x):
+            return x * 2
+
+        @classmethod
+        def triple(cls, x):
+            return x * 3
+
+    maths = Maths()
+
+    @FilterHook(maths, "double")
+    def filter_double(result, x):
+        return result + 1
+
+    @FilterHook(maths, "triple")
+    def filter_triple(result, x):
+        return result + 1
+
+    # hooked on the object, the class is untouched
+    assert maths.double(2) == 5
+    assert maths.triple(2) == 7
+    assert isinstance(vars(Maths)["double"], staticmethod)
+    assert isinstance(vars(Maths)["triple"], classmethod)
+    assert Maths().double(2) == 4
+    assert Maths.triple(2) == 6
+
+
+def test_hook_class_callback():
+    calls: typing.List = []
+
+    @Hook("test_instance_hooks_hook_class_callback")
+    def f(x):
+        return x
+
+    @HookClass
+    class Listener:
+        @PreHook("test_instance_hooks_hook_class_callback")
+        def before(self, x):
+            calls.append(("before", x))
+
+    first = Listener()
+
+    @PreHook(first, "before")
+    def pre(x):
+        calls.append(("pre", x))
+
+    # the class is untouched: the next instances still register before
+    second = Listener()
+    assert f(1) == 1
+    assert calls == [("before", 1), ("before", 1)]
+    calls.clear()
+    first.before(2)
+    second.before(3)
+    assert calls == [("pre", 2), ("before", 2), ("before", 3)]
+
+
+def test_no_weakref():
+    class Slotted:
+        __slots__ = ()
+
+        def reverse(self, text):
+            return text[::-1]
+
+    slotted = Slotted()
+    function = vars(Slotted)["reverse"]
+    with pytest.raises(TypeError):
+
+        @PreHook(slotted, "reverse")
+        def pre(text):
+            pass
+
+    # the class is not patched
+    assert vars(Slotted)["reverse"] is function
+    assert slotted.reverse("abc") == "cba"
+
+
+def test_when():
+    a = Text("abc")
+    b = Text("xyz")
+
+    @PreHook(a, "reverse", when={"prefix": "?"})
+    def pre(prefix=""):
+        return (True, "stop")
+
+    assert a.reverse("?") == "stop"
+    assert a.reverse("!") == "!cba"
+    assert a.reverse() == "cba"
+    assert b.reverse("?") == "?zyx"
+
+
+def test_invalid():
+    with pytest.raises(ValueError):
+
+        @PreHook("test_instance_hooks_invalid", per_instance=True)
+        def f(x):
+            pass
+
+    with pytest.raises(ValueError):
+
+        class Account:
+            @PreHook("test_instance_hooks_invalid", per_instance=True, when={"x": 1})
+            def check(self, x):
+                pass
@@ -0,0 +1,138 @@
+import typing
+
+import pytest
+
+from yapyhook import DispatchPolicy, Hook, HookType, PostHook, PreHook
+
+
+def test_disabled():
+    @Hook("test_instrumentation_disabled")
+    def f(x):
+        return x
+
+    hook = Hook.HOOKS["test_instrumentation_disabled"]
+    assert hook.stats() is None
+    assert hook._dispatch is None
+
+    hook.instrument()
+    assert f(1) == 1
+    stats = hook.stats()
+    assert stats is not None and stats["calls"] == 1
+
+    hook.instrument(None)
+    assert hook.stats() is None
+    assert hook._dispatch is None
+    assert "test_instrumentation_disabled" not in Hook.all_stats()
+
+
+def test_stats():
+    @Hook("test_instrumentation_stats")
+    def f(x):
+        return x
+
+    hook = Hook.HOOKS["test_instrumentation_stats"]
+    hook.instrument()
+
+    @PreHook("test_instrumentation_stats")
+    def pre(x):
+        if x < 0:
+            return (True, 0)
+
+    @PostHook("test_instrumentation_stats")
+    def post(result, x):
+        pass
+
+    assert f(1) == 1
+    assert f(-1) == 0
+
+    stats = hook.stats()
+    assert stats is not None
+    assert stats["calls"] == 2
+    assert stats["total"]["count"] == 2
+    assert stats["total"]["short_circuits"] == 1
+    assert stats["function"]["count"] == 1
+    assert sum(stats["function"]["buckets"].values()) == 1
+    pre_stats = stats["callbacks"][HookType.PRECALL.value][pre.__qualname__]
+    assert pre_stats["count"] == 2
+    assert pre_stats["short_circuits"] == 1
+    post_stats = stats["callbacks"][HookType.POSTCALL.value][post.__qualname__]
+    assert post_stats["count"] == 2
+    assert Hook.all_stats()["test_instrumentation_stats"] == stats
+
+
+@pytest.mark.parametrize("count", [1, 6])
+def test_sample_rate(count):
+    name = f"test_instrumentation_sample_rate_{count}"
+
+    @Hook(name)
+    def f(x):
+        return x
+
+    def make_callback(i):
+        def pre(x):
+            pass
+
+        return pre
+
+    callbacks = [make_callback(i) for i in range(count)]
+    for callback in callbacks:
+        PreHook(name)(callback)
+
+    Hook.HOOKS[name].instrument(sample_rate=0.25)
+    for i in range(8):
+        assert f(i) == i
+
+    stats = Hook.HOOKS[name].stats()
+    assert stats is not None
+    assert stats["calls"] == 8
+    assert stats["sample_rate"] == 0.25
+    assert stats["total"]["count"] == 2
+    # the callbacks have the same __qualname__
+    assert stats["callbacks"][HookType.PRECALL.value][callbacks[0].__qualname__][
+        "count"
+    ] == (2 * count)
+
+    with pytest.raises(ValueError):
+        Hook.HOOKS[name].instrument(sample_rate=0)
+
+
+@pytest.mark.asyncio
+async def test_async():
+    calls: typing.List = []
+
+    @Hook("test_instrumentation_async", postcall_policy=DispatchPolicy.CONCURRENT)
+    async def f(x):
+        return x
+
+    Hook.HOOKS["test_instrumentation_async"].instrument()
+
+    @PreHook("test_instrumentation_async")
+    async def pre(x):
+        calls.append(x)
+
+    assert await f(1) == 1
+    assert calls == [1]
+    stats = Hook.HOOKS["test_instrumentation_async"].stats()
+    assert stats is not None
+    assert stats["total"]["count"] == 1
+    assert stats["function"]["count"] == 1
+    assert stats["callbacks"][HookType.PRECALL.value][pre.__qualname__]["count"] == 1
+
+
+def test_prometheus():
+    @Hook('test_instrumentation_"prometheus"')
+    def f(x):
+        return x
+
+    Hook.HOOKS['test_instrumentation_"prometheus"'].instrument()
+    f(1)
+
+    text = Hook.prometheus_stats()
+    assert 'yapyhook_calls_total{hook="test_instrumentation_\\"prometheus\\""} 1' in (
+        text.splitlines()
+    )
+    assert (
+        'yapyhook_latency_seconds_bucket{hook="test_instrumentation_\\"prometheus\\"",'
+        'stage="function",callback="",le="+Inf"} 1'
+    ) in text.splitlines()
+    assert "# TYPE yapyhook_latency_seconds histogram" in text
@@ -0,0 +1,172 @@
+import typing
+
+import pytest
+
+from yapyhook import (
+    ITEM_UNPACKED_ARGS,
+    ITEM_UNROLL_LIMIT,
+    FilterHook,
+    Hook,
+    HookType,
+    ItemFilterHook,
+    PreHook,
+)
+
+
+def test_map_drop():
+    @Hook("test_item_filter_map_drop")
+    def f(n, step=1):
+        for i in range(0, n, step):
+            yield i
+
+    @ItemFilterHook("test_item_filter_map_drop")
+    def double(item, n, step=1):
+        return item * 2
+
+    @ItemFilterHook("test_item_filter_map_drop", drop=True)
+    def drop_multiples_of_4(item, n, step=1):
+        return item % 4 == 0
+
+    @FilterHook("test_item_filter_map_drop")
+    def to_list(result, n, step=1):
+        return list(result)
+
+    assert f(5) == [2, 6]
+    assert f(6, step=2) == []
+    assert Hook.HOOKS["test_item_filter_map_drop"][HookType.ITEMFILTERCALL] == [
+        double,
+        drop_multiples_of_4,
+    ]
+
+
+@pytest.mark.parametrize("count", [1, ITEM_UNROLL_LIMIT + 1])
+def test_callback_count(count):
+    name = f"test_item_filter_callback_count_{count}"
+
+    @Hook(name)
+    def f(n):
+        return iter(range(n))
+
+    def make_callback(i):
+        def increment(item, n):
+            return item + 1
+
+        return increment
+
+    callbacks = [make_callback(i) for i in range(count)]
+    for callback in callbacks:
+        ItemFilterHook(name)(callback)
+    del callback
+
+    assert list(f(3)) == [count, count + 1, count + 2]
+
+    # a dead callback is skipped
+    del callbacks[0]
+    assert list(f(3)) == [count - 1, count, count + 1]
+
+
+def test_chunked(monkeypatch):
+    monkeypatch.setattr("yapyhook.ITEM_CHUNK_SIZE", 4)
+    chunks: typing.List = []
+
+    @Hook("test_item_filter_chunked")
+    def f(n):
+        return range(n)
+
+    @ItemFilterHook("test_item_filter_chunked")
+    def double(item, n):
+        return item * 2
+
+    @ItemFilterHook("test_item_filter_chunked", chunked=True)
+    def keep_odd_indexes(items, n):
+        chunks.append(items)
+        return items[1::2]
+
+    assert list(f(10)) == [2, 6, 10, 14, 18]
+    assert chunks == [[0, 2, 4, 6], [8, 10, 12, 14], [16, 18]]
+
+    with pytest.raises(ValueError):
+        ItemFilterHook("test_item_filter_chunked", drop=True, chunked=True)
+
+
+def test_short_circuit():
+    @Hook("test_item_filter_short_circuit")
+    def f(n):
+        return range(n)
+
+    @PreHook("test_item_filter_short_circuit")
+    def pre(n):
+        return (True, [10, 20])
+
+    @ItemFilterHook("test_item_filter_short_circuit")
+    def increment(item, n):
+        return item + 1
+
+    assert list(f(3)) == [11, 21]
+
+
+def test_call_many():
+    @Hook("test_item_filter_call_many")
+    def f(n):
+        return range(n)
+
+    @ItemFilterHook("test_item_filter_call_many", drop=True)
+    def drop_odd(item, n):
+        return item % 2
+
+    assert [
+        list(r)
+        for r in Hook.HOOKS["test_item_filter_call_many"].call_many([(3,), (5,)])
+    ] == [
+        [0, 2],
+        [0, 2, 4],
+    ]
+
+
+@pytest.mark.asyncio
+async def test_async_generator():
+    @Hook("test_item_filter_async_generator")
+    async def f(n):
+        for i in range(n):
+            yield i
+
+    @ItemFilterHook("test_item_filter_async_generator")
+    def double(item, n):
+        return item * 2
+
+    @ItemFilterHook("test_item_filter_async_generator", drop=True)
+    def drop_zero(item, n):
+        return item == 0
+
+    assert [item async for item in f(3)] == [2, 4]
+
+    with pytest.raises(ValueError):
+
+        @ItemFilterHook("test_item_filter_async_generator", chunked=True)
+        async def async_callback(items, n):
+            return items
+
+
+@pytest.mark.parametrize("arity", [0, 1, ITEM_UNPACKED_ARGS + 1])
+def test_arguments(arity):
+    name = f"test_item_filter_arguments_{arity}"
+    calls: typing.List = []
+
+    @Hook(name)
+    def f(*args, **kwargs):
+        return range(2)
+
+    @ItemFilterHook(name)
+    def record(item, *args, **kwargs):
+        calls.append((item, args, kwargs))
+        return item
+
+    args = tuple(range(arity))
+    assert list(f(*args)) == [0, 1]
+    assert list(f(*args, key="value")) == [0, 1]
+    assert calls == [
+        (0, args, {}),
+        (1, args, {}),
+        (0, args, {"key": "value"}),
+        (1, args, {"key": "value"}),
+    ]
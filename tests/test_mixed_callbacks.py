@@ -0,0 +1,149 @@
+import asyncio
+import typing
+
+import pytest
+
+from yapyhook import DispatchPolicy, FilterHook, Hook, PostHook, PreHook
+
+
+@pytest.mark.asyncio
+async def test_sync_callbacks_on_async_hook():
+    calls: typing.List = []
+
+    @Hook("test_sync_callbacks_on_async_hook")
+    async def f(x):
+        return x
+
+    @PreHook("test_sync_callbacks_on_async_hook")
+    def pre(x):
+        calls.append(("pre", x))
+        if x < 0:
+            return (True, 0)
+
+    @FilterHook("test_sync_callbacks_on_async_hook")
+    def filter(result, x):
+        return result * 2
+
+    @PostHook("test_sync_callbacks_on_async_hook")
+    async def post(result, x):
+        calls.append(("post", result))
+
+    assert await f(2) == 4
+    assert await f(-1) == 0
+    assert calls == [("pre", 2), ("post", 4), ("pre", -1), ("post", 0)]
+
+
+@pytest.mark.asyncio
+async def test_sync_callbacks_concurrent_policies():
+    calls: typing.List = []
+
+    @Hook(
+        "test_sync_callbacks_concurrent_policies",
+        precall_policy=DispatchPolicy.CONCURRENT,
+        postcall_policy=DispatchPolicy.CONCURRENT,
+    )
+    async def f(x):
+        return x
+
+    @PreHook("test_sync_callbacks_concurrent_policies")
+    def pre(x):
+        if x < 0:
+            return (True, 0)
+
+    @PostHook("test_sync_callbacks_concurrent_policies")
+    def post(result, x):
+        calls.append(result)
+
+    assert await f(2) == 2
+    assert await f(-1) == 0
+    assert calls == [2, 0]
+
+
+@pytest.mark.asyncio
+async def test_async_posthook_on_sync_hook():
+    calls: typing.List = []
+
+    @Hook("test_async_posthook_on_sync_hook")
+    def f(x):
+        return x
+
+    @PostHook("test_async_posthook_on_sync_hook")
+    async def post(result, x):
+        await asyncio.sleep(0)
+        calls.append(result)
+
+    # scheduled on the running event loop
+    assert f(1) == 1
+    assert calls == []
+    await Hook.HOOKS["test_async_posthook_on_sync_hook"].wait_background_tasks()
+    assert calls == [1]
+
+
+def test_async_posthook_without_event_loop():
+    calls: typing.List = []
+
+    @Hook("test_async_posthook_without_event_loop")
+    def f(x):
+        return x
+
+    @PostHook("test_async_posthook_without_event_loop")
+    async def post(result, x):
+        await asyncio.sleep(0)
+        calls.append(result)
+
+    # run until completion
+    assert f(1) == 1
+    assert calls == [1]
+
+
+def test_async_posthook_dedicated_event_loop():
+    loops: typing.List = []
+    leftovers: typing.List = []
+
+    @Hook("test_async_posthook_dedicated_event_loop")
+    def f(x):
+        return x
+
+    @PostHook("test_async_posthook_dedicated_event_loop")
+    async def post(result, x):
+        loop = asyncio.get_event_loop()
+        loops.append(loop)
+        leftovers.append(loop.create_task(asyncio.sleep(60)))
+
+    thread_loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(thread_loop)
+    try:
+        f(1)
+        f(2)
+        # the event loop of the thread is neither used nor replaced
+        assert asyncio.get_event_loop() is thread_loop
+    finally:
+        asyncio.set_event_loop(None)
+        thread_loop.close()
+    # the event loop is reused and the pending tasks are cancelled
+    assert loops[0] is loops[1] and loops[0] is not thread_loop
+    assert all(task.cancelled() for task in leftovers)
+
+
+def test_async_callbacks_on_sync_hook_errors():
+    @Hook("test_async_callbacks_on_sync_hook_errors")
+    def f(x):
+        return x
+
+    with pytest.raises(ValueError):
+
+        @PreHook("test_async_callbacks_on_sync_hook_errors")
+        async def pre(x):
+            pass
+
+    with pytest.raises(ValueError):
+
+        @FilterHook("test_async_callbacks_on_sync_hook_errors")
+        async def filter(result, x):
+            return result
+
+    with pytest.raises(ValueError):
+
+        @PostHook("test_async_callbacks_on_sync_hook_errors", deferred=True)
+        async def post(result, x):
+            pass
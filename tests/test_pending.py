@@ -0,0 +1,128 @@
+import typing
+
+from yapyhook import Hook, HookClass, HookType, PostHook, PreHook
+
+
+def test_pending():
+    calls: typing.List = []
+
+    @PreHook("test_pending")
+    def pre(x):
+        calls.append(("pre", x))
+
+    @PostHook("test_pending")
+    def post(result, x):
+        calls.append(("post", result))
+
+    assert [
+        (name, hook_type)
+        for name, hook_type, _, _ in Hook.pending_registrations()
+        if name == "test_pending"
+    ] == [("test_pending", HookType.PRECALL), ("test_pending", HookType.POSTCALL)]
+
+    @Hook("test_pending")
+    def f(x):
+        return x
+
+    assert f(1) == 1
+    assert calls == [("pre", 1), ("post", 1)]
+    assert not [p for p in Hook.pending_registrations() if p[0] == "test_pending"]
+
+    # the registration is not pending anymore
+    del f
+    calls.clear()
+
+    @Hook("test_pending")
+    def g(x):
+        return x
+
+    g(1)
+    assert calls == []
+
+
+def test_validation():
+    @PostHook("test_pending_validation")
+    async def post(result, x):
+        pass
+
+    @PreHook("test_pending_validation")
+    async def pre(x):
+        pass
+
+    @Hook("test_pending_validation")
+    def g(x):
+        return x
+
+    assert g(1) == 1
+    # an async PreHook can't be registered on a sync hook
+    assert Hook.HOOKS["test_pending_validation"][HookType.PRECALL] == []
+    assert Hook.HOOKS["test_pending_validation"][HookType.POSTCALL] == [post]
+    pending = [
+        p for p in Hook.pending_registrations() if p[0] == "test_pending_validation"
+    ]
+    assert len(pending) == 1
+    name, hook_type, callback, error = pending[0]
+    assert (hook_type, callback) == (HookType.PRECALL, pre)
+    assert error is not None and "async" in error
+
+
+def test_unregister():
+    @PreHook("test_pending_unregister")
+    def pre(x):
+        pass
+
+    assert Hook.unregister(pre) is True
+    assert Hook.unregister(pre) is False
+    assert not [
+        p for p in Hook.pending_registrations() if p[0] == "test_pending_unregister"
+    ]
+
+
+def test_garbage_collected():
+    @PreHook("test_pending_garbage_collected")
+    def pre(x):
+        pass
+
+    del pre
+    assert not [
+        p
+        for p in Hook.pending_registrations()
+        if p[0] == "test_pending_garbage_collected"
+    ]
+
+
+def test_hook_class():
+    calls: typing.List = []
+
+    @HookClass
+    class Plugin:
+        @PostHook("test_pending_hook_class")
+        def post(self, result, x):
+            calls.append(result)
+
+    plugin = Plugin()
+
+    @Hook("test_pending_hook_class")
+    def f(x):
+        return x
+
+    f(1)
+    assert calls == [1]
+    del plugin
+
+
+def test_allowed_hook_types():
+    @PostHook("test_pending_allowed_hook_types")
+    def post(result, x):
+        pass
+
+    @Hook("test_pending_allowed_hook_types", allowed_hook_types={HookType.PRECALL})
+    def f(x):
+        return x
+
+    assert f(1) == 1
+    assert Hook.HOOKS["test_pending_allowed_hook_types"][HookType.POSTCALL] == []
+    pending = Hook.pending_registrations()
+    assert ("test_pending_allowed_hook_types", HookType.POSTCALL, post) in [
+        p[:3] for p in pending
+    ]
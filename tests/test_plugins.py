@@ -0,0 +1,94 @@
+import sys
+import typing
+
+import pytest
+
+import yapyhook
+from yapyhook import Hook, HookType
+
+PLUGIN = """
+from yapyhook import PreHook
+
+calls = []
+
+
+@PreHook("test_plugins.hook")
+def pre(x):
+    calls.append(x)
+"""
+
+
+@pytest.fixture
+def distribution(tmp_path, monkeypatch):
+    """Install a fake distribution declaring a plugin of test_plugins.hook"""
+    module_name = f"fake_yapyhook_plugin_{len(Hook.LOADED_PLUGINS)}"
+    (tmp_path / f"{module_name}.py").write_text(PLUGIN)
+    dist_info = tmp_path / "fake_yapyhook_plugin-1.0.dist-info"
+    dist_info.mkdir()
+    (dist_info / "METADATA").write_text(
+        "Metadata-Version: 2.1\nName: fake-yapyhook-plugin\nVersion: 1.0\n"
+    )
+    (dist_info / "entry_points.txt").write_text(
+        f"[yapyhook.callbacks]\ntest_plugins.hook = {module_name}\n"
+    )
+    monkeypatch.syspath_prepend(str(tmp_path))
+    yield module_name
+    sys.modules.pop(module_name, None)
+
+
+def test_load_on_first_call(distribution, tmp_path):
+    @Hook("test_plugins.hook")
+    def f(x):
+        return x
+
+    plugins = Hook.discover_plugins(cache_path=str(tmp_path / "cache.json"))
+    assert plugins["test_plugins.hook"] == [distribution]
+    assert distribution not in sys.modules
+
+    assert f(1) == 1
+    plugin = sys.modules[distribution]
+    assert plugin.calls == [1]  # type: ignore
+    assert Hook.HOOKS["test_plugins.hook"][HookType.PRECALL] == [plugin.pre]  # type: ignore
+    assert Hook.HOOKS["test_plugins.hook"]._plugins == []
+
+    f(2)
+    assert plugin.calls == [1, 2]  # type: ignore
+
+
+@pytest.mark.asyncio
+async def test_async(distribution):
+    Hook.discover_plugins(cache_path=None)
+
+    # the hook is created after the discovery
+    @Hook("test_plugins.hook")
+    async def f(x):
+        return x
+
+    assert distribution not in sys.modules
+    assert await f(1) == 1
+    assert sys.modules[distribution].calls == [1]  # type: ignore
+
+
+def test_cache(distribution, tmp_path_factory, monkeypatch):
+    # not in a directory of sys.path
+    cache_path = str(
+        tmp_path_factory.mktemp("cache") / "yapyhook" / "entry_points.json"
+    )
+    plugins = Hook.discover_plugins(cache_path=cache_path)
+
+    def scan_entry_points(group: str) -> typing.Dict[str, typing.List[str]]:
+        raise AssertionError("the cache is not used")
+
+    monkeypatch.setattr(yapyhook, "scan_entry_points", scan_entry_points)
+    assert Hook.discover_plugins(cache_path=cache_path) == plugins
+
+    # installing a distribution modifies a directory of sys.path
+    monkeypatch.syspath_prepend(str(tmp_path_factory.mktemp("site-packages")))
+    with pytest.raises(AssertionError):
+        Hook.discover_plugins(cache_path=cache_path)
+
+
+def test_load_entry_point():
+    assert yapyhook.load_entry_point("yapyhook") is yapyhook
+    assert yapyhook.load_entry_point("yapyhook:Hook.unregister") is Hook.unregister
+    assert yapyhook.load_entry_point("yapyhook : Hook [extra]") is Hook
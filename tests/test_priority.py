@@ -0,0 +1,88 @@
+import typing
+
+import pytest
+
+from yapyhook import Hook, HookType, PostHook, PreHook
+
+
+def test_priority():
+    calls: typing.List = []
+
+    @Hook("test_priority")
+    def f(x):
+        return x
+
+    @PreHook("test_priority")
+    def default_1(x):
+        calls.append("default_1")
+
+    @PreHook("test_priority", priority=10)
+    def late(x):
+        calls.append("late")
+
+    @PreHook("test_priority", priority=-10)
+    def early(x):
+        calls.append("early")
+
+    @PreHook("test_priority")
+    def default_2(x):
+        calls.append("default_2")
+
+    f(1)
+    assert calls == ["early", "default_1", "default_2", "late"]
+    assert list(Hook.HOOKS["test_priority"][HookType.PRECALL]) == [
+        early,
+        default_1,
+        default_2,
+        late,
+    ]
+
+
+def test_before_after():
+    calls: typing.List = []
+
+    @Hook("test_before_after")
+    def f(x):
+        return x
+
+    @PostHook("test_before_after")
+    def first(result, x):
+        calls.append("first")
+
+    @PostHook("test_before_after", after="test_before_after.<locals>.third")
+    def second(result, x):
+        calls.append("second")
+
+    @PostHook("test_before_after", priority=5, before=[first])
+    def third(result, x):
+        calls.append("third")
+
+    f(1)
+    assert calls == ["third", "first", "second"]
+
+    # the order is kept when a callback is unregistered
+    calls.clear()
+    assert Hook.unregister(first) is True
+    f(1)
+    assert calls == ["third", "second"]
+
+
+def test_circular_constraints():
+    calls: typing.List = []
+
+    @Hook("test_circular_constraints")
+    def f(x):
+        return x
+
+    @PreHook("test_circular_constraints", before="test_circular_constraints.<locals>.c")
+    def a(x):
+        calls.append("a")
+
+    def c(x):
+        calls.append("c")
+
+    with pytest.raises(ValueError):
+        PreHook("test_circular_constraints", before=a)(c)
+
+    f(1)
+    assert calls == ["a"]
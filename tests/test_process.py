@@ -0,0 +1,198 @@
+import asyncio
+import os
+import threading
+import time
+import typing
+
+import pytest
+
+from yapyhook import Backpressure, FilterHook, Hook, PostHook, ProcessExecutor
+
+
+def write_pid(result, path):
+    with open(path, "a") as f:
+        f.write(f"{os.getpid()} {result}\n")
+
+
+def square(result, x):
+    return result * result
+
+
+def slow(result, delay):
+    time.sleep(delay)
+
+
+def fail(result, path):
+    raise KeyError(result)
+
+
+def test_post_fire_and_forget(tmp_path):
+    path = str(tmp_path / "calls")
+
+    @Hook("test_process_post")
+    def f(path):
+        return 3
+
+    PostHook("test_process_post", executor="process")(write_pid)
+    try:
+        assert f(path) == 3
+        assert f(path) == 3
+        assert Hook.PROCESS_EXECUTOR.flush(10)
+    finally:
+        Hook.unregister(write_pid)
+
+    with open(path) as file:
+        lines = [line.split() for line in file]
+    assert [result for _, result in lines] == ["3", "3"]
+    # the callback ran in a worker process
+    assert all(int(pid) != os.getpid() for pid, _ in lines)
+
+
+@pytest.mark.asyncio
+async def test_async_filter():
+    @Hook("test_process_filter")
+    async def f(x):
+        return x + 1
+
+    FilterHook("test_process_filter", executor="process")(square)
+    try:
+        assert await f(2) == 9
+    finally:
+        Hook.unregister(square)
+
+
+def test_invalid():
+    with pytest.raises(ValueError):
+        PostHook("test_process_invalid", executor="thread")
+    with pytest.raises(ValueError):
+        PostHook("test_process_invalid", deferred=True, executor="process")
+
+    @Hook("test_process_invalid")
+    def f(x):
+        return x
+
+    # a sync hook can't wait for a process
+    with pytest.raises(ValueError):
+        FilterHook("test_process_invalid", executor="process")(square)
+
+    async def post(result, x):
+        pass
+
+    with pytest.raises(ValueError):
+        PostHook("test_process_invalid", executor="process")(post)
+
+
+def test_unpicklable(tmp_path):
+    @Hook("test_process_unpicklable")
+    def f(path):
+        return threading.Lock()
+
+    PostHook("test_process_unpicklable", executor="process")(write_pid)
+    try:
+        with pytest.raises(ValueError, match="can't be sent to a process"):
+            f(str(tmp_path / "calls"))
+    finally:
+        Hook.unregister(write_pid)
+
+    executor = ProcessExecutor()
+    with pytest.raises(ValueError):
+        executor.submit(lambda: None, (), {})
+    assert executor.stats()["submitted"] == 0
+
+
+def test_backpressure(tmp_path, caplog):
+    path = str(tmp_path / "calls")
+    executor = ProcessExecutor(
+        max_workers=1, max_in_flight=1, backpressure=Backpressure.DROP_NEWEST
+    )
+    try:
+        assert executor.submit(write_pid, (1, path), {}) is True
+        assert executor.submit(write_pid, (2, path), {}) is False
+        assert executor.flush(10)
+        assert executor.submit(fail, (3, path), {}) is True
+        assert executor.flush(10)
+        assert executor.stats() == {
+            "in_flight": 0,
+            "submitted": 2,
+            "dropped": 1,
+            "completed": 1,
+            "failed": 1,
+        }
+        assert "Exception in the process callback" in caplog.text
+
+        executor.configure(max_in_flight=4, backpressure=Backpressure.BLOCK)
+        for i in range(8):
+            assert executor.submit(write_pid, (i, path), {}) is True
+    finally:
+        executor.shutdown()
+    assert executor.stats()["in_flight"] == 0
+    with open(path) as file:
+        assert len(file.readlines()) == 9
+
+
+def test_shutdown_no_wait():
+    executor = ProcessExecutor(max_workers=1)
+    for _ in range(6):
+        assert executor.submit(time.sleep, (0.2,), {}) is True
+    executor.shutdown(wait=False)
+    # the calls which are not running yet are cancelled
+    assert executor.flush(10)
+    stats = executor.stats()
+    assert stats["submitted"] == 6
+    assert stats["completed"] < 6 and stats["failed"] == 0
+
+
+@pytest.mark.asyncio
+async def test_async_post(tmp_path):
+    path = str(tmp_path / "calls")
+
+    @Hook("test_process_async_post")
+    async def f(path):
+        return 4
+
+    PostHook("test_process_async_post", executor="process")(write_pid)
+    try:
+        assert await f(path) == 4
+        Hook.HOOKS["test_process_async_post"].freeze()
+        assert await f(path) == 4
+        assert Hook.PROCESS_EXECUTOR.flush(10)
+    finally:
+        Hook.HOOKS["test_process_async_post"].thaw()
+        Hook.unregister(write_pid)
+
+    with open(path) as file:
+        assert [line.split()[1] for line in file] == ["4", "4"]
+
+
+@pytest.mark.asyncio
+async def test_async_post_backpressure():
+    @Hook("test_process_async_post_backpressure")
+    async def f(delay):
+        return 5
+
+    gaps: typing.List[float] = []
+
+    async def heartbeat():
+        last = time.perf_counter()
+        while True:
+            await asyncio.sleep(0.01)
+            now = time.perf_counter()
+            gaps.append(now - last)
+            last = now
+
+    PostHook("test_process_async_post_backpressure", executor="process")(slow)
+    Hook.PROCESS_EXECUTOR.configure(max_in_flight=1)
+    task = asyncio.ensure_future(heartbeat())
+    loop = asyncio.get_event_loop()
+    try:
+        await asyncio.sleep(0.05)
+        # the second call waits for room without blocking the event loop
+        assert await f(0.5) == 5
+        assert await f(0.5) == 5
+        assert await loop.run_in_executor(None, Hook.PROCESS_EXECUTOR.flush, 10)
+        await asyncio.sleep(0.05)
+    finally:
+        task.cancel()
+        Hook.PROCESS_EXECUTOR.configure(max_in_flight=64)
+        Hook.unregister(slow)
+    assert gaps and max(gaps) < 0.25
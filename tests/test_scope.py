@@ -0,0 +1,146 @@
+import asyncio
+import sys
+import threading
+import typing
+
+import pytest
+
+from yapyhook import DISPATCH_UNROLL_LIMIT, FilterHook, Hook, HookType, PreHook
+
+pytestmark = pytest.mark.skipif(
+    sys.version_info < (3, 7), reason="Hook.scope() requires Python 3.7"
+)
+
+
+@pytest.mark.parametrize("count", [0, DISPATCH_UNROLL_LIMIT + 1])
+def test_scope(count):
+    name = f"test_scope_{count}"
+
+    @Hook(name)
+    def f(x):
+        return x
+
+    def add(i):
+        @FilterHook(name)
+        def filter(result, x):
+            return result + i
+
+        return filter
+
+    callbacks = [add(1) for _ in range(count)]
+    assert f(0) == count
+    with Hook.scope():
+        # the callbacks of a scope are kept alive until the end of the scope
+        add(100)
+        assert f(0) == count + 100
+        with Hook.scope():
+            add(1000)
+            assert f(0) == count + 1100
+        assert f(0) == count + 100
+    assert f(0) == count
+    assert len(Hook.HOOKS[name][HookType.FILTERCALL]) == count
+    del callbacks
+
+
+def test_unregister():
+    @Hook("test_scope_unregister")
+    def f(x):
+        return x
+
+    with Hook.scope():
+
+        @PreHook("test_scope_unregister")
+        def stop(x):
+            return (True, -x)
+
+        assert f(1) == -1
+        assert Hook.unregister(stop) is True
+        assert f(1) == 1
+        assert Hook.unregister(stop) is False
+    assert f(1) == 1
+
+
+def test_threads():
+    @Hook("test_scope_threads")
+    def f(x):
+        return x
+
+    barrier = threading.Barrier(2)
+    results: typing.Dict[int, typing.List] = {}
+
+    def request(i):
+        with Hook.scope():
+
+            @FilterHook("test_scope_threads")
+            def filter(result, x):
+                return result + i
+
+            barrier.wait()
+            results[i] = [f(0), f.__wrapped__(0)]  # type: ignore
+            barrier.wait()
+
+    threads = [threading.Thread(target=request, args=(i,)) for i in (1, 2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == {1: [1, 0], 2: [2, 0]}
+    assert f(0) == 0
+
+
+@pytest.mark.asyncio
+async def test_tasks():
+    calls: typing.List = []
+
+    @Hook("test_scope_tasks")
+    async def f(x):
+        await asyncio.sleep(0)
+        return x
+
+    async def request(i):
+        with Hook.scope():
+
+            @PreHook("test_scope_tasks")
+            async def pre(x):
+                calls.append((i, x))
+
+            # the tasks created in the scope see its callbacks
+            return await asyncio.gather(f(i), asyncio.create_task(f(i)))
+
+    assert await asyncio.gather(request(1), request(2), f(3)) == [[1, 1], [2, 2], 3]
+    assert sorted(calls) == [(1, 1), (1, 1), (2, 2), (2, 2)]
+
+
+def test_call_many():
+    @Hook("test_scope_call_many")
+    def f(x):
+        return x
+
+    with Hook.scope():
+
+        @FilterHook("test_scope_call_many", context=True)
+        def double(ctx):
+            return ctx.result * 2
+
+        assert Hook.HOOKS["test_scope_call_many"].call_many([(1,), (2,)]) == [2, 4]
+        assert f(3) == 6
+    assert Hook.HOOKS["test_scope_call_many"].call_many([(1,), (2,)]) == [1, 2]
+
+
+def test_invalid():
+    with Hook.scope():
+        with pytest.raises(ValueError):
+            PreHook("test_scope_missing")(lambda x: None)
+
+    @Hook("test_scope_invalid_when")
+    def f(x):
+        return x
+
+    with Hook.scope():
+        with pytest.raises(ValueError):
+
+            @PreHook("test_scope_invalid_when", when={"x": 1})
+            def pre(x):
+                return (True, 0)
+
+        assert f(2) == 2
@@ -0,0 +1,103 @@
+import gc
+import typing
+import weakref
+
+import pytest
+
+from yapyhook import (
+    DISPATCH_UNROLL_LIMIT,
+    FilterHook,
+    Hook,
+    HookClass,
+    HookType,
+    PostHook,
+    PreHook,
+    StrongRef,
+)
+
+CALLS: typing.List = []
+
+
+@Hook("test_strong_refs_module")
+def hooked(x):
+    return x
+
+
+@PreHook("test_strong_refs_module")
+def module_callback(x):
+    CALLS.append(x)
+
+
+def test_module_function():
+    # a module level function is not referenced weakly by default
+    hook = Hook.HOOKS["test_strong_refs_module"]
+    (ref,) = hook.hook_types[HookType.PRECALL]
+    assert isinstance(ref, StrongRef) and ref.callback is module_callback
+    CALLS.clear()
+    assert hooked(1) == 1
+    assert CALLS == [1]
+
+
+@pytest.mark.parametrize("count", [1, DISPATCH_UNROLL_LIMIT + 1])
+def test_weak_false(count):
+    name = f"test_strong_refs_weak_false_{count}"
+    calls: typing.List = []
+
+    @Hook(name)
+    def f(x):
+        return x
+
+    def register(i):
+        @FilterHook(name, weak=False)
+        def filter(result, x):
+            calls.append(i)
+            return result + 1
+
+        return filter
+
+    callbacks = [register(i) for i in range(count)]
+
+    @PostHook(name, weak=True)
+    def post(result, x):
+        calls.append("post")
+
+    # the callbacks are kept alive by the hook
+    refs = [weakref.ref(callback) for callback in callbacks]
+    del callbacks
+    gc.collect()
+    assert f(1) == 1 + count
+    assert calls == list(range(count)) + ["post"]
+
+    callback = refs[0]()
+    assert callback is not None and Hook.unregister(callback) is True
+    del callback
+    gc.collect()
+    assert refs[0]() is None
+    assert f(1) == count
+
+
+def test_method():
+    calls: typing.List = []
+
+    @Hook("test_strong_refs_method")
+    def f(x):
+        return x
+
+    @HookClass
+    class Listener:
+        @PreHook("test_strong_refs_method", weak=False)
+        def pre(self, x):
+            calls.append(x)
+
+    listener = Listener()
+    instance_ref = weakref.ref(listener)
+    method = listener.pre
+    del listener
+    gc.collect()
+    # the bound method keeps its instance alive until it is unregistered
+    assert f(1) == 1
+    assert calls == [1]
+    assert Hook.unregister(method) is True
+    del method
+    gc.collect()
+    assert instance_ref() is None
@@ -0,0 +1,139 @@
+import typing
+
+from yapyhook import HOOK_NAMES, Hook, HookClass, HookType, NameTrie, PostHook, PreHook
+
+
+def test_name_trie():
+    trie = NameTrie()
+    for name in ("a", "a.b", "a.b.c", "a.c", "b.c"):
+        trie.add(name, name)
+    assert sorted(trie.match("a.*")) == ["a.b", "a.c"]
+    assert sorted(trie.match("a.**")) == ["a", "a.b", "a.b.c", "a.c"]
+    assert sorted(trie.match("**.c")) == ["a.b.c", "a.c", "b.c"]
+    assert sorted(trie.match("*.*.c")) == ["a.b.c"]
+    assert trie.get("a.b") == ["a.b"]
+
+    patterns = NameTrie()
+    for pattern in ("a.*", "a.**", "**.c", "*.*.c", "a.b"):
+        patterns.add(pattern, pattern)
+    assert sorted(patterns.match_patterns("a.b")) == ["a.*", "a.**", "a.b"]
+    assert sorted(patterns.match_patterns("a.b.c")) == ["**.c", "*.*.c", "a.**"]
+    assert sorted(patterns.match_patterns("a")) == ["a.**"]
+
+    assert trie.remove("a.b.c", "a.b.c") is True
+    assert trie.remove("a.b.c", "a.b.c") is False
+    assert "c" not in trie.children["a"].children["b"].children
+
+
+def test_subscribe():
+    calls: typing.List = []
+
+    @Hook("test_subscriptions.existing")
+    def existing(x):
+        return x
+
+    @PostHook("test_subscriptions.*")
+    def post(result, x):
+        calls.append(result)
+
+    # created after the subscription
+    @Hook("test_subscriptions.created")
+    def created(x):
+        return x
+
+    @Hook("test_subscriptions.other.nested")
+    def nested(x):
+        return x
+
+    existing(1)
+    created(2)
+    nested(3)
+    assert calls == [1, 2]
+    assert Hook.HOOKS["test_subscriptions.created"][HookType.POSTCALL] == [post]
+
+    calls.clear()
+    assert Hook.unregister(post) is True
+    existing(1)
+    created(2)
+    assert calls == []
+
+    @Hook("test_subscriptions.later")
+    def later(x):
+        return x
+
+    assert Hook.HOOKS["test_subscriptions.later"][HookType.POSTCALL] == []
+
+
+def test_recursive_pattern():
+    calls: typing.List = []
+
+    @PreHook("test_subscriptions_payments.**")
+    def pre(*args):
+        calls.append(args)
+
+    @Hook("test_subscriptions_payments.card.charge")
+    def charge(amount):
+        return amount
+
+    @Hook("test_subscriptions_payments")
+    def payments():
+        return None
+
+    charge(10)
+    payments()
+    assert calls == [(10,), ()]
+
+    # the subscription dies with the callback
+    del pre
+    calls.clear()
+
+    @Hook("test_subscriptions_payments.refund")
+    def refund(amount):
+        return amount
+
+    refund(1)
+    assert calls == []
+
+
+def test_sync_async():
+    calls: typing.List = []
+
+    @PreHook("test_subscriptions_async.*")
+    async def pre(x):
+        calls.append(x)
+
+    # an async PreHook can't be registered on a sync hook
+    @Hook("test_subscriptions_async.sync")
+    def f(x):
+        return x
+
+    assert f(1) == 1
+    assert Hook.HOOKS["test_subscriptions_async.sync"][HookType.PRECALL] == []
+
+
+def test_hook_class():
+    calls: typing.List = []
+
+    @Hook("test_subscriptions_class.method")
+    def method(x):
+        return x
+
+    @HookClass
+    class Observer:
+        @PostHook("test_subscriptions_class.*")
+        def post(self, result, x):
+            calls.append((self, result))
+
+    observer = Observer()
+    method(1)
+    assert calls == [(observer, 1)]
+
+
+def test_hook_names():
+    hook = Hook("test_subscriptions_names.hook")
+    assert HOOK_NAMES.get("test_subscriptions_names.hook") == [
+        "test_subscriptions_names.hook"
+    ]
+    del hook
+    assert HOOK_NAMES.get("test_subscriptions_names.hook") == []
+    assert "test_subscriptions_names" not in HOOK_NAMES.children
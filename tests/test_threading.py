@@ -0,0 +1,78 @@
+import threading
+import typing
+
+from yapyhook import Hook, HookType, PostHook, PreHook
+
+
+def test_concurrent_register_and_call():
+    thread_count = 8
+    call_count = 2000
+    called = [0] * thread_count
+    errors: typing.List[BaseException] = []
+    stop = threading.Event()
+
+    @Hook("test_concurrent_register_and_call")
+    def f(i):
+        return i
+
+    @PostHook("test_concurrent_register_and_call")
+    def count(result, i):
+        called[i] += 1
+
+    def caller(i):
+        try:
+            for _ in range(call_count):
+                assert f(i) == i
+        except BaseException as e:  # pragma: no cover
+            errors.append(e)
+
+    def writer():
+        try:
+            while not stop.is_set():
+
+                @PreHook("test_concurrent_register_and_call")
+                def pre(i):
+                    pass
+
+                @PostHook("test_concurrent_register_and_call")
+                def post(result, i):
+                    pass
+
+                Hook.unregister(pre)
+                del post
+        except BaseException as e:  # pragma: no cover
+            errors.append(e)
+
+    writers = [threading.Thread(target=writer) for _ in range(2)]
+    callers = [threading.Thread(target=caller, args=(i,)) for i in range(thread_count)]
+    for t in writers + callers:
+        t.start()
+    for t in callers:
+        t.join()
+    stop.set()
+    for t in writers:
+        t.join()
+
+    assert errors == []
+    # the permanent callback is never skipped
+    assert called == [call_count] * thread_count
+    assert Hook.HOOKS["test_concurrent_register_and_call"][HookType.POSTCALL] == [count]
+
+
+def test_snapshot_version():
+    @Hook("test_snapshot_version")
+    def f():
+        return True
+
+    hook = Hook.HOOKS["test_snapshot_version"]
+    version = hook.version
+    snapshot = hook.hook_types
+
+    @PreHook("test_snapshot_version")
+    def pre():
+        pass
+
+    assert hook.version > version
+    assert isinstance(hook.hook_types[HookType.PRECALL], tuple)
+    # the previous snapshot is not modified
+    assert snapshot[HookType.PRECALL] == ()
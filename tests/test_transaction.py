@@ -0,0 +1,210 @@
+import asyncio
+import threading
+import typing
+
+import pytest
+
+from yapyhook import FilterHook, Hook, HookClass, HookType, PreHook
+
+
+def test_transaction():
+    @Hook("test_transaction")
+    def f(x):
+        return x
+
+    hook = Hook.HOOKS["test_transaction"]
+
+    def add(i, **kwargs):
+        @FilterHook("test_transaction", **kwargs)
+        def filter(result, x):
+            return result * 10 + i
+
+        return filter
+
+    version = hook.version
+    with Hook.transaction():
+        callbacks = [add(i) for i in range(1, 4)]
+        callbacks.append(add(0, priority=-1))
+        # a duplicate is ignored
+        FilterHook("test_transaction")(callbacks[0])
+        # the calls see the chains before the block
+        assert f(0) == 0
+    assert hook.version == version + 1
+    assert f(0) == 123
+    assert Hook.HOOKS["test_transaction"][HookType.FILTERCALL] == [
+        callbacks[3],
+        *callbacks[:3],
+    ]
+
+    with Hook.transaction():
+        assert Hook.unregister(callbacks[0]) is True
+        assert Hook.unregister(callbacks[0]) is False
+        added = add(4)
+        assert Hook.unregister(added) is True
+        with Hook.transaction():
+            added = add(5)
+        assert f(0) == 123
+    assert hook.version == version + 2
+    assert f(0) == 235
+
+
+def test_error():
+    @Hook("test_transaction_error")
+    def f(x):
+        return x
+
+    @PreHook("test_transaction_error")
+    def first(x):
+        return None
+
+    version = Hook.HOOKS["test_transaction_error"].version
+    with pytest.raises(KeyError):
+        with Hook.transaction():
+
+            @PreHook("test_transaction_error")
+            def stop(x):
+                return (True, -1)
+
+            Hook.unregister(first)
+            raise KeyError()
+    # nothing is applied
+    assert Hook.HOOKS["test_transaction_error"].version == version
+    assert Hook.HOOKS["test_transaction_error"][HookType.PRECALL] == [first]
+
+    # the constraints are checked when the callback is registered
+    with Hook.transaction():
+
+        @PreHook("test_transaction_error", before=first)
+        def second(x):
+            pass
+
+        with pytest.raises(ValueError):
+
+            @PreHook("test_transaction_error", after=first, before=second)
+            def third(x):
+                pass
+
+    assert Hook.HOOKS["test_transaction_error"][HookType.PRECALL] == [second, first]
+
+
+@pytest.mark.asyncio
+async def test_task_outlives_error():
+    @Hook("test_transaction_task_outlives_error")
+    def f(x):
+        return x
+
+    started = asyncio.Event()
+
+    async def register():
+        await started.wait()
+
+        @FilterHook("test_transaction_task_outlives_error")
+        def filter(result, x):
+            return result + 1
+
+        # the transaction of the context is over: applied directly
+        assert f(1) == 2
+        Hook.unregister(filter)
+
+        with Hook.transaction():
+            FilterHook("test_transaction_task_outlives_error")(filter)
+            assert f(1) == 1
+        assert f(1) == 2
+
+    with pytest.raises(KeyError):
+        with Hook.transaction():
+            task = asyncio.ensure_future(register())
+            raise KeyError()
+    started.set()
+    await task
+
+
+def test_register_many():
+    calls: typing.List = []
+
+    @Hook("test_transaction_many_a")
+    def a(x):
+        return x
+
+    @Hook("test_transaction_many_b")
+    def b(x):
+        return x
+
+    def pre(x):
+        calls.append(("pre", x))
+
+    def post(result, x):
+        calls.append(("post", x))
+
+    hooks = [
+        Hook.HOOKS["test_transaction_many_a"],
+        Hook.HOOKS["test_transaction_many_b"],
+    ]
+    versions = [hook.version for hook in hooks]
+    Hook.register_many(
+        [
+            ("test_transaction_many_a", HookType.PRECALL, pre),
+            ("test_transaction_many_a", HookType.POSTCALL, post),
+            ("test_transaction_many_b", HookType.PRECALL, pre),
+        ]
+    )
+    assert [hook.version for hook in hooks] == [v + 1 for v in versions]
+    a(1)
+    b(2)
+    assert calls == [("pre", 1), ("post", 1), ("pre", 2)]
+
+
+def test_hook_class():
+    @Hook("test_transaction_hook_class")
+    def f(x):
+        return x
+
+    @HookClass
+    class Listener:
+        @FilterHook("test_transaction_hook_class")
+        def add(self, result, x):
+            return result + 1
+
+        @FilterHook("test_transaction_hook_class", priority=1)
+        def double(self, result, x):
+            return result * 2
+
+    version = Hook.HOOKS["test_transaction_hook_class"].version
+    listener = Listener()
+    assert f(1) == 4
+    # the callbacks of the instance are published once, on the first call
+    assert Hook.HOOKS["test_transaction_hook_class"].version == version + 1
+    del listener
+
+
+def test_threads():
+    @Hook("test_transaction_threads")
+    def f(x):
+        return x
+
+    registered, checked = threading.Event(), threading.Event()
+    results = []
+
+    def other():
+        registered.wait()
+        results.append(f(1))
+        checked.set()
+
+    thread = threading.Thread(target=other)
+    thread.start()
+    with Hook.transaction():
+
+        @FilterHook("test_transaction_threads")
+        def first(result, x):
+            return result + 1
+
+        registered.set()
+        checked.wait()
+
+        @FilterHook("test_transaction_threads")
+        def second(result, x):
+            return result + 1
+
+    thread.join()
+    assert results == [1]
+    assert f(1) == 3
@@ -0,0 +1,136 @@
+import typing
+
+import pytest
+
+from yapyhook import (
+    DISPATCH_UNROLL_LIMIT,
+    FilterHook,
+    Hook,
+    ItemFilterHook,
+    PostHook,
+    PreHook,
+)
+
+
+@pytest.mark.parametrize("count", [2, DISPATCH_UNROLL_LIMIT + 2])
+def test_when(count):
+    name = f"test_when_{count}"
+    calls: typing.List = []
+
+    @Hook(name)
+    def f(kind, size=1):
+        return size
+
+    def make_pre(i):
+        def pre(kind, size=1):
+            calls.append(i)
+
+        return PreHook(name, when={"kind": f"kind_{i}"})(pre)
+
+    pres = [make_pre(i) for i in range(count)]
+
+    @PreHook(name)
+    def always(kind, size=1):
+        calls.append("always")
+
+    @PreHook(name, priority=-1, when={"kind": "kind_1", "size": 2})
+    def first(kind, size=1):
+        calls.append("first")
+
+    assert f("kind_0") == 1
+    assert f(kind="kind_1", size=3) == 3
+    assert f("kind_1", 2) == 2
+    assert f("other") == 1
+    assert f([]) == 1
+    assert calls == [
+        0,
+        "always",
+        1,
+        "always",
+        "first",
+        1,
+        "always",
+        "always",
+        "always",
+    ]
+    del pres
+
+
+def test_selector():
+    calls: typing.List = []
+
+    @Hook("test_when_selector")
+    def f(request):
+        return request["path"]
+
+    def method(request):
+        return request["method"]
+
+    @FilterHook("test_when_selector", when={method: "GET"})
+    def get(result, request):
+        return f"GET {result}"
+
+    @PostHook("test_when_selector", when={method: "POST"})
+    def post(result, request):
+        calls.append(result)
+
+    assert f({"method": "GET", "path": "/a"}) == "GET /a"
+    assert f({"method": "POST", "path": "/b"}) == "/b"
+    assert calls == ["/b"]
+
+
+def test_call_many():
+    calls: typing.List = []
+
+    @Hook("test_when_call_many")
+    def f(x):
+        return x
+
+    @PreHook("test_when_call_many", when={"x": 0})
+    def stop(x):
+        return (True, -1)
+
+    @FilterHook("test_when_call_many", when={"x": 1})
+    def increment(result, x):
+        return result + 10
+
+    @PostHook("test_when_call_many", when={"x": 2})
+    def post(result, x):
+        calls.append(result)
+
+    hook = Hook.HOOKS["test_when_call_many"]
+    assert hook.call_many([(0,), (1,), (2,)]) == [-1, 11, 2]
+    assert calls == [2]
+
+
+def test_invalid():
+    with pytest.raises(ValueError):
+        PreHook("test_when_invalid", when={})
+    with pytest.raises(ValueError):
+        PreHook("test_when_invalid", when={1: 2})  # type: ignore
+    with pytest.raises(ValueError):
+        PreHook("test_when_invalid", batch=True, when={"x": 1})
+    with pytest.raises(TypeError):
+        ItemFilterHook("test_when_invalid", when={"x": 1})  # type: ignore
+
+    @Hook("test_when_invalid")
+    def f(kind, *args):
+        return kind
+
+    def pre(kind, *args):
+        pass
+
+    # the keys are checked once the hooked function is known
+    with pytest.raises(ValueError, match="'knd' is not a parameter"):
+        PreHook("test_when_invalid", when={"knd": 1})(pre)
+    with pytest.raises(ValueError):
+        PreHook("test_when_invalid", when={"args": 1})(pre)
+    PreHook("test_when_invalid", when={"kind": 1})(pre)
+    assert f(1) == 1
+
+    @Hook("test_when_invalid_kwargs")
+    def g(**kwargs):
+        return kwargs
+
+    PreHook("test_when_invalid_kwargs", when={"kind": 1})(pre)
+    assert g(kind=1) == {"kind": 1}
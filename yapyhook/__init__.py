@@ -1,39 +1,2731 @@
 # SPDX-License-Identifier: MIT
 
+import asyncio
+import atexit
+import bisect
+import collections
+import concurrent.futures
+import contextlib
 import enum
+import gc
+import heapq
+import importlib
 import inspect
+import itertools
+import json
+import logging
+import os
+import pickle
+import sys
 import threading
+import time
+import types
 import typing
 import weakref
-from functools import wraps
+from functools import lru_cache, wraps
 
-__all__ = ["HookType", "Hook", "PreHook", "PostHook", "FilterHook", "HookClass"]
+__all__ = [
+    "HookType",
+    "DispatchPolicy",
+    "Backpressure",
+    "DeferredExecutor",
+    "ProcessExecutor",
+    "Hook",
+    "PreHook",
+    "PostHook",
+    "FilterHook",
+    "ItemFilterHook",
+    "HookClass",
+    "CacheHook",
+    "CallContext",
+]
+logger = logging.getLogger("yapyhook")
 T = typing.TypeVar("T")
 F = typing.Callable[..., T]
 WEAKREF_F = typing.Union[weakref.ReferenceType, weakref.WeakMethod]
 T_ARGS = typing.List[typing.Any]
 T_KWARGS = typing.Dict[str, typing.Any]
+# callbacks, or __qualname__ of callbacks, see sort_callbacks
+T_CONSTRAINTS = typing.Union[None, str, F, typing.Iterable[typing.Union[str, F]]]
+T_HOOKED_METHODS = typing.Tuple[typing.Tuple[str, str, "HookType", F], ...]
+
+if sys.version_info >= (3, 7):
+    get_running_loop = asyncio.get_running_loop
+    all_tasks = asyncio.all_tasks
+    current_task = asyncio.current_task
+    from contextvars import ContextVar
+else:  # Python 3.6
+
+    def get_running_loop() -> asyncio.AbstractEventLoop:
+        loop = asyncio._get_running_loop()
+        if loop is None:
+            raise RuntimeError("no running event loop")
+        return loop
+
+    def all_tasks(loop: asyncio.AbstractEventLoop) -> typing.Set[asyncio.Task]:
+        return {task for task in asyncio.Task.all_tasks(loop) if not task.done()}
+
+    current_task = asyncio.Task.current_task
+
+    class ContextVar(threading.local):
+        """Stand-in of contextvars.ContextVar: the value is local to the thread, the
+        asyncio tasks of the thread share it"""
+
+        def __init__(self, name: str, default: typing.Any = None) -> None:
+            self.name = name
+            self.value = default
+
+        def get(self) -> typing.Any:
+            return self.value
+
+        def set(self, value: typing.Any) -> typing.Any:
+            token, self.value = self.value, value
+            return token
+
+        def reset(self, token: typing.Any) -> None:
+            self.value = token
 
 
 def is_first_parameter_self(f: F) -> bool:
+    code = getattr(f, "__code__", None)
+    if (
+        inspect.isfunction(f)
+        and code is not None
+        and code.co_argcount
+        and not hasattr(f, "__wrapped__")
+        and not hasattr(f, "__signature__")
+    ):
+        # the first positional parameter, without building the signature
+        return code.co_varnames[0] == "self"
     signature = inspect.signature(f)
     if not signature.parameters:
         return False
     return next(iter(signature.parameters), None) == "self"
 
 
-def is_async_function(f: F) -> bool:
-    return (
-        not inspect.isasyncgenfunction(f)
-        and inspect.iscoroutinefunction(f)
-        or inspect.isawaitable(f)
-    )
+def is_async_function(f: F) -> bool:
+    return (
+        not inspect.isasyncgenfunction(f)
+        and inspect.iscoroutinefunction(f)
+        or inspect.isawaitable(f)
+    )
+
+
+class HookType(enum.Enum):
+    PRECALL = "precall"
+    POSTCALL = "postcall"
+    FILTERCALL = "filtercall"
+    # ItemFilterHook, called before the FILTERCALL callbacks
+    ITEMFILTERCALL = "itemfiltercall"
+
+
+# Above this number of callbacks, the dispatch function loops over the callbacks
+DISPATCH_UNROLL_LIMIT = 4
+# the same limit for a frozen hook, which is compiled once, see Hook.freeze
+FROZEN_UNROLL_LIMIT = 32
+# a hook publishes its lazy registrations once there are this number of them, or as
+# many as its callbacks, even if it is not called, see Hook.register
+LAZY_REGISTRATION_LIMIT = 64
+
+
+class DeadCallbacks:
+    """Remove the callbacks from their Hook when they are garbage collected.
+
+    The weakref callbacks call add(): outside a garbage collection, the callback is
+    given to its Hook immediately. During a garbage collection, the callbacks are
+    batched until the end of the collection, so the lock of each Hook is taken once
+    even if many instances die in the same pass. The Hook only records the dead
+    callbacks and sweeps them all on its next call or publish, see Hook._remove_dead.
+    """
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.collecting = False
+        self.pending: typing.Dict[
+            int, typing.Tuple[weakref.ReferenceType, typing.List]
+        ] = {}
+
+    def add(
+        self, hook_ref: "weakref.ReferenceType[Hook]", weakref_hook: "HOOK_REF"
+    ) -> None:
+        if not self.collecting:
+            hook = hook_ref()
+            if hook is not None:
+                hook._remove_dead((weakref_hook,))
+            return
+        with self.lock:
+            _, weakref_hooks = self.pending.setdefault(id(hook_ref), (hook_ref, []))
+            weakref_hooks.append(weakref_hook)
+
+    def flush(self) -> None:
+        with self.lock:
+            pending, self.pending = self.pending, {}
+        for hook_ref, weakref_hooks in pending.values():
+            hook = hook_ref()
+            if hook is not None:
+                hook._remove_dead(weakref_hooks)
+
+    def on_gc(self, phase: str, info: typing.Dict[str, int]) -> None:
+        if phase == "start":
+            self.collecting = True
+        else:
+            self.collecting = False
+            self.flush()
+
+
+DEAD_CALLBACKS = DeadCallbacks()
+gc.callbacks.append(DEAD_CALLBACKS.on_gc)
+
+
+class DispatchPolicy(enum.Enum):
+    """How the PRECALL or POSTCALL callbacks of an async hook point are awaited.
+
+    * SEQUENTIAL: one after another, in the order of the chain.
+    * CONCURRENT: PRECALL and POSTCALL. All the callbacks are started in the order
+      of the chain and run concurrently.
+      For PRECALL, the first callback to complete with (True, value) wins: the other
+      callbacks are cancelled. The callbacks must be independent.
+      For POSTCALL, the caller returns when all the callbacks are completed.
+    * BACKGROUND: POSTCALL only. The callbacks are scheduled as tasks, the caller
+      returns without waiting for them.
+
+    FILTERCALL callbacks are always sequential since each one receives the result
+    of the previous one.
+    """
+
+    SEQUENTIAL = "sequential"
+    CONCURRENT = "concurrent"
+    BACKGROUND = "background"
+
+
+class Backpressure(enum.Enum):
+    """What DeferredExecutor.submit does when the queue is full"""
+
+    BLOCK = "block"
+    DROP_OLDEST = "drop_oldest"
+    DROP_NEWEST = "drop_newest"
+
+
+class DeferredExecutor:
+    """Bounded thread pool running the PostHook(..., deferred=True) callbacks.
+
+    The worker threads are started on the first submit, and started again after
+    shutdown.
+    """
+
+    def __init__(
+        self,
+        max_workers: int = 2,
+        max_queue_size: int = 10000,
+        backpressure: Backpressure = Backpressure.BLOCK,
+    ):
+        self.condition = threading.Condition()
+        self.queue: typing.Deque[typing.Tuple[F, tuple, T_KWARGS]] = collections.deque()
+        self.threads: typing.List[threading.Thread] = []
+        self.running = 0
+        self.stopping = False
+        self.max_workers = max_workers
+        self.max_queue_size = max_queue_size
+        self.backpressure = backpressure
+        # counters
+        self.submitted = 0
+        self.dropped = 0
+        self.completed = 0
+        self.failed = 0
+
+    def configure(
+        self,
+        max_workers: typing.Optional[int] = None,
+        max_queue_size: typing.Optional[int] = None,
+        backpressure: typing.Optional[Backpressure] = None,
+    ) -> None:
+        with self.condition:
+            if max_workers is not None:
+                self.max_workers = max_workers
+            if max_queue_size is not None:
+                self.max_queue_size = max_queue_size
+            if backpressure is not None:
+                self.backpressure = backpressure
+            self.condition.notify_all()
+
+    def submit(self, f: F, args: tuple, kwargs: T_KWARGS) -> bool:
+        """Queue the call f(*args, **kwargs), return False if a call has been dropped"""
+        with self.condition:
+            accepted = True
+            if len(self.queue) >= self.max_queue_size:
+                if self.backpressure == Backpressure.DROP_NEWEST:
+                    self.dropped += 1
+                    return False
+                if self.backpressure == Backpressure.DROP_OLDEST:
+                    self.queue.popleft()
+                    self.dropped += 1
+                    accepted = False
+                else:
+                    while len(self.queue) >= self.max_queue_size:
+                        self.condition.wait()
+            self.queue.append((f, args, kwargs))
+            self.submitted += 1
+            if len(self.threads) < self.max_workers and self.running + len(
+                self.queue
+            ) > len(self.threads):
+                self._start_thread()
+            self.condition.notify_all()
+            return accepted
+
+    def _start_thread(self) -> None:
+        # started again after shutdown: the workers still running are kept
+        self.stopping = False
+        thread = threading.Thread(
+            target=self._worker, name="yapyhook-deferred", daemon=True
+        )
+        self.threads.append(thread)
+        thread.start()
+
+    def _worker(self) -> None:
+        while True:
+            with self.condition:
+                while not self.queue and not self.stopping:
+                    self.condition.wait()
+                if not self.queue:
+                    self.threads.remove(threading.current_thread())
+                    self.condition.notify_all()
+                    return
+                f, args, kwargs = self.queue.popleft()
+                self.running += 1
+                self.condition.notify_all()
+            try:
+                f(*args, **kwargs)
+            except Exception:
+                failed = True
+                logger.exception("Exception in the deferred PostHook %r", f)
+            else:
+                failed = False
+            with self.condition:
+                self.running -= 1
+                if failed:
+                    self.failed += 1
+                else:
+                    self.completed += 1
+                self.condition.notify_all()
+
+    def flush(self, timeout: typing.Optional[float] = None) -> bool:
+        """Wait until all the queued calls are completed, return False on timeout"""
+        with self.condition:
+            return self.condition.wait_for(
+                lambda: not self.queue and not self.running, timeout
+            )
+
+    def shutdown(self, wait: bool = True) -> None:
+        """Stop the worker threads once the queued calls are completed.
+
+        Without wait, the worker threads exit in the background. The next submit starts
+        them again.
+        """
+        with self.condition:
+            self.stopping = True
+            self.condition.notify_all()
+            threads = list(self.threads)
+        if wait:
+            for thread in threads:
+                thread.join()
+
+    def stats(self) -> typing.Dict[str, int]:
+        with self.condition:
+            return {
+                "queued": len(self.queue),
+                "running": self.running,
+                "submitted": self.submitted,
+                "dropped": self.dropped,
+                "completed": self.completed,
+                "failed": self.failed,
+            }
+
+
+def call_pickled(data: bytes) -> typing.Any:
+    """Run in a worker process of ProcessExecutor: data is the pickled call"""
+    f, args, kwargs = pickle.loads(data)
+    return f(*args, **kwargs)
+
+
+class ProcessExecutor:
+    """Bounded process pool running the callbacks registered with executor="process".
+
+    The callback and its arguments are pickled in the caller: a callback or an argument
+    which can't be pickled raises ValueError in the caller. At most max_in_flight calls
+    are queued or running, see Backpressure. The pool is started on the first call,
+    and started again after shutdown.
+    """
+
+    def __init__(
+        self,
+        max_workers: typing.Optional[int] = None,
+        max_in_flight: int = 64,
+        backpressure: Backpressure = Backpressure.BLOCK,
+    ):
+        self.condition = threading.Condition()
+        self.pool: typing.Optional[concurrent.futures.ProcessPoolExecutor] = None
+        # the queued or running calls: the callback, and if its exception is logged
+        self.in_flight: typing.Dict[
+            concurrent.futures.Future, typing.Tuple[F, bool]
+        ] = {}
+        # the calls being submitted to the pool, see _start
+        self.reserved = 0
+        self.max_workers = max_workers
+        self.max_in_flight = max_in_flight
+        self.backpressure = backpressure
+        # counters
+        self.submitted = 0
+        self.dropped = 0
+        self.completed = 0
+        self.failed = 0
+
+    def configure(
+        self,
+        max_workers: typing.Optional[int] = None,
+        max_in_flight: typing.Optional[int] = None,
+        backpressure: typing.Optional[Backpressure] = None,
+    ) -> None:
+        """max_workers applies to the next pool, see shutdown"""
+        with self.condition:
+            if max_workers is not None:
+                self.max_workers = max_workers
+            if max_in_flight is not None:
+                self.max_in_flight = max_in_flight
+            if backpressure is not None:
+                self.backpressure = backpressure
+            self.condition.notify_all()
+
+    @staticmethod
+    def _pickle(f: F, args: typing.Sequence, kwargs: T_KWARGS) -> bytes:
+        try:
+            return pickle.dumps((f, tuple(args), kwargs))
+        except Exception as e:
+            raise ValueError(
+                f"the call of {f!r} can't be sent to a process: {e}"
+            ) from e
+
+    def _full(self) -> bool:
+        return len(self.in_flight) + self.reserved >= self.max_in_flight
+
+    def _reserve(self) -> concurrent.futures.ProcessPoolExecutor:
+        """Must be called with self.condition held, when a call can be started"""
+        if self.pool is None:
+            self.pool = concurrent.futures.ProcessPoolExecutor(self.max_workers)
+        self.reserved += 1
+        return self.pool
+
+    def _start(
+        self,
+        pool: concurrent.futures.ProcessPoolExecutor,
+        f: F,
+        data: bytes,
+        log: bool,
+    ) -> concurrent.futures.Future:
+        """Submit the reserved call: the pool calls _done from its own thread, the
+        lock is not held while the pool takes its locks.
+        """
+        try:
+            future = pool.submit(call_pickled, data)
+        except BaseException:
+            with self.condition:
+                self.reserved -= 1
+                self.condition.notify_all()
+            raise
+        with self.condition:
+            self.reserved -= 1
+            self.in_flight[future] = (f, log)
+            self.submitted += 1
+        future.add_done_callback(self._done)
+        return future
+
+    def _done(self, future: concurrent.futures.Future) -> None:
+        with self.condition:
+            f, log = self.in_flight.pop(future)
+            if future.cancelled():
+                pass
+            elif future.exception() is not None:
+                self.failed += 1
+                if log:
+                    logger.error(
+                        "Exception in the process callback %r",
+                        f,
+                        exc_info=future.exception(),
+                    )
+            else:
+                self.completed += 1
+            self.condition.notify_all()
+
+    def _cancel_oldest(self) -> bool:
+        """Cancel the oldest call which is not running yet, see Backpressure.DROP_OLDEST"""
+        for future in list(self.in_flight):
+            # the callbacks of the future are called by cancel, the lock is reentrant
+            if future.cancel():
+                self.dropped += 1
+                return True
+        return False
+
+    def submit(self, f: F, args: typing.Sequence, kwargs: T_KWARGS) -> bool:
+        """Start the call f(*args, **kwargs) without waiting for its result, return False
+        if a call has been dropped. The exceptions of the call are logged.
+        """
+        data = self._pickle(f, args, kwargs)
+        with self.condition:
+            accepted = True
+            while self._full():
+                if self.backpressure == Backpressure.DROP_NEWEST:
+                    self.dropped += 1
+                    return False
+                if self.backpressure == Backpressure.DROP_OLDEST:
+                    if self._cancel_oldest():
+                        accepted = False
+                        continue
+                self.condition.wait()
+            pool = self._reserve()
+        self._start(pool, f, data, True)
+        return accepted
+
+    async def submit_async(self, f: F, args: typing.Sequence, kwargs: T_KWARGS) -> bool:
+        """Like submit, for an event loop: the event loop is not blocked while
+        max_in_flight calls are running.
+        """
+        data = self._pickle(f, args, kwargs)
+        loop = get_running_loop()
+        accepted = True
+        while True:
+            with self.condition:
+                if not self._full():
+                    pool = self._reserve()
+                    break
+                if self.backpressure == Backpressure.DROP_NEWEST:
+                    self.dropped += 1
+                    return False
+                if self.backpressure == Backpressure.DROP_OLDEST:
+                    if self._cancel_oldest():
+                        accepted = False
+                        continue
+            await loop.run_in_executor(None, self._wait_for_slot)
+        self._start(pool, f, data, True)
+        return accepted
+
+    async def call(self, f: F, args: typing.Sequence, kwargs: T_KWARGS) -> typing.Any:
+        """Run the call f(*args, **kwargs) and return its result: a call is never
+        dropped, the event loop is not blocked while max_in_flight calls are running.
+        """
+        data = self._pickle(f, args, kwargs)
+        loop = get_running_loop()
+        while True:
+            with self.condition:
+                if not self._full():
+                    pool = self._reserve()
+                    break
+            await loop.run_in_executor(None, self._wait_for_slot)
+        return await asyncio.wrap_future(self._start(pool, f, data, False))
+
+    def _wait_for_slot(self) -> None:
+        with self.condition:
+            self.condition.wait_for(lambda: not self._full())
+
+    def flush(self, timeout: typing.Optional[float] = None) -> bool:
+        """Wait until all the calls are completed, return False on timeout"""
+        with self.condition:
+            return self.condition.wait_for(
+                lambda: not self.in_flight and not self.reserved, timeout
+            )
+
+    def shutdown(self, wait: bool = True) -> None:
+        """Stop the worker processes once the started calls are completed. Without
+        wait, the calls which are not running yet are cancelled.
+        """
+        with self.condition:
+            pool, self.pool = self.pool, None
+            if pool is not None and not wait:
+                # cancel_futures of ProcessPoolExecutor.shutdown needs Python 3.9
+                for future in list(self.in_flight):
+                    future.cancel()
+        if pool is None:
+            return
+        if wait or sys.version_info >= (3, 9):
+            pool.shutdown(wait=wait)
+        else:
+            # shutdown(wait=False) breaks the calls in flight on Python < 3.9: wait for
+            # them in another thread
+            threading.Thread(
+                target=pool.shutdown, name="yapyhook-process-shutdown", daemon=True
+            ).start()
+
+    def stats(self) -> typing.Dict[str, int]:
+        with self.condition:
+            return {
+                "in_flight": len(self.in_flight),
+                "submitted": self.submitted,
+                "dropped": self.dropped,
+                "completed": self.completed,
+                "failed": self.failed,
+            }
+
+
+# upper bounds in seconds of the latency histograms, see Hook.instrument
+LATENCY_BUCKETS = (1e-6, 1e-5, 1e-4, 1e-3, 1e-2, 1e-1, 1.0, float("inf"))
+
+
+class LatencyStats:
+    """Latency histogram of a hooked function or of a callback, see Hook.instrument.
+
+    The counters are not protected by a lock: an update can be lost when the same hook
+    is called concurrently from several threads.
+    """
+
+    __slots__ = ("count", "sum", "buckets", "short_circuits")
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.sum = 0.0
+        self.buckets = [0] * len(LATENCY_BUCKETS)
+        # number of calls short-circuited by a PreHook
+        self.short_circuits = 0
+
+    def observe(self, duration: float) -> None:
+        self.count += 1
+        self.sum += duration
+        self.buckets[bisect.bisect_left(LATENCY_BUCKETS, duration)] += 1
+
+    def as_dict(self) -> typing.Dict[str, typing.Any]:
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "buckets": dict(zip(LATENCY_BUCKETS, self.buckets)),
+            "short_circuits": self.short_circuits,
+        }
+
+
+class Instrumentation:
+    """Statistics of a hook, see Hook.instrument"""
+
+    __slots__ = (
+        "sample_rate",
+        "sample_every",
+        "calls",
+        "total",
+        "function",
+        "callbacks",
+    )
+
+    def __init__(self, sample_rate: float) -> None:
+        if not 0 < sample_rate <= 1:
+            raise ValueError(f"sample_rate must be in ]0, 1], not {sample_rate!r}")
+        self.sample_rate = sample_rate
+        # one call out of sample_every is measured
+        self.sample_every = max(1, round(1 / sample_rate))
+        self.calls = 0
+        # the whole call: callbacks and hooked function
+        self.total = LatencyStats()
+        self.function = LatencyStats()
+        # the callbacks with the same __qualname__ share their statistics
+        self.callbacks: typing.Dict[typing.Tuple[HookType, str], LatencyStats] = {}
+
+    def as_dict(self) -> typing.Dict[str, typing.Any]:
+        callbacks: typing.Dict[str, typing.Dict[str, typing.Any]] = {
+            hook_type.value: {} for hook_type in HookType
+        }
+        for (hook_type, qualname), stats in self.callbacks.items():
+            callbacks[hook_type.value][qualname] = stats.as_dict()
+        return {
+            "calls": self.calls,
+            "sample_rate": self.sample_rate,
+            "total": self.total.as_dict(),
+            "function": self.function.as_dict(),
+            "callbacks": callbacks,
+        }
+
+
+def record_latency(stats: LatencyStats, start: float, value: T) -> T:
+    """Called by the instrumented dispatch as record_latency(stats, perf_counter(), call):
+    the arguments are evaluated in order, so start is taken before the call.
+    """
+    stats.observe(time.perf_counter() - start)
+    return value
+
+
+def sample_dispatch(
+    instrumentation: Instrumentation,
+    dispatch: typing.Callable,
+    instrumented_dispatch: typing.Callable,
+    is_coroutine: bool,
+) -> typing.Callable:
+    """Return a dispatch function measuring one call out of instrumentation.sample_every"""
+    total = instrumentation.total
+    perf_counter = time.perf_counter
+
+    if is_coroutine:
+
+        async def sampled_async(f: F, args: tuple, kwargs: T_KWARGS) -> typing.Any:
+            instrumentation.calls += 1
+            if instrumentation.calls % instrumentation.sample_every:
+                return await dispatch(f, args, kwargs)
+            start = perf_counter()
+            try:
+                return await instrumented_dispatch(f, args, kwargs)
+            finally:
+                total.observe(perf_counter() - start)
+
+        return sampled_async
+
+    def sampled(f: F, args: tuple, kwargs: T_KWARGS) -> typing.Any:
+        instrumentation.calls += 1
+        if instrumentation.calls % instrumentation.sample_every:
+            return dispatch(f, args, kwargs)
+        start = perf_counter()
+        try:
+            return instrumented_dispatch(f, args, kwargs)
+        finally:
+            total.observe(perf_counter() - start)
+
+    return sampled
+
+
+def escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_prometheus(stats: typing.Dict[str, Instrumentation]) -> str:
+    """Format the statistics of the hooks in the Prometheus text format"""
+    lines = [
+        "# HELP yapyhook_calls_total Number of calls of the hooked functions.",
+        "# TYPE yapyhook_calls_total counter",
+    ]
+    for name, instrumentation in stats.items():
+        lines.append(
+            f'yapyhook_calls_total{{hook="{escape_label(name)}"}} {instrumentation.calls}'
+        )
+
+    histograms = []
+    for name, instrumentation in stats.items():
+        histograms.append((name, "total", "", instrumentation.total))
+        histograms.append((name, "function", "", instrumentation.function))
+        for (hook_type, qualname), callback_stats in instrumentation.callbacks.items():
+            histograms.append((name, hook_type.value, qualname, callback_stats))
+
+    lines.append(
+        "# HELP yapyhook_short_circuits_total "
+        "Number of sampled calls short-circuited by a PreHook."
+    )
+    lines.append("# TYPE yapyhook_short_circuits_total counter")
+    for name, stage, callback, latency_stats in histograms:
+        if stage in ("total", HookType.PRECALL.value):
+            labels = (
+                f'hook="{escape_label(name)}",stage="{stage}",'
+                f'callback="{escape_label(callback)}"'
+            )
+            lines.append(
+                f"yapyhook_short_circuits_total{{{labels}}} "
+                f"{latency_stats.short_circuits}"
+            )
+
+    lines.append(
+        "# HELP yapyhook_latency_seconds Latency of the sampled calls, "
+        "of the hooked functions and of the callbacks."
+    )
+    lines.append("# TYPE yapyhook_latency_seconds histogram")
+    for name, stage, callback, latency_stats in histograms:
+        labels = (
+            f'hook="{escape_label(name)}",stage="{stage}",'
+            f'callback="{escape_label(callback)}"'
+        )
+        cumulative = 0
+        for bound, count in zip(LATENCY_BUCKETS, latency_stats.buckets):
+            cumulative += count
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            lines.append(
+                f'yapyhook_latency_seconds_bucket{{{labels},le="{le}"}} {cumulative}'
+            )
+        lines.append(f"yapyhook_latency_seconds_sum{{{labels}}} {latency_stats.sum!r}")
+        lines.append(
+            f"yapyhook_latency_seconds_count{{{labels}}} {latency_stats.count}"
+        )
+    return "\n".join(lines) + "\n"
+
+
+# The options of a callback which change how the callback is called,
+# and the hook types where the option is allowed
+CALLING_OPTIONS_HOOK_TYPES = {
+    "batch": {HookType.PRECALL, HookType.FILTERCALL, HookType.POSTCALL},
+    "deferred": {HookType.POSTCALL},
+    # executor="process", see ProcessExecutor
+    "process": {HookType.POSTCALL, HookType.FILTERCALL},
+    "context": {HookType.PRECALL, HookType.FILTERCALL, HookType.POSTCALL},
+    # not an option of CallHook: set by Hook.ref for a callback of one object, which
+    # is called without the first argument of the call (self), see InstanceCallbacks
+    "scoped": {HookType.PRECALL, HookType.FILTERCALL, HookType.POSTCALL},
+    # not an option of CallHook: set by Hook.ref for a callback registered with
+    # weak=False, which is read without a weakref call, see StrongRef
+    "strong": set(HookType),
+    # not an option of CallHook: set by Hook.ref when the callback is async
+    "is_async": set(HookType),
+}
+CALLING_OPTIONS = tuple(CALLING_OPTIONS_HOOK_TYPES)
+
+
+class HookRefMixin:
+    """Options of a callback, see Hook.ref"""
+
+    __slots__ = ()
+
+    batch: bool
+    deferred: bool
+    process: bool
+    context: bool
+    scoped: bool
+    is_async: bool
+    strong: bool
+    # values of the CALLING_OPTIONS
+    kind: typing.Tuple[bool, ...]
+    # order of the callbacks, see sort_callbacks
+    priority: int
+    before: typing.FrozenSet[str]
+    after: typing.FrozenSet[str]
+    qualname: str
+    seq: int
+    stats: typing.Optional[LatencyStats]
+    # ITEM_MAP, ITEM_DROP or ITEM_CHUNK, see ItemFilterHook
+    item_kind: str
+    concurrency: int
+    ordered: bool
+    # condition on the arguments of the call, see CallbackIndex
+    when: typing.Optional["T_CONDITIONS"]
+    # the object of the calls where the callback applies, see InstanceCallbacks
+    scope: typing.Optional[weakref.ReferenceType]
+    scope_id: int
+
+
+HOOK_REF_SLOTS = (
+    *CALLING_OPTIONS,
+    "kind",
+    "priority",
+    "before",
+    "after",
+    "qualname",
+    "seq",
+    # LatencyStats of the callback when the hook is instrumented
+    "stats",
+    "item_kind",
+    "concurrency",
+    "ordered",
+    "when",
+    "scope",
+    "scope_id",
+)
+
+
+class HookRef(HookRefMixin, weakref.ref):
+    """Weak reference to a callback, with the options of the callback"""
+
+    __slots__ = HOOK_REF_SLOTS
+
+
+class HookMethodRef(HookRefMixin, weakref.WeakMethod):
+    """Weak reference to a bound method callback, with the options of the callback"""
+
+    __slots__ = HOOK_REF_SLOTS
+
+
+class StrongRef(HookRefMixin, weakref.ref):
+    """Reference to a callback registered with weak=False, with the options of the
+    callback. The callback, and the instance of a bound method, are kept alive until
+    the callback is unregistered: the weakref never dies, and the unrolled dispatch
+    function reads the callback attribute instead of calling the weakref.
+    """
+
+    __slots__ = (*HOOK_REF_SLOTS, "callback")
+
+    def __init__(self, callback: typing.Callable):
+        # weakref.ref.__new__ has set the referent
+        self.callback = callback
+
+
+HOOK_REF = typing.Union[HookRef, HookMethodRef, StrongRef]
+
+
+def make_strong_ref(weakref_hook: HOOK_REF) -> typing.Optional[StrongRef]:
+    """Return a StrongRef with the options of weakref_hook, None if the callback is
+    dead. The order of the callbacks is kept: the StrongRef has the same seq.
+    """
+    o = weakref_hook()
+    if o is None:
+        return None
+    strong_ref = StrongRef(o)
+    for slot in HOOK_REF_SLOTS:
+        setattr(strong_ref, slot, getattr(weakref_hook, slot))
+    strong_ref.strong = True
+    strong_ref.kind = tuple(getattr(strong_ref, option) for option in CALLING_OPTIONS)
+    return strong_ref
+
+
+def get_positional_arity(f: typing.Callable) -> typing.Optional[int]:
+    """Return the number of positional parameters of f, None if unknown"""
+    try:
+        parameters = inspect.signature(f).parameters.values()
+    except (TypeError, ValueError):
+        return None
+    return sum(
+        p.kind in (p.POSITIONAL_ONLY, p.POSITIONAL_OR_KEYWORD) for p in parameters
+    )
+
+
+def is_module_function(f: typing.Callable) -> bool:
+    """Return True if f is a function defined by a def at the top level of a module:
+    such a function usually lives as long as the program.
+    """
+    return (
+        inspect.isfunction(f)
+        and f.__qualname__ == f.__name__
+        and f.__name__ != "<lambda>"
+    )
+
+
+def set_callback_options(
+    weakref_hook: HOOK_REF, options: typing.Dict[str, typing.Any]
+) -> None:
+    weakref_hook.batch = options.get("batch", False)
+    weakref_hook.deferred = options.get("deferred", False)
+    weakref_hook.process = options.get("process", False)
+    weakref_hook.context = options.get("context", False)
+    weakref_hook.scope = options.get("scope")
+    weakref_hook.scope_id = options.get("scope_id", 0)
+    weakref_hook.scoped = weakref_hook.scope is not None
+    weakref_hook.strong = isinstance(weakref_hook, StrongRef)
+    weakref_hook.is_async = options.get("is_async", False)
+    weakref_hook.kind = tuple(
+        getattr(weakref_hook, option) for option in CALLING_OPTIONS
+    )
+    weakref_hook.priority = options.get("priority", 0)
+    weakref_hook.before = options.get("before", frozenset())
+    weakref_hook.after = options.get("after", frozenset())
+    weakref_hook.qualname = options.get("qualname", "")
+    weakref_hook.seq = next(CALLBACK_SEQ)
+    weakref_hook.stats = None
+    weakref_hook.item_kind = options.get("item_kind", ITEM_MAP)
+    weakref_hook.concurrency = options.get("concurrency", 1)
+    weakref_hook.ordered = options.get("ordered", True)
+    weakref_hook.when = options.get("when")
+
+
+# registration order of the callbacks, see sort_callbacks
+CALLBACK_SEQ = itertools.count()
+
+
+def get_qualnames(constraints: T_CONSTRAINTS) -> typing.FrozenSet[str]:
+    if constraints is None:
+        return frozenset()
+    if isinstance(constraints, str) or callable(constraints):
+        constraints = [constraints]  # type: ignore
+    return frozenset(
+        c if isinstance(c, str) else c.__qualname__ for c in constraints  # type: ignore
+    )
+
+
+def insert_callback(
+    hook_tuple: typing.Tuple[HOOK_REF, ...], weakref_hook: HOOK_REF
+) -> typing.Tuple[HOOK_REF, ...]:
+    """Return a new chain with weakref_hook, see sort_callbacks.
+
+    Without before/after constraints, the chain is sorted by priority: a binary search
+    finds the position of the new callback.
+    """
+    if (
+        weakref_hook.before
+        or weakref_hook.after
+        or any(w.before or w.after for w in hook_tuple)
+    ):
+        return sort_callbacks(hook_tuple + (weakref_hook,))
+    # bisect_right on the priorities
+    lo, hi = 0, len(hook_tuple)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if weakref_hook.priority < hook_tuple[mid].priority:
+            hi = mid
+        else:
+            lo = mid + 1
+    return hook_tuple[:lo] + (weakref_hook,) + hook_tuple[lo:]
+
+
+def callback_key(o: typing.Callable) -> typing.Tuple[int, int]:
+    """Return a key equal for the callbacks equal to o, without hashing o: the bound
+    methods of the same object and function are equal.
+    """
+    if inspect.ismethod(o):
+        return id(o.__self__), id(o.__func__)
+    return id(o), 0
+
+
+def merge_callbacks(
+    hook_tuple: typing.Tuple[HOOK_REF, ...],
+    added: typing.Iterable[HOOK_REF],
+    removed: typing.Iterable[HOOK_REF],
+) -> typing.Tuple[HOOK_REF, ...]:
+    """Return a new chain without removed and with the callbacks of added which are not
+    in the chain yet, sorted once, see sort_callbacks.
+    """
+    removed_ids = {id(w) for w in removed}
+    chain = [w for w in hook_tuple if id(w) not in removed_ids]
+    changed = len(chain) != len(hook_tuple)
+    keys = set()
+    for w in chain:
+        o = w()
+        if o is not None:
+            keys.add(callback_key(o))
+    for weakref_hook in added:
+        o = weakref_hook()
+        if o is not None and callback_key(o) not in keys:
+            keys.add(callback_key(o))
+            chain.append(weakref_hook)
+            changed = True
+    if not changed:
+        return hook_tuple
+    if any(w.before or w.after for w in chain):
+        return sort_callbacks(tuple(chain))
+    # a stable sort: the same order as insert_callback one callback at a time
+    return tuple(sorted(chain, key=lambda w: w.priority))
+
+
+def sort_callbacks(
+    callbacks: typing.Tuple[HOOK_REF, ...],
+) -> typing.Tuple[HOOK_REF, ...]:
+    """Sort the callbacks by priority then by registration order,
+    respecting the before/after constraints (topological sort).
+
+    A constraint refers to the __qualname__ of callbacks, for example "AClass.method"
+    matches the callbacks of all the instances of AClass.
+    Raise ValueError if the constraints are circular.
+    """
+    indexes: typing.Dict[str, typing.List[int]] = {}
+    for i, w in enumerate(callbacks):
+        indexes.setdefault(w.qualname, []).append(i)
+    successors: typing.List[typing.Set[int]] = [set() for _ in callbacks]
+    for i, w in enumerate(callbacks):
+        for qualname in w.before:
+            successors[i].update(indexes.get(qualname, ()))
+        for qualname in w.after:
+            for j in indexes.get(qualname, ()):
+                successors[j].add(i)
+    predecessor_count = [0] * len(callbacks)
+    for i, next_indexes in enumerate(successors):
+        next_indexes.discard(i)
+        for j in next_indexes:
+            predecessor_count[j] += 1
+
+    heap = [
+        (w.priority, w.seq, i)
+        for i, w in enumerate(callbacks)
+        if predecessor_count[i] == 0
+    ]
+    heapq.heapify(heap)
+    result = []
+    while heap:
+        _, _, i = heapq.heappop(heap)
+        result.append(callbacks[i])
+        for j in successors[i]:
+            predecessor_count[j] -= 1
+            if predecessor_count[j] == 0:
+                heapq.heappush(heap, (callbacks[j].priority, callbacks[j].seq, j))
+    if len(result) != len(callbacks):
+        raise ValueError("the before/after constraints of the callbacks are circular")
+    return tuple(result)
+
+
+T_HOOK_TYPES = typing.Dict[HookType, typing.Tuple[HOOK_REF, ...]]
+# None when the callbacks are called in a loop, otherwise the kind of each callback
+T_SHAPE = typing.Optional[typing.Tuple[typing.Tuple[bool, ...], ...]]
+
+
+class CallContext:
+    """State of one call, given to the callbacks registered with context=True.
+
+    result is the return value of the hooked function, then the result of each
+    FilterHook callback. scratch is shared by the callbacks of the call: a PreHook can
+    leave a state for a PostHook of the same call without a thread-local.
+    """
+
+    __slots__ = ("args", "kwargs", "result", "scratch")
+
+    def __init__(self, args: typing.Sequence, kwargs: T_KWARGS):
+        self.args = args
+        self.kwargs = kwargs
+        self.result: typing.Any = None
+        self.scratch: typing.Dict[str, typing.Any] = {}
+
+
+def uses_context(hook_types: "T_HOOK_TYPES") -> bool:
+    """Return True if a callback of hook_types is registered with context=True"""
+    return any(w.context for hook_tuple in hook_types.values() for w in hook_tuple)
+
+
+T_CONDITIONS = typing.Dict[typing.Union[str, typing.Callable], typing.Hashable]
+# the value of a parameter which is not given to the call and has no default value
+NO_ARGUMENT = object()
+
+
+def make_argument_getter(
+    name: str, function: typing.Optional[typing.Callable]
+) -> typing.Callable[[typing.Sequence, T_KWARGS], typing.Any]:
+    """Return a function reading the argument name of a call of function"""
+    position = None
+    default = NO_ARGUMENT
+    try:
+        parameters = inspect.signature(function).parameters if function else {}
+    except (TypeError, ValueError):
+        parameters = {}
+    for i, parameter in enumerate(parameters.values()):
+        if parameter.name == name:
+            if parameter.kind in (
+                inspect.Parameter.POSITIONAL_ONLY,
+                inspect.Parameter.POSITIONAL_OR_KEYWORD,
+            ):
+                position = i
+            if parameter.default is not inspect.Parameter.empty:
+                default = parameter.default
+            break
+
+    if position is None:
+        return lambda args, kwargs: kwargs.get(name, default)
+
+    def get(args: typing.Sequence, kwargs: T_KWARGS) -> typing.Any:
+        if position < len(args):  # type: ignore
+            return args[position]  # type: ignore
+        return kwargs.get(name, default)
+
+    return get
+
+
+def check_conditions(conditions: T_CONDITIONS, function: typing.Callable) -> None:
+    """Raise ValueError if a condition names no parameter of function"""
+    try:
+        parameters = inspect.signature(function).parameters.values()
+    except (TypeError, ValueError):
+        return
+    if any(p.kind == inspect.Parameter.VAR_KEYWORD for p in parameters):
+        return
+    names = {p.name for p in parameters if p.kind != inspect.Parameter.VAR_POSITIONAL}
+    for condition in conditions:
+        if isinstance(condition, str) and condition not in names:
+            raise ValueError(f"{condition!r} is not a parameter of {function}")
+
+
+def make_key_getter(
+    conditions: typing.Sequence[typing.Union[str, typing.Callable]],
+    function: typing.Optional[typing.Callable],
+) -> typing.Callable[[typing.Sequence, T_KWARGS], typing.Hashable]:
+    """Return a function reading the values of the conditions of a call: the value
+    when there is a single condition, the tuple of the values otherwise.
+
+    A condition is the name of a parameter of function, or a selector called with
+    the arguments of the call.
+    """
+    getters: typing.List[typing.Callable[[typing.Sequence, T_KWARGS], typing.Any]] = [
+        (
+            make_argument_getter(c, function)
+            if isinstance(c, str)
+            else (lambda c: lambda args, kwargs: c(*args, **kwargs))(c)
+        )
+        for c in conditions
+    ]
+    if len(getters) == 1:
+        return getters[0]
+    return lambda args, kwargs: tuple([get(args, kwargs) for get in getters])
+
+
+class CallbackIndex:
+    """Select the callbacks of a hook type for a call, according to their when condition.
+
+    The conditional callbacks are grouped by the parameters and selectors of their
+    condition: the values of a group are read once per call and looked up in a dict.
+    The chain of a call is the unconditional callbacks and the matching conditional
+    callbacks, in the order of the hook type. The chains are built once and cached.
+    """
+
+    __slots__ = ("hook_tuple", "fallback", "groups", "chains")
+
+    def __init__(
+        self,
+        hook_tuple: typing.Tuple[HOOK_REF, ...],
+        function: typing.Optional[typing.Callable],
+    ):
+        self.hook_tuple = hook_tuple
+        self.fallback = tuple(w for w in hook_tuple if w.when is None)
+        groups: typing.Dict[typing.FrozenSet, typing.Tuple[list, dict]] = {}
+        for w in hook_tuple:
+            if w.when is None:
+                continue
+            conditions = list(w.when)
+            if frozenset(conditions) not in groups:
+                groups[frozenset(conditions)] = (conditions, {})
+            conditions, index = groups[frozenset(conditions)]
+            values = [w.when[c] for c in conditions]
+            key = values[0] if len(values) == 1 else tuple(values)
+            index.setdefault(key, set()).add(id(w))
+        self.groups = tuple(
+            (make_key_getter(conditions, function), index)
+            for conditions, index in groups.values()
+        )
+        # the chains by the keys of the groups which match (None otherwise)
+        self.chains: typing.Dict[typing.Hashable, typing.Tuple[HOOK_REF, ...]] = {}
+        if len(self.groups) == 1:
+            ((_, index),) = self.groups
+            for key, ids in index.items():
+                self.chains[key] = self._chain(ids)
+
+    def _chain(self, ids: typing.Set[int]) -> typing.Tuple[HOOK_REF, ...]:
+        return tuple(w for w in self.hook_tuple if w.when is None or id(w) in ids)
+
+    def select(
+        self, args: typing.Sequence, kwargs: T_KWARGS
+    ) -> typing.Tuple[HOOK_REF, ...]:
+        """Return the callbacks to call with args and kwargs"""
+        if len(self.groups) == 1:
+            try:
+                return self.chains.get(self.groups[0][0](args, kwargs), self.fallback)
+            except TypeError:  # an unhashable value matches no condition
+                return self.fallback
+        keys: typing.List[typing.Optional[tuple]] = []
+        ids: typing.Set[int] = set()
+        for get, index in self.groups:
+            key = get(args, kwargs)
+            try:
+                matching = index.get(key)
+            except TypeError:
+                matching = None
+            if matching is None:
+                keys.append(None)
+            else:
+                keys.append((key,))
+                ids.update(matching)
+        if not ids:
+            return self.fallback
+        chains_key = tuple(keys)
+        chain = self.chains.get(chains_key)
+        if chain is None:
+            chain = self.chains[chains_key] = self._chain(ids)
+        return chain
+
+
+class InstanceEntry:
+    """The callbacks of one object, see InstanceCallbacks"""
+
+    __slots__ = ("scope", "hook_types", "chains")
+
+    def __init__(self, scope: weakref.ReferenceType, hook_types: "T_HOOK_TYPES"):
+        self.scope = scope
+        self.hook_types = hook_types
+        # (base chain, chain of the calls on the object) by hook type
+        self.chains: typing.Dict[HookType, typing.Tuple[tuple, tuple]] = {}
+
+
+class InstanceCallbacks:
+    """Callbacks which only apply to the calls on one object: the first argument of the
+    call (self) is the object, such as the callbacks of FilterHook(obj, "method").
+
+    The callbacks are indexed by the id of their object, so a call only resolves the
+    callbacks of its own object whatever the number of objects. The entries are
+    replaced, never modified, the readers don't take the lock of the hook.
+    """
+
+    __slots__ = ("entries", "counts", "context_count")
+
+    def __init__(self) -> None:
+        self.entries: typing.Dict[int, InstanceEntry] = {}
+        self.counts = {hook_type: 0 for hook_type in HookType}
+        # number of callbacks registered with context=True
+        self.context_count = 0
+
+    def state(self) -> typing.Tuple[typing.FrozenSet[HookType], bool]:
+        """Return the hook types which have callbacks, and if a callback uses a
+        CallContext: the dispatch function depends on them.
+        """
+        hook_types = frozenset(hook_type for hook_type, n in self.counts.items() if n)
+        return hook_types, self.context_count > 0
+
+    def get(self, obj: typing.Any) -> typing.Optional[InstanceEntry]:
+        entry = self.entries.get(id(obj))
+        if entry is not None and entry.scope() is obj:
+            return entry
+        return None
+
+    def select(
+        self,
+        hook_type: HookType,
+        base: typing.Tuple[HOOK_REF, ...],
+        args: typing.Sequence,
+    ) -> typing.Tuple[HOOK_REF, ...]:
+        """Return the chain of a call: base and the callbacks of args[0] in order"""
+        if not args:
+            return base
+        entry = self.entries.get(id(args[0]))
+        if entry is None or entry.scope() is not args[0]:
+            return base
+        callbacks = entry.hook_types[hook_type]
+        if not callbacks:
+            return base
+        cached = entry.chains.get(hook_type)
+        if cached is not None and cached[0] is base:
+            return cached[1]
+        chain = sort_callbacks(base + callbacks)
+        entry.chains[hook_type] = (base, chain)
+        return chain
+
+    def _set(
+        self,
+        key: int,
+        entry: typing.Optional[InstanceEntry],
+        scope: weakref.ReferenceType,
+        hook_types: "T_HOOK_TYPES",
+    ) -> None:
+        for sign, counted in ((-1, entry.hook_types if entry else {}), (1, hook_types)):
+            for hook_type, hook_tuple in counted.items():
+                self.counts[hook_type] += sign * len(hook_tuple)
+                self.context_count += sign * sum(w.context for w in hook_tuple)
+        if any(hook_types.values()):
+            self.entries[key] = InstanceEntry(scope, hook_types)
+        else:
+            self.entries.pop(key, None)
+
+    def add(
+        self,
+        obj: typing.Any,
+        hook_type: HookType,
+        weakref_hook: HOOK_REF,
+        on_dead: typing.Callable[[weakref.ReferenceType], None],
+    ) -> bool:
+        """Add the callback of obj, return False if it is already registered.
+
+        on_dead is called when obj is garbage collected, see remove_scope.
+        """
+        entry = self.get(obj)
+        if entry is None:
+            try:
+                scope = weakref.ref(obj, on_dead)
+            except TypeError:
+                raise ValueError(f"{obj!r} doesn't support weak references") from None
+            hook_types: T_HOOK_TYPES = {hook_type: () for hook_type in HookType}
+        else:
+            scope, hook_types = entry.scope, entry.hook_types
+        if weakref_hook in hook_types[hook_type]:
+            return False
+        hook_tuple = insert_callback(hook_types[hook_type], weakref_hook)
+        self._set(id(obj), entry, scope, {**hook_types, hook_type: hook_tuple})
+        return True
+
+    def remove(self, weakref_hooks: typing.Iterable[HOOK_REF]) -> None:
+        """Remove the callbacks, for example when they are garbage collected"""
+        for weakref_hook in weakref_hooks:
+            entry = self.entries.get(weakref_hook.scope_id)
+            if entry is not None:
+                hook_types = {
+                    hook_type: tuple(w for w in hook_tuple if w is not weakref_hook)
+                    for hook_type, hook_tuple in entry.hook_types.items()
+                }
+                self._set(weakref_hook.scope_id, entry, entry.scope, hook_types)
+
+    def remove_scope(self, key: int, scope: weakref.ReferenceType) -> None:
+        """Remove the callbacks of a garbage collected object"""
+        entry = self.entries.get(key)
+        if entry is not None and entry.scope is scope:
+            hook_types: T_HOOK_TYPES = {hook_type: () for hook_type in HookType}
+            self._set(key, entry, scope, hook_types)
+
+    def remove_callback(self, hook_type: HookType, func: F) -> bool:
+        """Remove func from the first object where it is registered"""
+        for key, entry in list(self.entries.items()):
+            hook_tuple = entry.hook_types[hook_type]
+            for i, weakref_hook in enumerate(hook_tuple):
+                if weakref_hook() == func:
+                    hook_tuple = hook_tuple[:i] + hook_tuple[i + 1 :]
+                    self._set(
+                        key,
+                        entry,
+                        entry.scope,
+                        {**entry.hook_types, hook_type: hook_tuple},
+                    )
+                    return True
+        return False
+
+    def callbacks(self) -> typing.Iterator[typing.Tuple[HookType, HOOK_REF]]:
+        for entry in list(self.entries.values()):
+            for hook_type, hook_tuple in entry.hook_types.items():
+                for weakref_hook in hook_tuple:
+                    yield hook_type, weakref_hook
+
+
+# (hook name, hook type value): the values of the enum are hashed faster
+T_LOCAL_KEY = typing.Tuple[str, str]
+
+
+class LocalScope:
+    """The callbacks registered in a Hook.scope() block, by hook name and hook type.
+
+    The scope is the value of LOCAL_SCOPE in the block: its callbacks are only called
+    in the contexts of the block, such as the asyncio tasks created in the block. A
+    nested scope also calls the callbacks of its parent. The callbacks are replaced,
+    never modified, the readers don't take the lock.
+    """
+
+    __slots__ = ("parent", "callbacks", "chains", "lock")
+
+    def __init__(self, parent: typing.Optional["LocalScope"]) -> None:
+        self.parent = parent
+        self.callbacks: typing.Dict[T_LOCAL_KEY, typing.Tuple[HOOK_REF, ...]] = {}
+        # (base chain, callbacks, chain of the calls) by key
+        self.chains: typing.Dict[T_LOCAL_KEY, tuple] = {}
+        self.lock = threading.Lock()
+
+    def get(self, key: T_LOCAL_KEY) -> typing.Tuple[HOOK_REF, ...]:
+        callbacks = self.callbacks.get(key, ())
+        if self.parent is not None:
+            return self.parent.get(key) + callbacks
+        return callbacks
+
+    def select(
+        self, key: T_LOCAL_KEY, base: typing.Tuple[HOOK_REF, ...]
+    ) -> typing.Tuple[HOOK_REF, ...]:
+        """Return the chain of a call: base and the callbacks of the scope in order"""
+        callbacks = self.get(key)
+        if not callbacks:
+            return base
+        cached = self.chains.get(key)
+        if cached is not None and cached[0] is base and cached[1] == callbacks:
+            return cached[2]
+        chain = sort_callbacks(base + callbacks)
+        self.chains[key] = (base, callbacks, chain)
+        return chain
+
+    def add(self, key: T_LOCAL_KEY, weakref_hook: HOOK_REF) -> None:
+        with self.lock:
+            hook_tuple = self.callbacks.get(key, ())
+            if weakref_hook not in hook_tuple:
+                self.callbacks = {
+                    **self.callbacks,
+                    key: insert_callback(hook_tuple, weakref_hook),
+                }
+
+    def remove(self, key: T_LOCAL_KEY, func: F) -> bool:
+        """Remove func, return False if it is not registered in the scope"""
+        with self.lock:
+            hook_tuple = self.callbacks.get(key, ())
+            for i, weakref_hook in enumerate(hook_tuple):
+                if weakref_hook() == func:
+                    self.callbacks = {
+                        **self.callbacks,
+                        key: hook_tuple[:i] + hook_tuple[i + 1 :],
+                    }
+                    return True
+        return False
+
+    def close(self) -> None:
+        """Drop the callbacks: the tasks created in the scope may still run"""
+        with self.lock:
+            self.callbacks = {}
+            self.chains = {}
+
+
+# the innermost active Hook.scope(), None outside of the scopes
+LOCAL_SCOPE: "ContextVar[typing.Optional[LocalScope]]" = ContextVar(
+    "yapyhook_local_scope", default=None
+)
+
+
+class Transaction:
+    """The callbacks added and removed in a Hook.transaction() block, by hook and hook
+    type: the chains of a hook are published once, at the end of the block.
+    """
+
+    __slots__ = ("changes", "closed")
+
+    def __init__(self) -> None:
+        # (added callbacks, removed callbacks) by hook type, by hook
+        self.changes: typing.Dict[
+            "Hook",
+            typing.Dict[HookType, typing.Tuple[typing.List[HOOK_REF], typing.List]],
+        ] = {}
+        # the tasks created in the block may outlive it, see Hook.transaction
+        self.closed = False
+
+    def get(
+        self, hook: "Hook", hook_type: HookType
+    ) -> typing.Tuple[typing.List[HOOK_REF], typing.List[HOOK_REF]]:
+        return self.changes.setdefault(hook, {}).setdefault(hook_type, ([], []))
+
+    def add(self, hook: "Hook", hook_type: HookType, weakref_hook: HOOK_REF) -> None:
+        """Add the callback, raise ValueError now if the constraints are circular"""
+        hook._sweep()
+        added, removed = self.get(hook, hook_type)
+        chain = hook.hook_types[hook_type] + tuple(added) + (weakref_hook,)
+        if any(w.before or w.after for w in chain):
+            sort_callbacks(chain)
+        added.append(weakref_hook)
+
+    def remove(self, hook: "Hook", hook_type: HookType, func: F) -> bool:
+        """Remove func, return False if it is neither added nor in the chain"""
+        hook._sweep()
+        added, removed = self.get(hook, hook_type)
+        for i, weakref_hook in enumerate(added):
+            if weakref_hook() == func:
+                del added[i]
+                return True
+        for weakref_hook in hook.hook_types[hook_type]:
+            if weakref_hook() == func and all(w is not weakref_hook for w in removed):
+                removed.append(weakref_hook)
+                return True
+        return False
+
+    def commit(self) -> None:
+        for hook, changes in self.changes.items():
+            hook._apply(changes)
+
+
+# the active Hook.transaction(), None outside of the transactions
+TRANSACTION: "ContextVar[typing.Optional[Transaction]]" = ContextVar(
+    "yapyhook_transaction", default=None
+)
+
+
+def first_result(results: typing.Optional[typing.Sequence]) -> typing.Any:
+    return results[0] if results else None
+
+
+def callback_coroutine(
+    hook_type: HookType,
+    weakref_hook: HOOK_REF,
+    o: typing.Callable,
+    return_value: typing.Any,
+    args: T_ARGS,
+    kwargs: T_KWARGS,
+    ctx: typing.Optional[CallContext] = None,
+) -> typing.Awaitable:
+    callback_args: typing.Sequence
+    if weakref_hook.scoped:
+        args = args[1:]
+    if weakref_hook.context:
+        callback_args, kwargs = (ctx,), {}
+    elif hook_type == HookType.PRECALL:
+        callback_args = ([args],) if weakref_hook.batch else args
+    elif weakref_hook.batch:
+        callback_args = ([return_value], [args])
+    else:
+        callback_args = (return_value, *args)
+    awaitable: typing.Awaitable
+    if weakref_hook.process:
+        # only a POSTCALL callback gets here, its result is not waited for
+        awaitable = Hook.PROCESS_EXECUTOR.submit_async(o, callback_args, kwargs)
+    elif weakref_hook.is_async:
+        awaitable = o(*callback_args, **kwargs)
+    else:
+        awaitable = call_sync(o, callback_args, kwargs)
+    if hook_type == HookType.PRECALL and weakref_hook.batch:
+        return first_result_async(awaitable)
+    return awaitable
+
+
+async def call_sync(o: typing.Callable, args: typing.Sequence, kwargs: T_KWARGS) -> T:
+    return o(*args, **kwargs)
+
+
+def schedule_coroutine(
+    coroutine: typing.Coroutine, background_tasks: typing.Set[asyncio.Future]
+) -> None:
+    """Run the coroutine of an async POSTCALL callback of a sync hook point.
+
+    The coroutine is scheduled as a task when an event loop is running in the current
+    thread, otherwise it runs until completion, see run_coroutine.
+    """
+    try:
+        loop = get_running_loop()
+    except RuntimeError:
+        run_coroutine(coroutine)
+        return
+    task = loop.create_task(coroutine)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    task.add_done_callback(report_background_exception)
+
+
+# the event loops running the coroutines of the threads without running event loop,
+# see run_coroutine
+COROUTINE_LOOPS = threading.local()
+
+
+def run_coroutine(coroutine: typing.Coroutine) -> None:
+    """Run the coroutine until completion in the current thread.
+
+    Unlike asyncio.run, the event loop is created once per thread and reused, and the
+    event loop of the thread is left untouched. The tasks still pending when the
+    coroutine completes are cancelled, the event loop is closed with its thread.
+    """
+    loop = getattr(COROUTINE_LOOPS, "loop", None)
+    if loop is None:
+        loop = COROUTINE_LOOPS.loop = asyncio.new_event_loop()
+        weakref.finalize(threading.current_thread(), loop.close)
+    try:
+        loop.run_until_complete(coroutine)
+    finally:
+        pending = all_tasks(loop)
+        for task in pending:
+            task.cancel()
+        if pending:
+            loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+
+
+async def first_result_async(results: typing.Awaitable) -> typing.Any:
+    return first_result(await results)
+
+
+async def concurrent_precall(
+    hook_tuple: typing.Tuple[HOOK_REF, ...],
+    args: T_ARGS,
+    kwargs: T_KWARGS,
+    ctx: typing.Optional[CallContext] = None,
+) -> typing.Any:
+    """Run the PRECALL callbacks concurrently, see DispatchPolicy.CONCURRENT.
+
+    Return the result of the first callback which short-circuits the call, or None.
+    If a callback raises an exception, the other callbacks are cancelled and the
+    exception is raised.
+    """
+    pending = set()
+    for w in hook_tuple:
+        o = w()
+        if o is not None:
+            coroutine = callback_coroutine(
+                HookType.PRECALL, w, o, None, args, kwargs, ctx
+            )
+            pending.add(asyncio.ensure_future(coroutine))
+    try:
+        while pending:
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                r = task.result()
+                if r is not None and r[0] is True:
+                    return r
+        return None
+    finally:
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.wait(pending)
+
+
+async def concurrent_postcall(
+    hook_tuple: typing.Tuple[HOOK_REF, ...],
+    return_value: typing.Any,
+    args: T_ARGS,
+    kwargs: T_KWARGS,
+    ctx: typing.Optional[CallContext] = None,
+) -> None:
+    """Run the POSTCALL callbacks concurrently, see DispatchPolicy.CONCURRENT.
+
+    All the callbacks run until completion, then the exception of the first failed
+    callback in the chain is raised.
+    """
+    coroutines = []
+    for w in hook_tuple:
+        o = w()
+        if o is not None:
+            coroutines.append(
+                callback_coroutine(
+                    HookType.POSTCALL, w, o, return_value, args, kwargs, ctx
+                )
+            )
+    for r in await asyncio.gather(*coroutines, return_exceptions=True):
+        if isinstance(r, BaseException):
+            raise r
+
+
+def background_postcall(
+    hook_tuple: typing.Tuple[HOOK_REF, ...],
+    return_value: typing.Any,
+    args: T_ARGS,
+    kwargs: T_KWARGS,
+    background_tasks: typing.Set[asyncio.Future],
+    ctx: typing.Optional[CallContext] = None,
+) -> None:
+    """Schedule the POSTCALL callbacks as tasks, see DispatchPolicy.BACKGROUND.
+
+    The exceptions are given to the exception handler of the event loop.
+    """
+    for w in hook_tuple:
+        o = w()
+        if o is not None:
+            task = asyncio.ensure_future(
+                callback_coroutine(
+                    HookType.POSTCALL, w, o, return_value, args, kwargs, ctx
+                )
+            )
+            background_tasks.add(task)
+            task.add_done_callback(background_tasks.discard)
+            task.add_done_callback(report_background_exception)
+
+
+def report_background_exception(task: asyncio.Future) -> None:
+    if not task.cancelled() and task.exception() is not None:
+        asyncio.get_event_loop().call_exception_handler(
+            {
+                "message": "Exception in a background PostHook",
+                "exception": task.exception(),
+                "future": task,
+            }
+        )
+
+
+# kinds of ItemFilterHook callbacks
+ITEM_MAP = "map"
+ITEM_DROP = "drop"
+ITEM_CHUNK = "chunk"
+# number of items given to the ItemFilterHook(..., chunked=True) callbacks
+ITEM_CHUNK_SIZE = 256
+
+T_ITEM_STEPS = typing.List[typing.Tuple[str, typing.Callable]]
+
+
+def apply_item_steps(
+    steps: T_ITEM_STEPS, items: typing.List, args: tuple, kwargs: T_KWARGS
+) -> typing.List:
+    for item_kind, o in steps:
+        if item_kind == ITEM_CHUNK:
+            items = o(items, *args, **kwargs)
+        elif item_kind == ITEM_DROP:
+            items = [item for item in items if not o(item, *args, **kwargs)]
+        else:
+            items = [o(item, *args, **kwargs) for item in items]
+    return items
+
+
+def item_pipeline_items(
+    steps: T_ITEM_STEPS, result: typing.Iterable, args: tuple, kwargs: T_KWARGS
+) -> typing.Iterator:
+    for item in result:
+        for item_kind, o in steps:
+            if item_kind == ITEM_DROP:
+                if o(item, *args, **kwargs):
+                    break
+            else:
+                item = o(item, *args, **kwargs)
+        else:
+            yield item
+
+
+def item_pipeline_chunks(
+    steps: T_ITEM_STEPS, result: typing.Iterable, args: tuple, kwargs: T_KWARGS
+) -> typing.Iterator:
+    iterator = iter(result)
+    while True:
+        chunk = list(itertools.islice(iterator, ITEM_CHUNK_SIZE))
+        if not chunk:
+            return
+        yield from apply_item_steps(steps, chunk, args, kwargs)
+
+
+async def item_pipeline_async(
+    steps: T_ITEM_STEPS, result: typing.AsyncIterable, args: tuple, kwargs: T_KWARGS
+) -> typing.AsyncIterator:
+    try:
+        if not any(item_kind == ITEM_CHUNK for item_kind, _ in steps):
+            async for item in result:
+                for item_kind, o in steps:
+                    if item_kind == ITEM_DROP:
+                        if o(item, *args, **kwargs):
+                            break
+                    else:
+                        item = o(item, *args, **kwargs)
+                else:
+                    yield item
+            return
+        chunk = []
+        async for item in result:
+            chunk.append(item)
+            if len(chunk) == ITEM_CHUNK_SIZE:
+                for item in apply_item_steps(steps, chunk, args, kwargs):
+                    yield item
+                chunk = []
+        for item in apply_item_steps(steps, chunk, args, kwargs):
+            yield item
+    finally:
+        # when the consumer stops early, the source is closed too
+        aclose = getattr(result, "aclose", None)
+        if aclose is not None:
+            await aclose()
+
+
+async def iterate_async(result: typing.Iterable) -> typing.AsyncIterator:
+    for item in result:
+        yield item
+
+
+async def item_stage_concurrent(
+    o: typing.Callable,
+    item_kind: str,
+    concurrency: int,
+    ordered: bool,
+    source: typing.AsyncIterable,
+    args: tuple,
+    kwargs: T_KWARGS,
+) -> typing.AsyncIterator:
+    """Call the async ItemFilterHook callback o on up to concurrency items at a time.
+
+    A new item is read from source only when less than concurrency items are in flight:
+    a slow consumer slows down the source. With ordered=False, the items are yielded
+    as soon as the callback returns. When the consumer stops, the calls in flight are
+    cancelled and source is closed.
+    """
+
+    async def call(item: typing.Any) -> typing.Tuple[typing.Any, typing.Any]:
+        return item, await o(item, *args, **kwargs)
+
+    iterator = source.__aiter__()
+    pending: typing.Deque[asyncio.Future] = collections.deque()
+    exhausted = False
+    try:
+        while True:
+            while not exhausted and len(pending) < concurrency:
+                try:
+                    item = await iterator.__anext__()
+                except StopAsyncIteration:
+                    exhausted = True
+                else:
+                    pending.append(asyncio.ensure_future(call(item)))
+            if not pending:
+                return
+            if ordered:
+                task = pending[0]
+                await asyncio.wait([task])
+                pending.popleft()
+            else:
+                done, _ = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                # the first item in input order among the completed ones
+                task = next(task for task in pending if task in done)
+                pending.remove(task)
+            item, value = task.result()
+            if item_kind != ITEM_DROP:
+                yield value
+            elif not value:
+                yield item
+    finally:
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.wait(pending)
+        aclose = getattr(iterator, "aclose", None)
+        if aclose is not None:
+            await aclose()
+
+
+def item_pipeline_streaming(
+    hook_tuple: typing.Tuple[HOOK_REF, ...],
+    result: typing.Any,
+    args: tuple,
+    kwargs: T_KWARGS,
+) -> typing.AsyncIterator:
+    """Apply ItemFilterHook callbacks including async callbacks: the result is an
+    async iterator. The consecutive sync callbacks are applied in a single loop, each
+    async callback is applied by item_stage_concurrent.
+    """
+    stream = result if hasattr(result, "__aiter__") else iterate_async(result)
+    sync_steps: T_ITEM_STEPS = []
+    for weakref_hook in hook_tuple:
+        o = weakref_hook()
+        if o is None:
+            continue
+        if not weakref_hook.is_async:
+            sync_steps.append((weakref_hook.item_kind, o))
+            continue
+        if sync_steps:
+            stream = item_pipeline_async(sync_steps, stream, args, kwargs)
+            sync_steps = []
+        stream = item_stage_concurrent(
+            o,
+            weakref_hook.item_kind,
+            weakref_hook.concurrency,
+            weakref_hook.ordered,
+            stream,
+            args,
+            kwargs,
+        )
+    if sync_steps:
+        stream = item_pipeline_async(sync_steps, stream, args, kwargs)
+    return stream
+
+
+def item_pipeline_loop(
+    hook_tuple: typing.Tuple[HOOK_REF, ...],
+    result: typing.Any,
+    args: tuple,
+    kwargs: T_KWARGS,
+) -> typing.Any:
+    """Apply the ItemFilterHook callbacks to the items of result in one loop.
+
+    The callbacks are resolved once per call. With a chunked callback, the items are
+    read by chunks of ITEM_CHUNK_SIZE items.
+    """
+    if any(weakref_hook.is_async for weakref_hook in hook_tuple):
+        return item_pipeline_streaming(hook_tuple, result, args, kwargs)
+    steps: T_ITEM_STEPS = []
+    for weakref_hook in hook_tuple:
+        o = weakref_hook()
+        if o is not None:
+            steps.append((weakref_hook.item_kind, o))
+    if hasattr(result, "__aiter__"):
+        return item_pipeline_async(steps, result, args, kwargs)
+    if any(item_kind == ITEM_CHUNK for item_kind, _ in steps):
+        return item_pipeline_chunks(steps, result, args, kwargs)
+    return item_pipeline_items(steps, result, args, kwargs)
+
+
+def compile_item_pipeline(
+    hook_tuple: typing.Tuple[HOOK_REF, ...],
+) -> typing.Callable[[typing.Any, tuple, T_KWARGS], typing.Any]:
+    """Compile item_pipeline(result, args, kwargs) applying the ItemFilterHook callbacks.
+
+    Up to ITEM_UNROLL_LIMIT map and drop callbacks, the calls are unrolled in the
+    loop over a sync iterable, otherwise item_pipeline_loop is used.
+    """
+    # the async callbacks are applied by item_pipeline_loop
+    item_kinds = tuple(ITEM_CHUNK if w.is_async else w.item_kind for w in hook_tuple)
+    namespace: typing.Dict[str, typing.Any] = {
+        "hook_tuple": hook_tuple,
+        "item_pipeline_loop": item_pipeline_loop,
+    }
+    for i, weakref_hook in enumerate(hook_tuple):
+        namespace[f"item_{i}"] = weakref_hook
+    exec(compile_item_pipeline_code(item_kinds), namespace)
+    return namespace["item_pipeline"]
+
+
+# above this number of ItemFilterHook callbacks, the items loop over the callbacks
+ITEM_UNROLL_LIMIT = 32
+# up to this number of positional arguments and without kwargs, the arguments are given
+# to the ItemFilterHook callbacks as local variables rather than with *args
+ITEM_UNPACKED_ARGS = 3
+
+
+@lru_cache(maxsize=None)
+def compile_item_pipeline_code(item_kinds: typing.Tuple[str, ...]) -> types.CodeType:
+    if len(item_kinds) > ITEM_UNROLL_LIMIT or ITEM_CHUNK in item_kinds:
+        lines = [
+            "def item_pipeline(result, args, kwargs):",
+            "    return item_pipeline_loop(hook_tuple, result, args, kwargs)",
+        ]
+        return compile("\n".join(lines), "<yapyhook item pipeline>", "exec")
+
+    callbacks = [f"o_{i}" for i in range(len(item_kinds))]
+    resolved = [f"item_{i}()" for i in range(len(item_kinds))]
+    lines = [
+        "def item_pipeline(result, args, kwargs):",
+        '    if hasattr(result, "__aiter__"):',
+        "        return item_pipeline_loop(hook_tuple, result, args, kwargs)",
+        "    if kwargs:",
+        f"        return fused_kwargs({', '.join(['result', 'args', 'kwargs', *resolved])})",
+    ]
+    for arity in range(ITEM_UNPACKED_ARGS + 1):
+        unpacked = [f"args[{j}]" for j in range(arity)]
+        lines.append(f"    if len(args) == {arity}:")
+        lines.append(
+            f"        return fused_{arity}({', '.join(['result', *unpacked, *resolved])})"
+        )
+    lines.append(f"    return fused_args({', '.join(['result', 'args', *resolved])})")
+
+    fused_functions = [
+        ("fused_kwargs", ["args", "kwargs"], "item, *args, **kwargs"),
+        ("fused_args", ["args"], "item, *args"),
+    ]
+    for arity in range(ITEM_UNPACKED_ARGS + 1):
+        parameters = [f"a{j}" for j in range(arity)]
+        fused_functions.append(
+            (f"fused_{arity}", parameters, ", ".join(["item", *parameters]))
+        )
+    for name, parameters, call_args in fused_functions:
+        lines.append(f"def {name}({', '.join(['result', *parameters, *callbacks])}):")
+        lines.append("    for item in result:")
+        for i, item_kind in enumerate(item_kinds):
+            if item_kind == ITEM_DROP:
+                lines.append(f"        if o_{i} is not None and o_{i}({call_args}):")
+                lines.append("            continue")
+            else:
+                lines.append(f"        if o_{i} is not None:")
+                lines.append(f"            item = o_{i}({call_args})")
+        lines.append("        yield item")
+    return compile("\n".join(lines), "<yapyhook item pipeline>", "exec")
+
+
+def generate_callback_call(
+    hook_type: HookType,
+    options: typing.Dict[str, bool],
+    is_coroutine: bool,
+    with_kwargs: bool,
+    arity: typing.Optional[int] = None,
+) -> str:
+    """Generate the expression calling the callback o, options are CALLING_OPTIONS.
+
+    With arity, the positional arguments are the variables a0, a1, ... unpacked from
+    args: a call with *args builds a new tuple.
+    """
+    aw = "await " if options["is_async"] else ""
+    kwargs = ", **kwargs" if with_kwargs else ""
+    if options["context"]:
+        if options["deferred"]:
+            return "deferred_submit(o, (ctx,), {})"
+        if options["is_async"] and not is_coroutine:
+            return "schedule_coroutine(o(ctx), background_tasks)"
+        return f"{aw}o(ctx)"
+    first = 1 if options["scoped"] else 0
+    if arity is None:
+        args = "*args[1:]" if options["scoped"] else "*args"
+    else:
+        args = ", ".join(f"a{i}" for i in range(first, arity))
+    if hook_type == HookType.PRECALL:
+        if options["batch"]:
+            return f"first_result({aw}o([args]{kwargs}))"
+        return f"{aw}o({args}{kwargs})"
+    if options["batch"]:
+        callback_args = "[return_value], [args]"
+    else:
+        callback_args = ", ".join(["return_value", args] if args else ["return_value"])
+    if options["deferred"]:
+        return f"deferred_submit(o, ({callback_args},), kwargs)"
+    if options["process"]:
+        if hook_type == HookType.POSTCALL:
+            # the event loop must not wait for room in the process pool
+            submit = "await process_submit_async" if is_coroutine else "process_submit"
+            return f"{submit}(o, ({callback_args},), kwargs)"
+        return f"await process_call(o, ({callback_args},), kwargs)"
+    if options["is_async"] and not is_coroutine:
+        return f"schedule_coroutine(o({callback_args}{kwargs}), background_tasks)"
+    if options["batch"] and hook_type == HookType.FILTERCALL:
+        return f"({aw}o({callback_args}{kwargs}))[0]"
+    return f"{aw}o({callback_args}{kwargs})"
+
+
+def generate_dispatch_body(
+    is_coroutine: bool,
+    shapes: typing.Dict[HookType, T_SHAPE],
+    policies: typing.Dict[HookType, DispatchPolicy],
+    with_kwargs: bool,
+    indent: str,
+    instrumented: bool = False,
+    item_filters: bool = False,
+    context: bool = False,
+    indexed: typing.FrozenSet[HookType] = frozenset(),
+    scoped: typing.FrozenSet[HookType] = frozenset(),
+    local: typing.FrozenSet[HookType] = frozenset(),
+    arity: typing.Optional[int] = None,
+) -> typing.List[str]:
+    """Generate the statements calling the callbacks and the hooked function.
+
+    With arity, args has arity items unpacked as a0, a1, ... see generate_callback_call.
+
+    The hooks are named pre_0, pre_1, ... filter_0, ... post_0, ... in the namespace
+    when they are unrolled, or pre_hooks, filter_hooks, post_hooks otherwise.
+
+    With context, a CallContext named ctx is created for the call and ctx.result
+    follows return_value.
+
+    The callbacks of the indexed hook types are selected for the call by the
+    CallbackIndex pre_index, filter_index, post_index, then called in a loop. The
+    callbacks of the object of the call are added for the scoped hook types, see
+    InstanceCallbacks, and the callbacks of the active Hook.scope() named scope are
+    added for the local hook types, see LocalScope.
+
+    When instrumented, the latency of each call is recorded in the LatencyStats of the
+    callback (w.stats) and in function_stats, see Hook.instrument.
+
+    The dead callbacks are removed by DeadCallbacks: the dispatch function only skips
+    a callback which has been garbage collected after the snapshot has been published.
+    """
+    lines: typing.List[str] = []
+
+    def emit(line: str, level: int = 0) -> None:
+        lines.append(indent + "    " * level + line)
+
+    def call(hook_type: HookType, kind: typing.Tuple[bool, ...], ref: str) -> str:
+        options = dict(zip(CALLING_OPTIONS, kind))
+        expression = generate_callback_call(
+            hook_type, options, is_coroutine, with_kwargs, arity
+        )
+        if instrumented:
+            return f"record_latency({ref}.stats, perf_counter(), {expression})"
+        return expression
+
+    def is_strong(kind: typing.Tuple[bool, ...]) -> bool:
+        return kind[CALLING_OPTIONS.index("strong")]
+
+    def emit_short_circuit(ref: typing.Optional[str], level: int) -> None:
+        if instrumented:
+            emit("total_stats.short_circuits += 1", level)
+            if ref is not None:
+                emit(f"{ref}.stats.short_circuits += 1", level)
+
+    def emit_loop_call(hook_type: HookType, statement: str, level: int) -> None:
+        for line in generate_loop_call(hook_type, statement, ()):
+            emit(line, level)
+
+    def generate_loop_call(
+        hook_type: HookType, statement: str, kind: typing.Tuple[bool, ...]
+    ) -> typing.List[str]:
+        """In a loop, the calling convention is selected according to w.kind"""
+        if len(kind) == len(CALLING_OPTIONS):
+            return [statement.format(call(hook_type, kind, "w"))]
+        option = CALLING_OPTIONS[len(kind)]
+        if_false = generate_loop_call(hook_type, statement, kind + (False,))
+        if (
+            hook_type not in CALLING_OPTIONS_HOOK_TYPES[option]
+            # Hook.register rejects these callbacks
+            or (option == "deferred" and is_coroutine)
+            or (
+                option == "process"
+                and (
+                    kind[CALLING_OPTIONS.index("batch")]
+                    or kind[CALLING_OPTIONS.index("deferred")]
+                    or (hook_type == HookType.FILTERCALL and not is_coroutine)
+                )
+            )
+            or (option == "context" and kind[CALLING_OPTIONS.index("batch")])
+            or (option == "scoped" and hook_type not in scoped)
+            or (
+                option == "is_async"
+                and not is_coroutine
+                and hook_type != HookType.POSTCALL
+            )
+        ):
+            return if_false
+        if_true = generate_loop_call(hook_type, statement, kind + (True,))
+        if if_true == if_false:
+            return if_true
+        return [
+            f"if w.{option}:",
+            *("    " + line for line in if_true),
+            "else:",
+            *("    " + line for line in if_false),
+        ]
+
+    if arity is not None:
+        call_f = f"f({', '.join(f'a{i}' for i in range(arity))})"
+    else:
+        call_f = "f(*args, **kwargs)" if with_kwargs else "f(*args)"
+    call_f = ("await " if is_coroutine else "") + call_f
+    if instrumented:
+        call_f = f"record_latency(function_stats, perf_counter(), {call_f})"
+    ctx = ", ctx" if context else ""
+    if context:
+        emit("ctx = CallContext(args, kwargs)")
+
+    def emit_select(hook_type: HookType, prefix: str) -> None:
+        base = f"{prefix}_all"
+        if hook_type in indexed:
+            base = f"{prefix}_index.select(args, kwargs)"
+        if hook_type in scoped:
+            base = f"instances.select({prefix}_type, {base}, args)"
+        if hook_type in local:
+            base = f"scope.select({prefix}_key, {base})"
+        if hook_type in indexed or hook_type in scoped or hook_type in local:
+            emit(f"{prefix}_hooks = {base}")
+
+    # PRECALL
+    emit_select(HookType.PRECALL, "pre")
+    pre_shape = shapes[HookType.PRECALL]
+    if pre_shape != () and policies[HookType.PRECALL] == DispatchPolicy.CONCURRENT:
+        emit(f"r = await concurrent_precall(pre_hooks, args, kwargs{ctx})")
+        emit("if r is not None and r[0] is True:")
+        emit_short_circuit(None, 1)
+        emit("return_value = r[1]", 1)
+        emit("else:")
+        emit(f"return_value = {call_f}", 1)
+    elif pre_shape is None:
+        emit("for w in pre_hooks:")
+        emit("o = w()", 1)
+        emit("if o is None:", 1)
+        emit("continue", 2)
+        emit_loop_call(HookType.PRECALL, "r = {}", 1)
+        emit("if r is not None and r[0] is True:", 1)
+        emit_short_circuit("w", 2)
+        emit("return_value = r[1]", 2)
+        emit("break", 2)
+        emit("else:")
+        emit(f"return_value = {call_f}", 1)
+    else:
+        for i, kind in enumerate(pre_shape):
+            expression = call(HookType.PRECALL, kind, f"pre_{i}")
+            if is_strong(kind):
+                emit(f"o = pre_{i}.callback", i)
+                emit(f"r = {expression}", i)
+            else:
+                emit(f"o = pre_{i}()", i)
+                emit(f"r = None if o is None else {expression}", i)
+            emit("if r is not None and r[0] is True:", i)
+            emit_short_circuit(f"pre_{i}", i + 1)
+            emit("return_value = r[1]", i + 1)
+            emit("else:", i)
+        emit(f"return_value = {call_f}", len(pre_shape))
+
+    # ITEMFILTERCALL
+    if item_filters:
+        emit("return_value = item_pipeline(return_value, args, kwargs)")
+    if context:
+        emit("ctx.result = return_value")
+
+    # FILTERCALL and POSTCALL
+    for hook_type, prefix, statement in (
+        (
+            HookType.FILTERCALL,
+            "filter",
+            "return_value = ctx.result = {}" if context else "return_value = {}",
+        ),
+        (HookType.POSTCALL, "post", "{}"),
+    ):
+        emit_select(hook_type, prefix)
+        shape = shapes[hook_type]
+        policy = policies.get(hook_type, DispatchPolicy.SEQUENTIAL)
+        if shape != () and policy == DispatchPolicy.CONCURRENT:
+            emit(
+                "await concurrent_postcall("
+                f"post_hooks, return_value, args, kwargs{ctx})"
+            )
+        elif shape != () and policy == DispatchPolicy.BACKGROUND:
+            emit(
+                "background_postcall("
+                f"post_hooks, return_value, args, kwargs, background_tasks{ctx})"
+            )
+        elif shape is None:
+            emit(f"for w in {prefix}_hooks:")
+            emit("o = w()", 1)
+            emit("if o is not None:", 1)
+            emit_loop_call(hook_type, statement, 2)
+        else:
+            for i, kind in enumerate(shape):
+                expression = call(hook_type, kind, f"{prefix}_{i}")
+                if is_strong(kind):
+                    emit(f"o = {prefix}_{i}.callback")
+                    emit(statement.format(expression))
+                else:
+                    emit(f"o = {prefix}_{i}()")
+                    emit("if o is not None:")
+                    emit(statement.format(expression), 1)
+
+    emit("return return_value")
+    return lines
+
+
+def compile_dispatch(hook: "Hook", instrumented: bool = False) -> typing.Callable:
+    """Compile a function dispatch(f, args, kwargs) specialized for the callbacks.
+
+    Up to DISPATCH_UNROLL_LIMIT callbacks per hook type, the calls are unrolled:
+    there is no generator, no loop and no kwargs dict when kwargs is empty. When
+    a callback has a when condition or a callback is registered on an object, the
+    hook type is called in a loop over the callbacks selected for the call. A frozen
+    hook unrolls up to FROZEN_UNROLL_LIMIT callbacks and unpacks the positional
+    arguments of the hooked function, see Hook.freeze.
+
+    The namespace must not reference the hook: the hook references the dispatch function.
+    """
+    hook_types = hook.hook_types
+    instrumentation = hook.instrumentation
+    namespace: typing.Dict[str, typing.Any] = {
+        "first_result": first_result,
+        "concurrent_precall": concurrent_precall,
+        "concurrent_postcall": concurrent_postcall,
+        "background_postcall": background_postcall,
+        "background_tasks": hook.background_tasks,
+        "deferred_submit": Hook.DEFERRED_EXECUTOR.submit,
+        "process_submit": Hook.PROCESS_EXECUTOR.submit,
+        "process_submit_async": Hook.PROCESS_EXECUTOR.submit_async,
+        "process_call": Hook.PROCESS_EXECUTOR.call,
+        "schedule_coroutine": schedule_coroutine,
+        "CallContext": CallContext,
+    }
+    if instrumented and instrumentation is not None:
+        namespace.update(
+            record_latency=record_latency,
+            perf_counter=time.perf_counter,
+            total_stats=instrumentation.total,
+            function_stats=instrumentation.function,
+        )
+        for hook_type, hook_tuple in hook_types.items():
+            for weakref_hook in hook_tuple:
+                weakref_hook.stats = instrumentation.callbacks.setdefault(
+                    (hook_type, weakref_hook.qualname), LatencyStats()
+                )
+        for hook_type, weakref_hook in hook.instances.callbacks():
+            weakref_hook.stats = instrumentation.callbacks.setdefault(
+                (hook_type, weakref_hook.qualname), LatencyStats()
+            )
+    shapes: typing.List[T_SHAPE] = []
+    indexed = set()
+    scoped, instances_context = hook.instances.state()
+    namespace["instances"] = hook.instances
+    function = hook._function() if hook._function is not None else None
+    for hook_type, prefix in (
+        (HookType.PRECALL, "pre"),
+        (HookType.FILTERCALL, "filter"),
+        (HookType.POSTCALL, "post"),
+    ):
+        hook_list = hook_types[hook_type]
+        namespace[f"{prefix}_hooks"] = namespace[f"{prefix}_all"] = hook_list
+        namespace[f"{prefix}_type"] = hook_type
+        namespace[f"{prefix}_key"] = (hook.name, hook_type.value)
+        if any(w.when is not None for w in hook_list):
+            namespace[f"{prefix}_index"] = CallbackIndex(hook_list, function)
+            indexed.add(hook_type)
+            shapes.append(None)
+        elif hook_type in scoped:
+            shapes.append(None)
+        elif len(hook_list) > (
+            FROZEN_UNROLL_LIMIT if hook.frozen else DISPATCH_UNROLL_LIMIT
+        ):
+            shapes.append(None)
+        else:
+            shapes.append(tuple(w.kind for w in hook_list))
+            for i, weakref_hook in enumerate(hook_list):
+                namespace[f"{prefix}_{i}"] = weakref_hook
+
+    item_hooks = hook_types[HookType.ITEMFILTERCALL]
+    if item_hooks:
+        namespace["item_pipeline"] = compile_item_pipeline(item_hooks)
+
+    local, local_context = hook.local_types, hook.local_context
+    if local:
+        namespace["get_scope"] = LOCAL_SCOPE.get
+    code = compile_dispatch_code(
+        hook.is_coroutine,
+        tuple(shapes),
+        hook.precall_policy,
+        hook.postcall_policy,
+        instrumented,
+        bool(item_hooks),
+        uses_context(hook_types) or instances_context or local_context,
+        frozenset(indexed),
+        scoped,
+        local,
+        get_positional_arity(function) if hook.frozen and function else None,
+    )
+    exec(code, namespace)
+    return namespace["dispatch"]
+
+
+@lru_cache(maxsize=None)
+def compile_dispatch_code(
+    is_coroutine: bool,
+    shapes: typing.Tuple[T_SHAPE, T_SHAPE, T_SHAPE],
+    precall_policy: DispatchPolicy,
+    postcall_policy: DispatchPolicy,
+    instrumented: bool = False,
+    item_filters: bool = False,
+    context: bool = False,
+    indexed: typing.FrozenSet[HookType] = frozenset(),
+    scoped: typing.FrozenSet[HookType] = frozenset(),
+    local: typing.FrozenSet[HookType] = frozenset(),
+    arity: typing.Optional[int] = None,
+) -> types.CodeType:
+    """Compile the module defining dispatch, for the (PRECALL, FILTERCALL, POSTCALL) shapes.
+
+    The code only depends on the shape of the chains, not on the callbacks themselves.
+    When a Hook.scope() has callbacks of the local hook types, the calls made in a
+    scope merge its callbacks, the other calls run the same code as without scopes.
+    With arity, the calls with arity positional arguments and no kwargs unpack args,
+    see Hook.freeze.
+    """
+    shapes_dict = dict(
+        zip((HookType.PRECALL, HookType.FILTERCALL, HookType.POSTCALL), shapes)
+    )
+    policies = {HookType.PRECALL: precall_policy, HookType.POSTCALL: postcall_policy}
+
+    def generate(
+        shapes: typing.Dict[HookType, T_SHAPE],
+        local: typing.FrozenSet[HookType],
+        indent: str,
+        arity: typing.Optional[int] = None,
+    ) -> typing.List[str]:
+        unpacked: typing.List[str] = []
+        if arity is not None:
+            names = "".join(f"a{i}, " for i in range(arity))
+            unpacked = [
+                indent + f"if len(args) == {arity}:",
+                *([indent + f"    {names}= args"] if arity else []),
+                *generate_dispatch_body(
+                    is_coroutine,
+                    shapes,
+                    policies,
+                    False,
+                    indent + " " * 4,
+                    instrumented,
+                    item_filters,
+                    context,
+                    indexed,
+                    scoped,
+                    local,
+                    arity,
+                ),
+            ]
+        return [
+            indent + "if kwargs:",
+            *generate_dispatch_body(
+                is_coroutine,
+                shapes,
+                policies,
+                True,
+                indent + " " * 4,
+                instrumented,
+                item_filters,
+                context,
+                indexed,
+                scoped,
+                local,
+            ),
+            *unpacked,
+            *generate_dispatch_body(
+                is_coroutine,
+                shapes,
+                policies,
+                False,
+                indent,
+                instrumented,
+                item_filters,
+                context,
+                indexed,
+                scoped,
+                local,
+            ),
+        ]
+
+    lines = [("async " if is_coroutine else "") + "def dispatch(f, args, kwargs):"]
+    if local:
+        lines += [
+            "    scope = get_scope()",
+            "    if scope is not None:",
+            *generate(
+                {
+                    hook_type: None if hook_type in local else shape
+                    for hook_type, shape in shapes_dict.items()
+                },
+                local,
+                " " * 8,
+            ),
+        ]
+        # the chains selected in the scope are local variables of dispatch
+        prefixes = {
+            HookType.PRECALL: "pre",
+            HookType.FILTERCALL: "filter",
+            HookType.POSTCALL: "post",
+        }
+        lines += [
+            f"    {prefixes[hook_type]}_hooks = {prefixes[hook_type]}_all"
+            for hook_type in sorted(local, key=list(HookType).index)
+        ]
+    lines += generate(shapes_dict, frozenset(), " " * 4, arity)
+    return compile("\n".join(lines), "<yapyhook dispatch>", "exec")
+
+
+def is_pattern(name: str) -> bool:
+    """Return True if name is a pattern of hook names, see NameTrie"""
+    return any(segment in ("*", "**") for segment in name.split("."))
+
+
+class NameTrie:
+    """Values indexed by dotted names, segment by segment.
+
+    In a pattern, the segment "*" matches one segment and "**" matches any number of
+    segments: "SomeText.*" matches "SomeText.__init__", "payments.**" matches
+    "payments.refund" and "payments.card.charge".
+    """
+
+    __slots__ = ("children", "values")
+
+    # a weakref callback can remove a name while the trie is visited: the visits
+    # iterate over copies of the children
+
+    def __init__(self) -> None:
+        self.children: typing.Dict[str, NameTrie] = {}
+        self.values: typing.List[typing.Any] = []
+
+    def add(self, name: str, value: typing.Any) -> None:
+        node = self
+        for segment in name.split("."):
+            node = node.children.setdefault(segment, NameTrie())
+        node.values.append(value)
+
+    def get(self, name: str) -> typing.List[typing.Any]:
+        """Return the values of name, name is not a pattern"""
+        node = self
+        for segment in name.split("."):
+            child = node.children.get(segment)
+            if child is None:
+                return []
+            node = child
+        return list(node.values)
+
+    def remove(self, name: str, value: typing.Any) -> bool:
+        """Remove value from name, the empty nodes are removed"""
+        path = [self]
+        for segment in name.split("."):
+            child = path[-1].children.get(segment)
+            if child is None:
+                return False
+            path.append(child)
+        try:
+            path[-1].values.remove(value)
+        except ValueError:
+            return False
+        for parent, segment, node in zip(
+            reversed(path[:-1]), reversed(name.split(".")), reversed(path)
+        ):
+            if node.values or node.children:
+                break
+            del parent.children[segment]
+        return True
+
+    def match(self, pattern: str) -> typing.List[typing.Any]:
+        """Return the values of the names matching pattern"""
+        values: typing.List[typing.Any] = []
+        seen: typing.Set[typing.Tuple[int, int]] = set()
+
+        def visit(node: NameTrie, segments: typing.List[str], i: int) -> None:
+            if (id(node), i) in seen:
+                return
+            seen.add((id(node), i))
+            if i == len(segments):
+                values.extend(node.values)
+                return
+            segment = segments[i]
+            if segment == "**":
+                visit(node, segments, i + 1)
+                for child in tuple(node.children.values()):
+                    visit(child, segments, i)
+            elif segment == "*":
+                for child in tuple(node.children.values()):
+                    visit(child, segments, i + 1)
+            else:
+                next_node = node.children.get(segment)
+                if next_node is not None:
+                    visit(next_node, segments, i + 1)
+
+        visit(self, pattern.split("."), 0)
+        return values
+
+    def match_patterns(self, name: str) -> typing.List[typing.Any]:
+        """Return the values of the patterns matching name"""
+        values: typing.List[typing.Any] = []
+        seen: typing.Set[typing.Tuple[int, int]] = set()
+
+        def visit(node: NameTrie, segments: typing.List[str], i: int) -> None:
+            if (id(node), i) in seen:
+                return
+            seen.add((id(node), i))
+            if i == len(segments):
+                values.extend(node.values)
+            else:
+                for segment in (segments[i], "*"):
+                    child = node.children.get(segment)
+                    if child is not None:
+                        visit(child, segments, i + 1)
+            child = node.children.get("**")
+            if child is not None:
+                for j in range(i, len(segments) + 1):
+                    visit(child, segments, j)
+
+        visit(self, name.split("."), 0)
+        return values
+
+
+class Subscription:
+    """A callback registered on the hooks matching a pattern, see Hook.subscribe.
+
+    A subscription to a name which is not a pattern is a pending registration:
+    it is removed once the callback is registered.
+    """
+
+    __slots__ = ("pattern", "hook_type", "callback", "once", "error")
+
+    def __init__(self, pattern: str, hook_type: HookType, f: F) -> None:
+        self.pattern = pattern
+        self.hook_type = hook_type
+        self.once = not is_pattern(pattern)
+        # why the last registration failed, see Hook.pending_registrations
+        self.error: typing.Optional[str] = None
+        # the subscription is removed when the callback dies
+        self.callback: WEAKREF_F
+        if inspect.ismethod(f):
+            self.callback = weakref.WeakMethod(f, self._remove)  # type: ignore
+        else:
+            self.callback = weakref.ref(f, self._remove)
+
+    def _remove(self, _: WEAKREF_F) -> None:
+        with SUBSCRIPTIONS_LOCK:
+            SUBSCRIPTIONS.remove(self.pattern, self)
+
+    def attach(self, hook: "Hook") -> None:
+        """Register the callback on hook. Must be called with SUBSCRIPTIONS_LOCK held."""
+        f = self.callback()
+        if f is None:
+            return
+        try:
+            hook.register(self.hook_type, hook.ref(f))
+        except ValueError as e:
+            # for example an async PreHook callback on a sync hook
+            if self.once:
+                self.error = str(e)
+                logger.warning("pending %r not registered on %r: %s", f, hook.name, e)
+            else:
+                logger.debug("%r not registered on %r: %s", f, hook.name, e)
+            return
+        if self.once:
+            SUBSCRIPTIONS.remove(self.pattern, self)
+
+
+# names of the existing hooks and the subscriptions by pattern, see Hook.subscribe
+HOOK_NAMES = NameTrie()
+SUBSCRIPTIONS = NameTrie()
+SUBSCRIPTIONS_LOCK = threading.RLock()
+
+
+# entry point group of the plugins: the name of an entry point is a hook name or a
+# pattern of hook names, see Hook.discover_plugins
+PLUGIN_GROUP = "yapyhook.callbacks"
+
+
+def default_plugin_cache_path() -> str:
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+        os.path.expanduser("~"), ".cache"
+    )
+    return os.path.join(cache_home, "yapyhook", "entry_points.json")
+
+
+def scan_entry_points(group: str) -> typing.Dict[str, typing.List[str]]:
+    """Return the values of the entry points of group by entry point name"""
+    try:
+        from importlib import metadata
+    except ImportError:  # Python < 3.8
+        import importlib_metadata as metadata  # type: ignore
+
+    entry_points = metadata.entry_points()
+    if hasattr(entry_points, "select"):
+        selected = entry_points.select(group=group)
+    else:
+        selected = entry_points.get(group, [])  # type: ignore
+    plugins: typing.Dict[str, typing.List[str]] = {}
+    for entry_point in selected:
+        plugins.setdefault(entry_point.name, []).append(entry_point.value)
+    return plugins
+
+
+def entry_points_cache_key(group: str) -> typing.List[typing.Any]:
+    """The distributions are installed in the directories of sys.path:
+    installing or removing a distribution changes the mtime of the directory.
+    """
+    key: typing.List[typing.Any] = [group]
+    for path in sys.path:
+        try:
+            key.append([path, os.stat(path or ".").st_mtime_ns])
+        except OSError:
+            key.append([path, None])
+    return key
+
+
+def read_entry_points(
+    group: str, cache_path: typing.Optional[str], refresh: bool = False
+) -> typing.Dict[str, typing.List[str]]:
+    """Return scan_entry_points(group), cached in the JSON file cache_path"""
+    if cache_path is None:
+        return scan_entry_points(group)
+    key = entry_points_cache_key(group)
+    if not refresh:
+        try:
+            with open(cache_path) as cache_file:
+                cache = json.load(cache_file)
+            if cache["key"] == key:
+                return cache["entry_points"]
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+    plugins = scan_entry_points(group)
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as cache_file:
+            json.dump({"key": key, "entry_points": plugins}, cache_file)
+        os.replace(tmp_path, cache_path)
+    except OSError as e:
+        logger.debug("can't write the entry points cache %r: %s", cache_path, e)
+    return plugins
+
+
+def load_entry_point(value: str) -> typing.Any:
+    """Import the module of the entry point "module" or "module:attribute"
+    and return the module or the attribute
+    """
+    module_name, _, attribute = value.partition(":")
+    obj = importlib.import_module(module_name.strip())
+    attribute = attribute.split("[")[0].strip()
+    for name in attribute.split(".") if attribute else ():
+        obj = getattr(obj, name)
+    return obj
+
+
+def create_plugin_dispatch(
+    hook_ref: "weakref.ReferenceType[Hook]", is_coroutine: bool
+) -> typing.Callable:
+    """Return a dispatch function loading the plugins of the hook on the first call,
+    then calling the dispatch function rebuilt without them.
+
+    It references the hook with a weakref: the hook references the dispatch function.
+    """
+
+    def load_plugins(f: F, args: tuple, kwargs: T_KWARGS) -> typing.Any:
+        hook = hook_ref()
+        if hook is not None:
+            hook.load_plugins()
+            dispatch = hook._dispatch
+            if dispatch is not None:
+                return dispatch(f, args, kwargs)
+        return f(*args, **kwargs)
+
+    if not is_coroutine:
+        return load_plugins
 
+    async def load_plugins_async(f: F, args: tuple, kwargs: T_KWARGS) -> typing.Any:
+        return await load_plugins(f, args, kwargs)
 
-class HookType(enum.Enum):
-    PRECALL = "precall"
-    POSTCALL = "postcall"
-    FILTERCALL = "filtercall"
+    return load_plugins_async
+
+
+def create_sweep_dispatch(
+    hook_ref: "weakref.ReferenceType[Hook]", is_coroutine: bool
+) -> typing.Callable:
+    """Return a dispatch function publishing the lazy registrations and removing the
+    dead callbacks of the hook on the next call, then calling the dispatch function
+    rebuilt with the new chains.
+
+    It references the hook with a weakref: the hook references the dispatch function.
+    """
+
+    def sweep(f: F, args: tuple, kwargs: T_KWARGS) -> typing.Any:
+        hook = hook_ref()
+        if hook is None:
+            return f(*args, **kwargs)
+        with hook.lock:
+            hook._sweep()
+            # the changes are only kept while the same thread modifies the hook
+            dispatch = (
+                compile_dispatch(hook)
+                if hook._dead_ids or hook._added
+                else hook._dispatch
+            )
+        if dispatch is None:
+            return f(*args, **kwargs)
+        return dispatch(f, args, kwargs)
+
+    if not is_coroutine:
+        return sweep
+
+    async def sweep_async(f: F, args: tuple, kwargs: T_KWARGS) -> typing.Any:
+        return await sweep(f, args, kwargs)
+
+    return sweep_async
 
 
 class CallHook:
@@ -41,6 +2733,12 @@ class CallHook:
     UNBOUND_METHODS: typing.ClassVar[
         weakref.WeakKeyDictionary
     ] = weakref.WeakKeyDictionary()
+    # incremented each time UNBOUND_METHODS is modified, see get_hooked_methods
+    UNBOUND_METHODS_VERSION: typing.ClassVar[int] = 0
+    # (state, table) by class, see get_hooked_methods
+    HOOKED_METHODS: typing.ClassVar[
+        weakref.WeakKeyDictionary
+    ] = weakref.WeakKeyDictionary()
 
     def __init__(
         self,
@@ -48,19 +2746,68 @@ class CallHook:
         name_or_obj: typing.Union[str, typing.Any],
         key: typing.Optional[str] = None,
         unbound_method: bool = False,
+        batch: bool = False,
+        deferred: bool = False,
+        context: bool = False,
+        when: typing.Optional[T_CONDITIONS] = None,
+        per_instance: bool = False,
+        weak: typing.Optional[bool] = None,
+        priority: int = 0,
+        before: T_CONSTRAINTS = None,
+        after: T_CONSTRAINTS = None,
+        executor: typing.Optional[str] = None,
     ):
         self.hook_type = hook_type
         self.unbound_method = unbound_method
+        # the object of an anonymous hook on a method of an instance, see Hook.ref
+        self.scope: typing.Any = None
+        if executor not in (None, "process"):
+            raise ValueError(f"unknown executor {executor!r}")
+        self.options: typing.Dict[str, typing.Any] = {
+            "batch": batch,
+            "deferred": deferred,
+            "context": context,
+            "process": executor == "process",
+        }
+        for option, value in self.options.items():
+            if value and hook_type not in CALLING_OPTIONS_HOOK_TYPES[option]:
+                raise ValueError(f"{option} is not allowed for {hook_type!r}")
+        if batch and context:
+            raise ValueError("a batch callback can't be called with a CallContext")
+        if executor is not None and (batch or deferred or context):
+            raise ValueError(f"executor={executor!r} excludes batch, deferred, context")
+        if when is not None:
+            if hook_type == HookType.ITEMFILTERCALL or batch:
+                raise ValueError(f"when is not allowed for {hook_type!r} or batch")
+            if not when or not all(isinstance(c, str) or callable(c) for c in when):
+                raise ValueError("when must map parameter names or selectors to values")
+            if per_instance:
+                raise ValueError("a per instance callback can't have a when condition")
+            when = dict(when)
+        self.options.update(
+            when=when,
+            per_instance=per_instance,
+            weak=weak,
+            priority=priority,
+            before=get_qualnames(before),
+            after=get_qualnames(after),
+        )
         if not isinstance(name_or_obj, str) and isinstance(key, str):
-            self.name = Hook.get_anonymous_hook_name(name_or_obj, key)
+            # the callbacks of an instance hook are merged without an index, see
+            # InstanceCallbacks: a conditional callback gets a hook on the object
+            instance_hook_name = (
+                Hook.get_instance_hook_name(name_or_obj, key) if when is None else None
+            )
+            if instance_hook_name is not None:
+                self.name = instance_hook_name
+                self.scope = name_or_obj
+            else:
+                self.name = Hook.get_anonymous_hook_name(name_or_obj, key)
         elif isinstance(name_or_obj, str) and key is None:
             self.name = name_or_obj
         elif key is not None:
             raise ValueError("key has to be None if name_or_obj is a str")
 
-        if self.name not in Hook.HOOKS:
-            raise ValueError(f"{self.name!r} doesn't exit")
-
     def __call__(
         self,
         f: F,
@@ -72,9 +2819,8 @@ class CallHook:
 
         f_is_method = inspect.ismethod(f)
 
-        wref: WEAKREF_F = (
-            weakref.WeakMethod(f) if f_is_method else weakref.ref(f)  # type: ignore
-        )
+        # See Hook.ref
+        f.__setattr__("__hook_options__", self.options)
 
         """
         There is no way to know if a function is a unbound method.
@@ -90,20 +2836,71 @@ class CallHook:
         """
         if self.unbound_method or (not f_is_method and is_first_parameter_self(f)):
             CallHook.UNBOUND_METHODS[f] = (self.name, self.hook_type)
+            CallHook.UNBOUND_METHODS_VERSION += 1
+        elif self.options["per_instance"]:
+            raise ValueError(f"{f} must be a method of a HookClass to be per instance")
         else:
-            Hook.HOOKS[self.name].register(self.hook_type, wref)
+            Hook.register_by_name(self.name, self.hook_type, f, self.scope)
+        # the CallHook is often kept by the caller: don't keep the object alive
+        self.scope = None
 
         # See static method Hooks.delete
         f.__setattr__("__hook__", (self.name, self.hook_type))
         return f
 
+    @staticmethod
+    def get_hooked_methods(cls: type, refresh: bool = False) -> T_HOOKED_METHODS:
+        """Return the hooked methods of cls: (attribute name, hook name, hook type, function).
+
+        The MRO is scanned once, the result is stored in HOOKED_METHODS. The table is
+        scanned again when UNBOUND_METHODS is modified, when a function is added to,
+        replaced in or deleted from a class of the MRO, or when refresh is True.
+        """
+        # the functions are weakly referenced: the address of a dead function can be
+        # reused by a new one. The attributes of object can't be modified.
+        functions = [
+            value
+            for klass in cls.__mro__[:-1]
+            for value in vars(klass).values()
+            if isinstance(value, types.FunctionType)
+        ]
+        state = (CallHook.UNBOUND_METHODS_VERSION, tuple(map(weakref.ref, functions)))
+        cached = CallHook.HOOKED_METHODS.get(cls)
+        if not refresh and cached is not None and cached[0] == state:
+            return cached[1]
+
+        hooked_methods = []
+        names = set()
+        for klass in cls.__mro__:
+            for name, value in vars(klass).items():
+                if name in names:
+                    continue
+                names.add(name)
+                hook = (
+                    CallHook.UNBOUND_METHODS.get(value)
+                    if inspect.isfunction(value)
+                    else None
+                )
+                if hook:
+                    hooked_methods.append((name, hook[0], hook[1], value))
+        table = tuple(hooked_methods)
+        CallHook.HOOKED_METHODS[cls] = (state, table)
+        return table
+
     @staticmethod
     def register_instance(instance: typing.Any) -> None:
-        for name, method in inspect.getmembers(instance, predicate=inspect.ismethod):
-            hook = CallHook.UNBOUND_METHODS.get(method.__func__)
-            if hook:
-                name, hook_type = hook
-                Hook.HOOKS[name].register(hook_type, weakref.WeakMethod(method))
+        cls = type(instance)
+        hooked_methods = CallHook.get_hooked_methods(cls)
+        # the chains of a hook are published once for many instances, see lazy
+        for name, hook_name, hook_type, function in hooked_methods:
+            per_instance = function.__hook_options__["per_instance"]  # type: ignore
+            Hook.register_by_name(
+                hook_name,
+                hook_type,
+                getattr(instance, name),
+                instance if per_instance else None,
+                lazy=True,
+            )
 
 
 def create_or_hook_new_method(cls: typing.Type[T]) -> None:
@@ -146,8 +2943,29 @@ class PreHook(CallHook):
         name_or_obj: typing.Union[str, typing.Any],
         key: str = None,
         unbound_method: bool = False,
+        batch: bool = False,
+        context: bool = False,
+        when: typing.Optional[T_CONDITIONS] = None,
+        per_instance: bool = False,
+        weak: typing.Optional[bool] = None,
+        priority: int = 0,
+        before: T_CONSTRAINTS = None,
+        after: T_CONSTRAINTS = None,
     ):
-        super().__init__(HookType.PRECALL, name_or_obj, key, unbound_method)
+        super().__init__(
+            HookType.PRECALL,
+            name_or_obj,
+            key,
+            unbound_method,
+            batch=batch,
+            context=context,
+            when=when,
+            per_instance=per_instance,
+            weak=weak,
+            priority=priority,
+            before=before,
+            after=after,
+        )
 
 
 class PostHook(CallHook):
@@ -156,8 +2974,33 @@ class PostHook(CallHook):
         name_or_obj: typing.Union[str, typing.Any],
         key: str = None,
         unbound_method: bool = False,
+        batch: bool = False,
+        deferred: bool = False,
+        context: bool = False,
+        when: typing.Optional[T_CONDITIONS] = None,
+        per_instance: bool = False,
+        weak: typing.Optional[bool] = None,
+        priority: int = 0,
+        before: T_CONSTRAINTS = None,
+        after: T_CONSTRAINTS = None,
+        executor: typing.Optional[str] = None,
     ):
-        super().__init__(HookType.POSTCALL, name_or_obj, key, unbound_method)
+        super().__init__(
+            HookType.POSTCALL,
+            name_or_obj,
+            key,
+            unbound_method,
+            batch=batch,
+            deferred=deferred,
+            context=context,
+            when=when,
+            per_instance=per_instance,
+            weak=weak,
+            priority=priority,
+            before=before,
+            after=after,
+            executor=executor,
+        )
 
 
 class FilterHook(CallHook):
@@ -166,8 +3009,324 @@ class FilterHook(CallHook):
         name_or_obj: typing.Union[str, typing.Any],
         key: str = None,
         unbound_method: bool = False,
+        batch: bool = False,
+        context: bool = False,
+        when: typing.Optional[T_CONDITIONS] = None,
+        per_instance: bool = False,
+        weak: typing.Optional[bool] = None,
+        priority: int = 0,
+        before: T_CONSTRAINTS = None,
+        after: T_CONSTRAINTS = None,
+        executor: typing.Optional[str] = None,
+    ):
+        super().__init__(
+            HookType.FILTERCALL,
+            name_or_obj,
+            key,
+            unbound_method,
+            batch=batch,
+            context=context,
+            when=when,
+            per_instance=per_instance,
+            weak=weak,
+            priority=priority,
+            before=before,
+            after=after,
+            executor=executor,
+        )
+
+
+class ItemFilterHook(CallHook):
+    """Filter the items of an iterable result, such as a generator, item by item.
+
+    The callback is called as callback(item, *args, **kwargs) and returns the new item.
+    With drop=True, the item is dropped when the callback returns a true value.
+    With chunked=True, the callback is called with a list of items and returns the
+    list of the new items, see ITEM_CHUNK_SIZE.
+
+    All the ItemFilterHook callbacks are applied in a single loop over the result,
+    then the result is given to the FilterHook callbacks.
+
+    An async callback is called on up to concurrency items at a time, and the result
+    becomes an async iterator. The items are yielded in input order, or as soon as
+    they are ready with ordered=False, see item_stage_concurrent.
+    """
+
+    def __init__(
+        self,
+        name_or_obj: typing.Union[str, typing.Any],
+        key: typing.Optional[str] = None,
+        unbound_method: bool = False,
+        drop: bool = False,
+        chunked: bool = False,
+        concurrency: int = 1,
+        ordered: bool = True,
+        weak: typing.Optional[bool] = None,
+        priority: int = 0,
+        before: T_CONSTRAINTS = None,
+        after: T_CONSTRAINTS = None,
+    ):
+        if drop and chunked:
+            raise ValueError("a chunked callback returns the items which are kept")
+        if concurrency < 1:
+            raise ValueError(f"concurrency must be positive, not {concurrency!r}")
+        super().__init__(
+            HookType.ITEMFILTERCALL,
+            name_or_obj,
+            key,
+            unbound_method,
+            weak=weak,
+            priority=priority,
+            before=before,
+            after=after,
+        )
+        self.options.update(
+            item_kind=ITEM_CHUNK if chunked else ITEM_DROP if drop else ITEM_MAP,
+            concurrency=concurrency,
+            ordered=ordered,
+        )
+
+
+# (value, expiration time or None), see CacheHook
+T_CACHE_ENTRY = typing.Tuple[typing.Any, typing.Optional[float]]
+
+
+def make_cache_key(*args: typing.Any, **kwargs: typing.Any) -> typing.Hashable:
+    """Default key of CacheHook: the arguments, which must be hashable"""
+    if kwargs:
+        return (args, tuple(sorted(kwargs.items())))
+    return args
+
+
+class CacheHook:
+    """Cache the results of a hooked function with a PreHook callback.
+
+    On a hit, the PreHook short-circuits the call with (True, cached value). On a miss,
+    the PreHook calls the hooked function, stores and returns the result: the FilterHook
+    and PostHook callbacks are called on hits and misses and the cache stores the result
+    before filtering. Concurrent misses on the same key, from threads or from tasks,
+    call the hooked function once: the other calls wait for the result.
+
+    The cache PreHook runs after the other PreHook callbacks: a PreHook denying a call
+    runs on hits and misses. Since a miss also short-circuits the call, Hook.instrument
+    counts the misses as short-circuits. The PreHook callbacks of the hook can't run
+    with DispatchPolicy.CONCURRENT.
+
+    The entries are evicted in LRU order above maxsize entries (None: no limit)
+    and after ttl seconds (None: no expiration).
+    key(*args, **kwargs) returns the key of a call, see make_cache_key. The calls with
+    an unhashable key run uncached and count as misses.
+
+    The callback is weakly referenced like the other callbacks: the cache must be kept
+    alive, it is unregistered when it is garbage collected.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        maxsize: typing.Optional[int] = 128,
+        ttl: typing.Optional[float] = None,
+        key: typing.Callable[..., typing.Hashable] = make_cache_key,
     ):
-        super().__init__(HookType.FILTERCALL, name_or_obj, key, unbound_method)
+        if maxsize is not None and maxsize <= 0:
+            raise ValueError(f"maxsize must be positive or None, not {maxsize!r}")
+        if ttl is not None and ttl <= 0:
+            raise ValueError(f"ttl must be positive or None, not {ttl!r}")
+        if name not in Hook.HOOKS:
+            raise ValueError(f"{name!r} doesn't exist")
+        hook = Hook.HOOKS[name]
+        if hook._function is None:
+            raise ValueError(f"{name!r} doesn't hook a function")
+        if hook.precall_policy == DispatchPolicy.CONCURRENT:
+            raise ValueError(f"{name!r} runs its PreHook callbacks concurrently")
+
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.key = key
+        self.lock = threading.Lock()
+        # key -> (value, expiration time or None), in LRU order
+        self.entries: "collections.OrderedDict[typing.Hashable, T_CACHE_ENTRY]" = (
+            collections.OrderedDict()
+        )
+        # key -> (event or future set when the value is computed, thread or task
+        # computing it)
+        self.pending: typing.Dict[
+            typing.Hashable, typing.Tuple[typing.Any, typing.Any]
+        ] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+        callback = self._precall_async if hook.is_coroutine else self._precall
+        self._weakref_hook = hook.ref(callback)
+        # the PreHook callbacks registered later, or in a scope, run first
+        self._weakref_hook.priority = sys.maxsize
+        hook.register(HookType.PRECALL, self._weakref_hook)
+
+    def _function(self) -> typing.Callable:
+        hook = Hook.HOOKS[self.name]
+        f = hook._function() if hook._function is not None else None
+        if f is None:
+            raise ValueError(f"{self.name!r} doesn't hook a function")
+        return f
+
+    def _lookup(self, key: typing.Hashable) -> typing.Tuple[bool, typing.Any]:
+        """Return (True, value) if key is cached. Must be called with self.lock held."""
+        entry = self.entries.get(key)
+        if entry is None:
+            return False, None
+        value, expiration = entry
+        if expiration is not None and expiration <= time.monotonic():
+            del self.entries[key]
+            self.expirations += 1
+            return False, None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return True, value
+
+    def _store(
+        self, key: typing.Hashable, pending: typing.Any, value: typing.Any
+    ) -> None:
+        """Store the computed value unless key has been invalidated meanwhile.
+        Must be called with self.lock held.
+        """
+        if self.pending.get(key) is not pending:
+            return
+        expiration = None if self.ttl is None else time.monotonic() + self.ttl
+        self.entries[key] = (value, expiration)
+        self.entries.move_to_end(key)
+        if self.maxsize is not None and len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def _make_key(
+        self, args: typing.Tuple, kwargs: T_KWARGS
+    ) -> typing.Tuple[bool, typing.Hashable]:
+        """Return (True, key) of a call, or (False, None) if its key is unhashable"""
+        try:
+            key = self.key(*args, **kwargs)
+            hash(key)
+        except TypeError:
+            with self.lock:
+                self.misses += 1
+            return False, None
+        return True, key
+
+    def _precall(
+        self, *args: typing.Any, **kwargs: typing.Any
+    ) -> typing.Optional[typing.Tuple[bool, typing.Any]]:
+        hashable, key = self._make_key(args, kwargs)
+        if not hashable:
+            return None
+        current = threading.get_ident()
+        while True:
+            with self.lock:
+                found, value = self._lookup(key)
+                if found:
+                    return True, value
+                waiting = self.pending.get(key)
+                if waiting is None:
+                    pending = self.pending[key] = (threading.Event(), current)
+                    self.misses += 1
+                    break
+            if waiting[1] == current:
+                # recursive call with the same key
+                return True, self._function()(*args, **kwargs)
+            waiting[0].wait()
+
+        try:
+            value = self._function()(*args, **kwargs)
+            with self.lock:
+                self._store(key, pending, value)
+        finally:
+            with self.lock:
+                if self.pending.get(key) is pending:
+                    del self.pending[key]
+            pending[0].set()
+        return True, value
+
+    async def _precall_async(
+        self, *args: typing.Any, **kwargs: typing.Any
+    ) -> typing.Optional[typing.Tuple[bool, typing.Any]]:
+        hashable, key = self._make_key(args, kwargs)
+        if not hashable:
+            return None
+        current = current_task()
+        while True:
+            with self.lock:
+                found, value = self._lookup(key)
+                if found:
+                    return True, value
+                waiting = self.pending.get(key)
+                if waiting is None:
+                    # a thread-safe future: the tasks of other threads and event
+                    # loops may wait for it
+                    future: concurrent.futures.Future = concurrent.futures.Future()
+                    pending = self.pending[key] = (future, current)
+                    self.misses += 1
+                    break
+            if waiting[1] is current:
+                # recursive call with the same key
+                return True, await self._function()(*args, **kwargs)
+            # a cancelled waiter must not cancel the future of the other waiters
+            await asyncio.shield(asyncio.wrap_future(waiting[0]))
+
+        try:
+            value = await self._function()(*args, **kwargs)
+            with self.lock:
+                self._store(key, pending, value)
+        finally:
+            with self.lock:
+                if self.pending.get(key) is pending:
+                    del self.pending[key]
+            pending[0].set_result(None)
+        return True, value
+
+    def invalidate(self, key: typing.Hashable) -> bool:
+        """Remove the entry of key, return True if it was cached.
+
+        A value being computed for key is not stored.
+        """
+        with self.lock:
+            self.pending.pop(key, None)
+            return self.entries.pop(key, None) is not None
+
+    def invalidate_if(
+        self, predicate: typing.Callable[[typing.Hashable, typing.Any], bool]
+    ) -> int:
+        """Remove the entries where predicate(key, value) is true, return their number"""
+        with self.lock:
+            keys = [
+                key for key, (value, _) in self.entries.items() if predicate(key, value)
+            ]
+            for key in keys:
+                del self.entries[key]
+            return len(keys)
+
+    def clear(self) -> None:
+        """Remove all the entries, the values being computed are not stored"""
+        with self.lock:
+            self.entries.clear()
+            self.pending.clear()
+
+    def unregister(self) -> None:
+        """Stop caching the calls of the hook"""
+        hook = Hook.HOOKS.get(self.name)
+        if hook is not None:
+            hook._remove_dead([self._weakref_hook])
+            hook._sweep()
+
+    def stats(self) -> typing.Dict[str, int]:
+        with self.lock:
+            return {
+                "size": len(self.entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
 
 
 class Hook:
@@ -175,98 +3334,355 @@ class Hook:
     HOOKS = (
         weakref.WeakValueDictionary()
     )  # type: typing.ClassVar[weakref.WeakValueDictionary[str, Hook]]
+    # runs the PostHook(..., deferred=True) callbacks of all the hooks
+    DEFERRED_EXECUTOR: typing.ClassVar[DeferredExecutor] = DeferredExecutor()
+    # runs the callbacks registered with executor="process" of all the hooks
+    PROCESS_EXECUTOR: typing.ClassVar[ProcessExecutor] = ProcessExecutor()
+    # entry point values by hook name or pattern, see discover_plugins
+    PLUGINS: typing.ClassVar[NameTrie] = NameTrie()
+    # the entry point values already loaded
+    LOADED_PLUGINS: typing.ClassVar[typing.Set[str]] = set()
 
     __slots__ = (
         "__weakref__",
         "name",
         "hook_types",
+        "version",
         "allowed_hook_types",
         "is_coroutine",
         "lock",
+        "_dispatch",
+        "_weakref_callback",
+        "_dead_ids",
+        "_added",
+        "_sorted_types",
+        "_size",
+        "_modifying",
+        "_function",
+        "precall_policy",
+        "postcall_policy",
+        "background_tasks",
+        "instrumentation",
+        "_plugins",
+        "instances",
+        "local_types",
+        "local_context",
+        "frozen",
+        "_thawed_hook_types",
     )
 
     def __init__(
         self,
         name: str,
         allowed_hook_types: typing.Optional[typing.Set[HookType]] = None,
+        precall_policy: DispatchPolicy = DispatchPolicy.SEQUENTIAL,
+        postcall_policy: DispatchPolicy = DispatchPolicy.SEQUENTIAL,
     ):
         if name in Hook.HOOKS:
             raise ValueError(f"Hook {name!r} already exists")
+        if precall_policy == DispatchPolicy.BACKGROUND:
+            raise ValueError(f"{precall_policy!r} not allowed for PRECALL")
 
         self.name = name
-        self.hook_types: typing.Dict[HookType, typing.List] = {}
-        self.allowed_hook_types: typing.List[HookType] = (
-            set(*allowed_hook_types) if allowed_hook_types else HookType  # type: ignore
+        self.hook_types: T_HOOK_TYPES = {hook_type: () for hook_type in HookType}
+        self.version = 0
+        self.allowed_hook_types: typing.Set[HookType] = (
+            set(allowed_hook_types) if allowed_hook_types else set(HookType)
         )
         self.is_coroutine = False
         self.lock = threading.RLock()
-        for hook_type in HookType:
-            self.hook_types[hook_type] = []
+        self._dispatch: typing.Optional[typing.Callable] = None
+        hook_ref = weakref.ref(self)
+        self._weakref_callback = lambda w: DEAD_CALLBACKS.add(hook_ref, w)
+        self._dead_ids: typing.Set[int] = set()
+        # the lazy registrations by hook type, see register
+        self._added: typing.Dict[HookType, typing.List[HOOK_REF]] = {}
+        # the hook types with before/after constraints, and the number of callbacks
+        self._sorted_types: typing.FrozenSet[HookType] = frozenset()
+        self._size = 0
+        self._modifying = False
+        self._function: typing.Optional[WEAKREF_F] = None
+        self.precall_policy = precall_policy
+        self.postcall_policy = postcall_policy
+        # the tasks created by DispatchPolicy.BACKGROUND, see wait_background_tasks
+        self.background_tasks: typing.Set[asyncio.Future] = set()
+        # see instrument
+        self.instrumentation: typing.Optional[Instrumentation] = None
+        # the plugins loaded on the first call, see discover_plugins
+        self._plugins: typing.List[str] = Hook._find_plugins(name)
+        # the callbacks of a single object, see register
+        self.instances = InstanceCallbacks()
+        # the hook types which have had callbacks in a scope, and if one of these
+        # callbacks uses a CallContext, see scope
+        self.local_types: typing.FrozenSet[HookType] = frozenset()
+        self.local_context = False
+        # see freeze
+        self.frozen = False
+        self._thawed_hook_types: typing.Optional[T_HOOK_TYPES] = None
         Hook.HOOKS[self.name] = self
+        with SUBSCRIPTIONS_LOCK:
+            HOOK_NAMES.add(name, name)
+        finalizer = weakref.finalize(self, Hook._remove_name, name)
+        finalizer.atexit = False
 
     def _iter_hooks(
         self, hook_type: HookType
     ) -> typing.Generator[typing.Callable, None, None]:
-        hook_list = self.hook_types[hook_type]
-        for weakref_hook in hook_list:
+        self._sweep()
+        for weakref_hook in self.hook_types[hook_type]:
             o = weakref_hook()
             if o is not None:
                 yield o
-            else:
-                with self.lock:
-                    hook_list.remove(weakref_hook)
 
-    def _create_wrapped_function(self, f: F) -> F:
-        @wraps(f)
-        def hooked(*args: T_ARGS, **kwargs: T_KWARGS) -> T:
-            return_value = None
+    def _remove_dead(self, weakref_hooks: typing.Iterable[HOOK_REF]) -> None:
+        with self.lock:
+            scoped = [w for w in weakref_hooks if w.scoped]
+            if scoped:
+                self._modify_instances(lambda: self.instances.remove(scoped))
+            dead_ids = {id(w) for w in weakref_hooks if not w.scoped}
+            if dead_ids:
+                # a dead callback is skipped by the dispatch function: the snapshot
+                # is published once for all the callbacks dead until the next call,
+                # instead of once per callback (O(n²) when n instances are deleted)
+                sweep = not self._dead_ids
+                self._dead_ids.update(dead_ids)
+                if sweep and not self._modifying:
+                    self._rebuild()
 
-            # PRECALL
-            for o in self._iter_hooks(HookType.PRECALL):
-                r = o(*args, **kwargs)
-                if r is not None and r[0] is True:
-                    return_value = r[1]
-                    break
-            else:
-                # CALL
-                return_value = f(*args, **kwargs)
+    def _register_lazy(self, hook_type: HookType, weakref_hook: HOOK_REF) -> None:
+        """Add the callback to the chain on the next call or publish, see register"""
+        with self.lock:
+            sweep = not self._dead_ids and not self._added
+            added = self._added.setdefault(hook_type, [])
+            added.append(weakref_hook)
+            if self._modifying:
+                return
+            if len(added) >= max(LAZY_REGISTRATION_LIMIT, self._size):
+                # the pending callbacks would outgrow the chains of a hook never called
+                self._publish(self.hook_types)
+            elif sweep:
+                self._rebuild()
 
-            # FILTERCALL
-            for o in self._iter_hooks(HookType.FILTERCALL):
-                return_value = o(return_value, *args, **kwargs)
+    def _sweep(self) -> None:
+        """Publish the snapshot with the lazy registrations and without the dead
+        callbacks, see create_sweep_dispatch
+        """
+        if not self._dead_ids and not self._added:
+            return
+        with self.lock:
+            if (self._dead_ids or self._added) and not self._modifying:
+                self._publish(self.hook_types)
 
-            # POSTCALL
-            for o in self._iter_hooks(HookType.POSTCALL):
-                o(return_value, *args, **kwargs)
+    def _modify_instances(self, modify: typing.Callable[[], T]) -> T:
+        """Modify self.instances, the dispatch function is rebuilt when it depends on
+        the change, see InstanceCallbacks.state.
+        """
+        with self.lock:
+            state = self.instances.state()
+            result = modify()
+            if self.instances.state() != state:
+                self._rebuild()
+            return result
 
-            return return_value
+    def _remove_scope(self, key: int, scope: weakref.ReferenceType) -> None:
+        self._modify_instances(lambda: self.instances.remove_scope(key, scope))
 
-        return hooked
+    @contextlib.contextmanager
+    def _modify(self) -> typing.Iterator[None]:
+        """Hold the lock while a new snapshot is built from self.hook_types.
 
-    def _create_wrapped_async(self, f: F) -> F:
-        @wraps(f)
-        async def hooked(*args: T_ARGS, **kwargs: T_KWARGS) -> T:
-            return_value = None
+        A callback can die while the new snapshot is built (the garbage collector can run
+        on any allocation): _remove_dead only records it, it is dropped by _publish.
+        """
+        with self.lock:
+            modifying = self._modifying
+            self._modifying = True
+            try:
+                yield
+            finally:
+                self._modifying = modifying
+                if not modifying and (self._dead_ids or self._added):
+                    self._publish(self.hook_types)
 
-            # PRECALL
-            for o in self._iter_hooks(HookType.PRECALL):
-                r = await o(*args, **kwargs)
-                if r is not None and r[0] is True:
-                    return_value = r[1]
-                    break
+    def _publish(self, hook_types: T_HOOK_TYPES) -> None:
+        """Replace the callbacks snapshot and the dispatch function.
+
+        Must be called with self.lock held. The dict and the tuples are never modified
+        once published, so the readers don't need to take the lock.
+        """
+        if self._dead_ids:
+            dead_ids, self._dead_ids = self._dead_ids, set()
+            hook_types = {
+                hook_type: tuple(w for w in hook_tuple if id(w) not in dead_ids)
+                for hook_type, hook_tuple in hook_types.items()
+            }
+        if self._added:
+            added, self._added = self._added, {}
+            hook_types = {
+                hook_type: merge_callbacks(hook_tuple, added.get(hook_type, ()), ())
+                for hook_type, hook_tuple in hook_types.items()
+            }
+        self._sorted_types = frozenset(
+            hook_type
+            for hook_type, hook_tuple in hook_types.items()
+            if any(w.before or w.after for w in hook_tuple)
+        )
+        self._size = sum(map(len, hook_types.values()))
+        self.hook_types = hook_types
+        self.version += 1
+        self._rebuild()
+
+    def _rebuild(self) -> None:
+        """Compile the dispatch function for the current callbacks.
+
+        Must be called with self.lock held.
+        """
+        if self._plugins:
+            self._dispatch = create_plugin_dispatch(
+                weakref.ref(self), self.is_coroutine
+            )
+        elif self._dead_ids or self._added:
+            self._dispatch = create_sweep_dispatch(weakref.ref(self), self.is_coroutine)
+        elif self.instrumentation is not None:
+            self._dispatch = sample_dispatch(
+                self.instrumentation,
+                compile_dispatch(self),
+                compile_dispatch(self, instrumented=True),
+                self.is_coroutine,
+            )
+        elif (
+            any(self.hook_types.values()) or self.instances.entries or self.local_types
+        ):
+            self._dispatch = compile_dispatch(self)
+        else:
+            self._dispatch = None
+
+    def _check_not_frozen(self) -> None:
+        if self.frozen:
+            raise ValueError(f"the hook {self.name!r} is frozen, see Hook.thaw")
+
+    def freeze(self) -> None:
+        """Compile the callbacks of the hook into a static chain.
+
+        The callbacks are referenced strongly, the dispatch function is compiled once
+        without weakref call and without liveness check, with the positional arguments
+        of the hooked function unpacked. register and unregister raise ValueError until
+        thaw: a @HookClass instance with callbacks can't be created. The plugins are
+        loaded first.
+        """
+        if self._plugins:
+            self.load_plugins()
+        # the lazy registrations are referenced weakly
+        self._sweep()
+        with self._modify():
+            if self.frozen:
+                return
+            self._thawed_hook_types = self.hook_types
+            self.frozen = True
+            self._publish(
+                {
+                    hook_type: tuple(
+                        strong_ref
+                        for strong_ref in map(make_strong_ref, hook_tuple)
+                        if strong_ref is not None
+                    )
+                    for hook_type, hook_tuple in self.hook_types.items()
+                }
+            )
+
+    def thaw(self) -> None:
+        """Restore the callbacks referenced before freeze, allow register again"""
+        with self._modify():
+            if not self.frozen or self._thawed_hook_types is None:
+                return
+            hook_types, self._thawed_hook_types = self._thawed_hook_types, None
+            self.frozen = False
+            # the callbacks dead before freeze may not have been removed yet
+            self._publish(
+                {
+                    hook_type: tuple(w for w in hook_tuple if w() is not None)
+                    for hook_type, hook_tuple in hook_types.items()
+                }
+            )
+
+    @staticmethod
+    def freeze_all() -> None:
+        """Freeze all the hooks, see freeze: the hooks created later are not frozen"""
+        for hook in list(Hook.HOOKS.values()):
+            hook.freeze()
+
+    @staticmethod
+    def thaw_all() -> None:
+        for hook in list(Hook.HOOKS.values()):
+            hook.thaw()
+
+    def instrument(self, sample_rate: typing.Optional[float] = 1.0) -> None:
+        """Record the statistics of the calls of the hook, see stats.
+
+        One call out of round(1 / sample_rate) is measured: the latency of the whole
+        call, of the hooked function and of each callback, and the short-circuits of
+        the PreHook callbacks. With the CONCURRENT and BACKGROUND policies, only the
+        whole call and the hooked function are measured.
+
+        instrument(None) stops the instrumentation and drops the statistics, the
+        dispatch function is then the same as a hook never instrumented.
+        """
+        with self.lock:
+            if sample_rate is None:
+                self.instrumentation = None
             else:
-                # CALL
-                return_value = await f(*args, **kwargs)
+                self.instrumentation = Instrumentation(sample_rate)
+            self._rebuild()
+
+    def stats(self) -> typing.Optional[typing.Dict[str, typing.Any]]:
+        """Return the statistics of the hook, None if the hook is not instrumented"""
+        instrumentation = self.instrumentation
+        if instrumentation is None:
+            return None
+        return instrumentation.as_dict()
+
+    @staticmethod
+    def all_stats() -> typing.Dict[str, typing.Dict[str, typing.Any]]:
+        """Return the statistics of the instrumented hooks by hook name"""
+        return {
+            name: instrumentation.as_dict()
+            for name, instrumentation in Hook._instrumentations().items()
+        }
+
+    @staticmethod
+    def prometheus_stats() -> str:
+        """Return the statistics of the instrumented hooks in Prometheus text format"""
+        return format_prometheus(Hook._instrumentations())
+
+    @staticmethod
+    def _instrumentations() -> typing.Dict[str, Instrumentation]:
+        instrumentations = {}
+        for name, hook in list(Hook.HOOKS.items()):
+            if hook.instrumentation is not None:
+                instrumentations[name] = hook.instrumentation
+        return instrumentations
 
-            # FILTERCALL
-            for o in self._iter_hooks(HookType.FILTERCALL):
-                return_value = await o(return_value, *args, **kwargs)
+    def _create_wrapped_function(self, f: F) -> F:
+        @wraps(f)
+        def hooked(*args: T_ARGS, **kwargs: T_KWARGS) -> T:
+            dispatch = self._dispatch
+            if dispatch is not None:
+                return dispatch(f, args, kwargs)
+            if kwargs:
+                return f(*args, **kwargs)
+            return f(*args)
 
-            # POSTCALL
-            for o in self._iter_hooks(HookType.POSTCALL):
-                await o(return_value, *args, **kwargs)
+        return hooked
 
-            return return_value
+    def _create_wrapped_async(self, f: F) -> F:
+        @wraps(f)
+        async def hooked(*args: T_ARGS, **kwargs: T_KWARGS) -> T:
+            dispatch = self._dispatch
+            if dispatch is not None:
+                return await dispatch(f, args, kwargs)
+            if kwargs:
+                return await f(*args, **kwargs)
+            return await f(*args)
 
         return hooked
 
@@ -275,7 +3691,21 @@ class Hook:
 
         if not inspect.isfunction(f) and not inspect.ismethod(f):
             raise ValueError(f"{f} has to be a function or a method")
-        self.is_coroutine = is_async_function(f)
+        f_is_async = is_async_function(f)
+        for policy in (self.precall_policy, self.postcall_policy):
+            if not f_is_async and policy != DispatchPolicy.SEQUENTIAL:
+                raise ValueError(f"{f} must be an async function to use {policy!r}")
+        with self.lock:
+            self.is_coroutine = f_is_async
+            self._function = (
+                weakref.WeakMethod(f) if inspect.ismethod(f) else weakref.ref(f)  # type: ignore
+            )
+            self._rebuild()
+        # the callbacks subscribed to a pattern are registered once the hook knows
+        # if the function is async, see subscribe
+        with SUBSCRIPTIONS_LOCK:
+            for subscription in SUBSCRIPTIONS.match_patterns(self.name):
+                subscription.attach(self)
         if self.is_coroutine:
             hooked = self._create_wrapped_async(f)
         else:
@@ -287,9 +3717,19 @@ class Hook:
         self,
         hook_type: HookType,
         weakref_hook: WEAKREF_F,
+        local: typing.Optional[LocalScope] = None,
+        lazy: bool = False,
     ) -> None:
+        """Register the callback of weakref_hook, only in the scope local if given.
+
+        With lazy, the callback is added to the chain on the next call of the hook, with
+        the other lazy registrations: registering the callbacks of n objects publishes a
+        single snapshot instead of n. The callback is added immediately if a callback
+        of its chain has before/after constraints.
+        """
         if not isinstance(weakref_hook, weakref.ref):
             raise ValueError(f"{weakref_hook!r} is not a weakref.ref")
+        self._check_not_frozen()
 
         # check allowed_hook_types
         if hook_type not in self.allowed_hook_types:
@@ -302,31 +3742,640 @@ class Hook:
         if not inspect.isfunction(o) and not inspect.ismethod(o):
             raise ValueError(f"{o} has to be a function or a method")
 
-        # check async or not
-        o_is_async = is_async_function(o)
-        if o_is_async != self.is_coroutine:
-            if self.is_coroutine:
-                raise ValueError(f"{o} must be an async function")
-            raise ValueError(f"{o} must not be an async function")
+        # the weakref has to remove the callback when the callback dies
+        if not isinstance(weakref_hook, (HookRef, HookMethodRef, StrongRef)):
+            weakref_hook = self.ref(o)
+
+        if (
+            hook_type == HookType.ITEMFILTERCALL
+            and weakref_hook.is_async
+            and weakref_hook.item_kind == ITEM_CHUNK
+        ):
+            raise ValueError(f"{o} can't be a chunked async function")
+
+        if weakref_hook.when is not None and self._function is not None:
+            function = self._function()
+            if function is not None:
+                check_conditions(weakref_hook.when, function)
+
+        if weakref_hook.deferred and self.is_coroutine:
+            raise ValueError(f"{o} can't be deferred on an async hook")
+
+        if weakref_hook.process:
+            if weakref_hook.is_async:
+                raise ValueError(f"{o} can't be an async function in a process")
+            if hook_type == HookType.FILTERCALL and not self.is_coroutine:
+                raise ValueError(f"{o} can only run in a process on an async hook")
+
+        # check async or not: a sync hook point can't await a result, the async
+        # ItemFilterHook callbacks are awaited by the async iterator it returns: the
+        # hooked function must be a coroutine function or an async generator function
+        if (
+            hook_type == HookType.ITEMFILTERCALL
+            and weakref_hook.is_async
+            and not self.is_coroutine
+        ):
+            f = self._function() if self._function is not None else None
+            if f is not None and not inspect.isasyncgenfunction(f):
+                raise ValueError(f"{o} must not be an async function on {f}")
+        if (
+            weakref_hook.is_async
+            and not self.is_coroutine
+            and hook_type != HookType.ITEMFILTERCALL
+        ):
+            if hook_type != HookType.POSTCALL or weakref_hook.deferred:
+                raise ValueError(f"{o} must not be an async function")
+
+        if weakref_hook.scope is not None:
+            if weakref_hook.when is not None:
+                raise ValueError(f"{o} can't have a when condition on an object")
+            self._register_scoped(hook_type, weakref_hook)
+            return
+        if local is not None:
+            # the callbacks of a scope are merged without an index, see LocalScope
+            if weakref_hook.when is not None:
+                raise ValueError(f"{o} can't have a when condition in a scope")
+            if not weakref_hook.strong:
+                weakref_hook = self.ref(o, weak=False)
+            self._register_local(local, hook_type, weakref_hook)
+            return
+
+        transaction = TRANSACTION.get()
+        if transaction is not None and not transaction.closed:
+            transaction.add(self, hook_type, weakref_hook)
+            return
+
+        if (
+            lazy
+            and not weakref_hook.before
+            and not weakref_hook.after
+            and hook_type not in self._sorted_types
+        ):
+            # the duplicates are dropped by merge_callbacks
+            self._register_lazy(hook_type, weakref_hook)
+            return
 
         # make sure there is no duplicate
-        hook_list = self.hook_types[hook_type]
+        with self._modify():
+            hook_tuple = self.hook_types[hook_type]
+            if weakref_hook not in hook_tuple:
+                self._publish(
+                    {
+                        **self.hook_types,
+                        hook_type: insert_callback(hook_tuple, weakref_hook),
+                    }
+                )
+
+    def _register_scoped(self, hook_type: HookType, weakref_hook: HOOK_REF) -> None:
+        """Register a callback which only applies to the calls on one object.
+
+        The callback is indexed by its object instead of being added to the chain of
+        all the calls, see InstanceCallbacks.
+        """
+        if hook_type == HookType.ITEMFILTERCALL or weakref_hook.batch:
+            raise ValueError(f"{hook_type!r} or batch callbacks can't be per object")
+        obj = weakref_hook.scope() if weakref_hook.scope is not None else None
+        if obj is None:
+            raise ValueError("the object of the callback has been garbage collected")
+        hook_ref = weakref.ref(self)
+        key = id(obj)
+
+        def on_dead(scope: weakref.ReferenceType) -> None:
+            hook = hook_ref()
+            if hook is not None:
+                hook._remove_scope(key, scope)
+
+        self._sweep()
+        with self.lock:
+            # check the before/after constraints of the chain of the calls on obj
+            entry = self.instances.get(obj)
+            chain = self.hook_types[hook_type] + (weakref_hook,)
+            if entry is not None:
+                chain += entry.hook_types[hook_type]
+            if any(w.before or w.after for w in chain):
+                sort_callbacks(chain)
+            if self.instrumentation is not None:
+                weakref_hook.stats = self.instrumentation.callbacks.setdefault(
+                    (hook_type, weakref_hook.qualname), LatencyStats()
+                )
+            self._modify_instances(
+                lambda: self.instances.add(obj, hook_type, weakref_hook, on_dead)
+            )
+
+    def _apply(
+        self,
+        changes: typing.Dict[
+            HookType, typing.Tuple[typing.List[HOOK_REF], typing.List[HOOK_REF]]
+        ],
+    ) -> None:
+        """Publish the changes of a transaction: (added, removed) by hook type"""
+        with self._modify():
+            hook_types = {
+                hook_type: (
+                    merge_callbacks(hook_tuple, *changes[hook_type])
+                    if hook_type in changes
+                    else hook_tuple
+                )
+                for hook_type, hook_tuple in self.hook_types.items()
+            }
+            if any(hook_types[t] is not self.hook_types[t] for t in hook_types):
+                self._publish(hook_types)
+
+    @staticmethod
+    @contextlib.contextmanager
+    def transaction() -> typing.Iterator[None]:
+        """Apply the registrations and unregistrations of the block at the end.
+
+        The callbacks are checked when they are registered, the chains of each hook are
+        then published once at the end of the block: the calls see the chains before
+        or after the block, never a part of the block. If the block raises an
+        exception, nothing is published. A nested block is part of the enclosing
+        transaction. The callbacks of a scope or of an object are not deferred.
+        """
+        current = TRANSACTION.get()
+        if current is not None and not current.closed:
+            yield
+            return
+        transaction = Transaction()
+        token = TRANSACTION.set(transaction)
+        try:
+            yield
+        finally:
+            TRANSACTION.reset(token)
+            # the tasks created in the block keep the transaction in their context:
+            # their registrations are applied directly, even if the block raised
+            transaction.closed = True
+        transaction.commit()
+
+    @staticmethod
+    def register_many(
+        registrations: typing.Iterable[typing.Tuple[str, HookType, F]],
+    ) -> None:
+        """Register the (hook name, hook type, callback) in one transaction"""
+        with Hook.transaction():
+            for name, hook_type, f in registrations:
+                Hook.register_by_name(name, hook_type, f)
+
+    def _register_local(
+        self, local: LocalScope, hook_type: HookType, weakref_hook: HOOK_REF
+    ) -> None:
+        """Register a callback which is only called in the contexts of a scope.
+
+        The callback is kept alive until the end of the scope. The dispatch function is
+        only rebuilt the first time the hook type has a callback in a scope, then it
+        keeps checking LOCAL_SCOPE: the scopes don't take the lock of the hook.
+        """
+        if hook_type == HookType.ITEMFILTERCALL:
+            raise ValueError(f"{hook_type!r} callbacks can't be registered in a scope")
+        # check the before/after constraints of the chain of the calls in the scope
+        self._sweep()
+        chain = (
+            self.hook_types[hook_type]
+            + local.get((self.name, hook_type.value))
+            + (weakref_hook,)
+        )
+        if any(w.before or w.after for w in chain):
+            sort_callbacks(chain)
+        instrumentation = self.instrumentation
+        # the callbacks of the scope are not in the snapshot read by instrument
+        weakref_hook.stats = (
+            instrumentation.callbacks.setdefault(
+                (hook_type, weakref_hook.qualname), LatencyStats()
+            )
+            if instrumentation is not None
+            else LatencyStats()
+        )
+        if hook_type not in self.local_types or (
+            weakref_hook.context and not self.local_context
+        ):
+            with self.lock:
+                self.local_types |= {hook_type}
+                self.local_context |= weakref_hook.context
+                self._rebuild()
+        local.add((self.name, hook_type.value), weakref_hook)
+
+    @staticmethod
+    @contextlib.contextmanager
+    def scope() -> typing.Iterator[LocalScope]:
+        """Register the callbacks only in the current context until the end of the block.
+
+        The callbacks registered by CallHook and register_by_name in the block are only
+        called by the calls made in the contexts of the block: the current thread or
+        task, and the asyncio tasks created in the block. The calls made out of a scope
+        don't merge the callbacks of the scopes.
+
+        Requires Python 3.7 or newer: the scopes are stored in a contextvars.ContextVar.
+        """
+        if sys.version_info < (3, 7):
+            raise RuntimeError("Hook.scope() requires contextvars, Python 3.7 or newer")
+        local = LocalScope(LOCAL_SCOPE.get())
+        token = LOCAL_SCOPE.set(local)
+        try:
+            yield local
+        finally:
+            LOCAL_SCOPE.reset(token)
+            local.close()
+
+    async def wait_background_tasks(self) -> None:
+        """Wait for the POSTCALL callbacks scheduled by DispatchPolicy.BACKGROUND"""
+        while self.background_tasks:
+            await asyncio.wait(set(self.background_tasks))
+
+    def call_many(
+        self, arguments: typing.Iterable[typing.Sequence], **kwargs: typing.Any
+    ) -> typing.Any:
+        """Call the hooked function once per item of arguments, return the results.
+
+        Each item of arguments is the tuple of positional arguments of one call,
+        kwargs are given to all the calls.
+
+        The callbacks are resolved once for the whole batch, each hook type runs for
+        all the calls before the next hook type. The callbacks registered with
+        batch=True are called once with all the calls:
+        * PreHook: callback(args_list, **kwargs), returns None or a list with
+          None or (True, value) for each call.
+        * FilterHook: callback(results, args_list, **kwargs), returns the new results.
+          The results can be any sequence, for example a NumPy array.
+        * PostHook: callback(results, args_list, **kwargs).
+
+        The other callbacks are called once per call, the context=True callbacks are
+        called with one CallContext per call, the callbacks with a when condition are
+        called for the calls which match the condition.
+        """
+        if self.is_coroutine:
+            raise ValueError(
+                f"call_many is not supported on the async hook {self.name!r}"
+            )
+        f = self._function() if self._function is not None else None
+        if f is None:
+            raise ValueError(f"{self.name!r} doesn't hook a function")
+        if self._plugins:
+            self.load_plugins()
+
+        self._sweep()
+        hook_types = self.hook_types
+        local = LOCAL_SCOPE.get()
+        if local is not None:
+            hook_types = {
+                hook_type: local.select((self.name, hook_type.value), hook_tuple)
+                for hook_type, hook_tuple in hook_types.items()
+            }
+        args_list = [tuple(args) for args in arguments]
+        results: typing.Any = [None] * len(args_list)
+        contexts = (
+            [CallContext(args, kwargs) for args in args_list]
+            if uses_context(hook_types) or self.instances.context_count
+            else []
+        )
+
+        # the chains of the batch with the callbacks of the objects of the calls, and
+        # the ids of the callbacks selected for each call, by hook type
+        chains = dict(hook_types)
+        selected: typing.Dict[HookType, typing.List[typing.Set[int]]] = {}
+        scoped_types, _ = self.instances.state()
+        for hook_type, hook_tuple in hook_types.items():
+            conditional = any(w.when is not None for w in hook_tuple)
+            if not conditional and hook_type not in scoped_types:
+                continue
+            index = CallbackIndex(hook_tuple, f) if conditional else None
+            scoped: typing.Dict[int, HOOK_REF] = {}
+            selected[hook_type] = []
+            for args in args_list:
+                chain = index.select(args, kwargs) if index else hook_tuple
+                chain = self.instances.select(hook_type, chain, args)
+                selected[hook_type].append({id(w) for w in chain})
+                scoped.update((id(w), w) for w in chain if w.scoped)
+            if scoped:
+                chains[hook_type] = sort_callbacks(hook_tuple + tuple(scoped.values()))
+
+        def matching(
+            hook_type: HookType, weakref_hook: HOOK_REF, calls: typing.List[int]
+        ) -> typing.List[int]:
+            """Return the calls for which the condition of weakref_hook holds"""
+            if weakref_hook.when is None and not weakref_hook.scoped:
+                return calls
+            return [i for i in calls if id(weakref_hook) in selected[hook_type][i]]
+
+        def callback_args_list(weakref_hook: HOOK_REF) -> typing.List[tuple]:
+            """The callbacks of an object are called without the object"""
+            if weakref_hook.scoped:
+                return [args[1:] for args in args_list]
+            return args_list
+
+        # PRECALL
+        all_calls = list(range(len(args_list)))
+        pending = all_calls
+        for weakref_hook in chains[HookType.PRECALL]:
+            o = weakref_hook()
+            calls = matching(HookType.PRECALL, weakref_hook, pending)
+            if o is None or not calls:
+                continue
+            if weakref_hook.batch:
+                pre_results = o([args_list[i] for i in calls], **kwargs)
+            elif weakref_hook.context:
+                pre_results = [o(contexts[i]) for i in calls]
+            else:
+                callbacks_args = callback_args_list(weakref_hook)
+                pre_results = [o(*callbacks_args[i], **kwargs) for i in calls]
+            if pre_results:
+                stopped = set()
+                for i, r in zip(calls, pre_results):
+                    if r is not None and r[0] is True:
+                        results[i] = r[1]
+                        stopped.add(i)
+                if stopped:
+                    pending = [i for i in pending if i not in stopped]
+
+        # CALL
+        for i in pending:
+            results[i] = f(*args_list[i], **kwargs)
+
+        # ITEMFILTERCALL
+        item_hooks = hook_types[HookType.ITEMFILTERCALL]
+        if item_hooks:
+            results = [
+                item_pipeline_loop(item_hooks, r, args, kwargs)
+                for r, args in zip(results, args_list)
+            ]
+
+        # FILTERCALL
+        for weakref_hook in chains[HookType.FILTERCALL]:
+            o = weakref_hook()
+            if o is None:
+                continue
+            if weakref_hook.batch:
+                results = o(results, args_list, **kwargs)
+            elif weakref_hook.when is not None or weakref_hook.scoped:
+                results = list(results)
+                callbacks_args = callback_args_list(weakref_hook)
+                for i in matching(HookType.FILTERCALL, weakref_hook, all_calls):
+                    if weakref_hook.context:
+                        contexts[i].result = results[i]
+                        results[i] = o(contexts[i])
+                    else:
+                        results[i] = o(results[i], *callbacks_args[i], **kwargs)
+            elif weakref_hook.context:
+                for ctx, r in zip(contexts, results):
+                    ctx.result = r
+                    ctx.result = o(ctx)
+                results = [ctx.result for ctx in contexts]
+            else:
+                results = [o(r, *args, **kwargs) for r, args in zip(results, args_list)]
+
+        # POSTCALL
+        for weakref_hook in chains[HookType.POSTCALL]:
+            o = weakref_hook()
+            if o is None:
+                continue
+            post_args: typing.Iterable[tuple]
+            callback_kwargs = kwargs
+            calls = matching(HookType.POSTCALL, weakref_hook, all_calls)
+            if weakref_hook.batch:
+                post_args = [(results, args_list)]
+            elif weakref_hook.context:
+                post_args = ((contexts[i],) for i in calls)
+                callback_kwargs = {}
+                for ctx, r in zip(contexts, results):
+                    ctx.result = r
+            else:
+                callbacks_args = callback_args_list(weakref_hook)
+                post_args = ((results[i], *callbacks_args[i]) for i in calls)
+            for callback_args in post_args:
+                if weakref_hook.deferred:
+                    Hook.DEFERRED_EXECUTOR.submit(o, callback_args, callback_kwargs)
+                elif weakref_hook.process:
+                    Hook.PROCESS_EXECUTOR.submit(o, callback_args, callback_kwargs)
+                elif weakref_hook.is_async:
+                    coroutine = o(*callback_args, **callback_kwargs)
+                    schedule_coroutine(coroutine, self.background_tasks)
+                else:
+                    o(*callback_args, **callback_kwargs)
+
+        return results
+
+    def ref(
+        self, f: F, scope: typing.Any = None, weak: typing.Optional[bool] = None
+    ) -> HOOK_REF:
+        """Return a weak reference to f which unregisters f when f is garbage collected.
+
+        The options of the callback are read from the attributes set by CallHook. With
+        scope, f only applies to the calls where the first argument is scope, and it
+        is called without this argument.
+
+        The reference is a StrongRef when f is registered with weak=False, or by default
+        when f is a module level function, see is_module_function. weak overrides the
+        weak option of f.
+        """
+        hook_options = getattr(f, "__hook_options__", {})
+        if weak is None:
+            weak = hook_options.get("weak")
+        if weak is None:
+            weak = not is_module_function(f)
+        weakref_hook: HOOK_REF
+        if not weak:
+            weakref_hook = StrongRef(f)
+        elif inspect.ismethod(f):
+            weakref_hook = HookMethodRef(f, self._weakref_callback)  # type: ignore
+        else:
+            weakref_hook = HookRef(f, self._weakref_callback)
+        options = {
+            **hook_options,
+            "is_async": is_async_function(f),
+            "qualname": getattr(f, "__qualname__", ""),
+        }
+        if scope is not None:
+            options.update(scope=weakref.ref(scope), scope_id=id(scope))
+        set_callback_options(weakref_hook, options)
+        return weakref_hook
+
+    @staticmethod
+    def discover_plugins(
+        group: str = PLUGIN_GROUP,
+        cache_path: typing.Optional[str] = default_plugin_cache_path(),
+        refresh: bool = False,
+    ) -> typing.Dict[str, typing.List[str]]:
+        """Find the plugins declared as entry points of group, return them by name.
+
+        The name of an entry point is a hook name or a pattern of hook names (see
+        NameTrie), its value is "module" or "module:attribute". The module is imported
+        the first time a matching hook is called: importing it registers its callbacks.
+
+        The entry points are cached in the JSON file cache_path (None: no cache), the
+        cache is refreshed when a directory of sys.path is modified or when refresh
+        is True.
+        """
+        plugins = read_entry_points(group, cache_path, refresh)
+        with SUBSCRIPTIONS_LOCK:
+            for name, values in plugins.items():
+                for value in values:
+                    if value not in Hook.PLUGINS.get(name):
+                        Hook.PLUGINS.add(name, value)
+        for hook in list(Hook.HOOKS.values()):
+            hook_plugins = Hook._find_plugins(hook.name)
+            if hook_plugins:
+                with hook.lock:
+                    hook._plugins = hook_plugins
+                    hook._rebuild()
+        return plugins
+
+    @staticmethod
+    def _find_plugins(name: str) -> typing.List[str]:
+        with SUBSCRIPTIONS_LOCK:
+            return [
+                value
+                for value in Hook.PLUGINS.match_patterns(name)
+                if value not in Hook.LOADED_PLUGINS
+            ]
+
+    def load_plugins(self) -> None:
+        """Import the plugins of the hook, see discover_plugins.
+
+        A plugin which can't be imported is logged and not imported again.
+        """
+        # the locks are not held during the import: the plugin registers callbacks.
+        # The concurrent first calls wait for the import lock of the module.
+        with Hook.transaction():
+            for value in self._plugins:
+                if value in Hook.LOADED_PLUGINS:
+                    continue
+                try:
+                    load_entry_point(value)
+                except Exception:
+                    logger.exception("can't load the plugin %r of %r", value, self.name)
+                with SUBSCRIPTIONS_LOCK:
+                    Hook.LOADED_PLUGINS.add(value)
         with self.lock:
-            if weakref_hook not in hook_list:
-                hook_list.append(weakref_hook)
+            self._plugins = [
+                value for value in self._plugins if value not in Hook.LOADED_PLUGINS
+            ]
+            self._rebuild()
+
+    @staticmethod
+    def _remove_name(name: str) -> None:
+        with SUBSCRIPTIONS_LOCK:
+            HOOK_NAMES.remove(name, name)
+
+    @staticmethod
+    def register_by_name(
+        name: str,
+        hook_type: HookType,
+        f: F,
+        scope: typing.Any = None,
+        lazy: bool = False,
+    ) -> None:
+        """Register f on the hook name, or on the hooks matching the pattern name.
+
+        If the hook doesn't exist yet, the registration is pending until the hook is
+        created, see subscribe and pending_registrations. With scope, f only applies to
+        the calls on scope, see Hook.ref: the hook must exist. In a Hook.scope() block,
+        f is only registered in the block: the hook must exist. See register for lazy.
+        """
+        local = LOCAL_SCOPE.get()
+        hook = None if is_pattern(name) else Hook.HOOKS.get(name)
+        if hook is None:
+            if scope is not None:
+                raise ValueError(
+                    f"the hook {name!r} of a per object callback must exist"
+                )
+            if local is not None:
+                raise ValueError(f"the hook {name!r} of a scope callback must exist")
+            Hook.subscribe(name, hook_type, f)
+        else:
+            # the callbacks of a scope are kept alive until the end of the scope
+            weak = False if local is not None and scope is None else None
+            hook.register(hook_type, hook.ref(f, scope, weak), local, lazy)
+
+    @staticmethod
+    def pending_registrations() -> (
+        typing.List[typing.Tuple[str, HookType, F, typing.Optional[str]]]
+    ):
+        """Return the registrations on hooks which don't exist or don't hook a function
+        yet: (hook name, hook type, callback, error of the last registration or None).
+        """
+        pending = []
+        with SUBSCRIPTIONS_LOCK:
+            for subscription in SUBSCRIPTIONS.match("**"):
+                f = subscription.callback()
+                if subscription.once and f is not None:
+                    pending.append(
+                        (
+                            subscription.pattern,
+                            subscription.hook_type,
+                            f,
+                            subscription.error,
+                        )
+                    )
+        return pending
+
+    @staticmethod
+    def subscribe(pattern: str, hook_type: HookType, f: F) -> None:
+        """Register f on the hooks matching pattern, see NameTrie.
+
+        The hooks created later are matched when they hook their function: pattern
+        subscriptions have no cost on the calls. The hooks where f can't be registered,
+        for example an async PreHook callback on a sync hook, are skipped.
+
+        The registration on a hook name which is not a pattern is validated when the hook
+        hooks its function: a failure is logged and the registration stays pending.
+        """
+        subscription = Subscription(pattern, hook_type, f)
+        with SUBSCRIPTIONS_LOCK:
+            SUBSCRIPTIONS.add(pattern, subscription)
+            for name in HOOK_NAMES.match(pattern):
+                hook = Hook.HOOKS.get(name)
+                if hook is not None and hook._function is not None:
+                    subscription.attach(hook)
+
+    def _unregister(self, hook_type: HookType, func: F) -> bool:
+        self._check_not_frozen()
+        self._sweep()
+        local = LOCAL_SCOPE.get()
+        while local is not None:
+            if local.remove((self.name, hook_type.value), func):
+                return True
+            local = local.parent
+        transaction = TRANSACTION.get()
+        if transaction is not None and not transaction.closed:
+            if transaction.remove(self, hook_type, func):
+                return True
+        else:
+            with self._modify():
+                hook_tuple = self.hook_types[hook_type]
+                for i, callback_weakref in enumerate(hook_tuple):
+                    if callback_weakref() == func:
+                        self._publish(
+                            {
+                                **self.hook_types,
+                                hook_type: hook_tuple[:i] + hook_tuple[i + 1 :],
+                            }
+                        )
+                        return True
+        return self._modify_instances(
+            lambda: self.instances.remove_callback(hook_type, func)
+        )
 
     @staticmethod
     def unregister(func: F = None) -> bool:
         hook_info = func.__hook__ if hasattr(func, "__hook__") else None  # type: ignore
         if isinstance(hook_info, tuple):
+            subscribed = False
+            with SUBSCRIPTIONS_LOCK:
+                for subscription in SUBSCRIPTIONS.get(hook_info[0]):
+                    if subscription.callback() == func:
+                        SUBSCRIPTIONS.remove(hook_info[0], subscription)
+                        subscribed = True
+                        break
+                if is_pattern(hook_info[0]):
+                    if subscribed:
+                        for name in HOOK_NAMES.match(hook_info[0]):
+                            hook = Hook.HOOKS.get(name)
+                            if hook is not None:
+                                hook._unregister(hook_info[1], func)
+                    return subscribed
             hook = Hook.HOOKS.get(hook_info[0])
             if hook is not None:
-                with hook.lock:
-                    hook_list = hook.hook_types[hook_info[1]]
-                    for i, callback_weakref in enumerate(hook_list):
-                        if callback_weakref() == func:
-                            del hook_list[i]
-                            return True
+                return hook._unregister(hook_info[1], func) or subscribed
+            return subscribed
         return False
 
     def __class_getitem__(cls, hook_name: str) -> "Hook":
@@ -344,6 +4393,45 @@ class Hook:
     def get_hook_name(f: F) -> typing.Optional[str]:
         return f.__hookname__ if hasattr(f, "__hookname__") else None  # type: ignore
 
+    @staticmethod
+    def get_instance_hook_name(obj: typing.Any, key: str) -> typing.Optional[str]:
+        """Return the name of the hook of the method key of the class of obj, the hook
+        is created on the first call: the callbacks of the instances are indexed by
+        instance in the hook of their class, see InstanceCallbacks.
+
+        Return None if obj.key is not a method of obj (a staticmethod or a classmethod
+        is not), if the method is already hooked by a hook which is not an instance hook,
+        if the method is a callback of the instances of a HookClass, or if obj can't be
+        weakly referenced.
+        """
+        if isinstance(obj, (dict, type, types.ModuleType)):
+            return None
+        if key in getattr(obj, "__dict__", {}):
+            return None
+        cls = type(obj)
+        function = inspect.getattr_static(cls, key, None)
+        if not inspect.isfunction(function) or function in CallHook.UNBOUND_METHODS:
+            # replacing a HookClass callback would hide it from get_hooked_methods
+            return None
+        try:
+            weakref.ref(obj)
+        except TypeError:
+            # the callbacks of the instances are indexed by weak reference
+            return None
+        hook_name = Hook.get_hook_name(function)
+        if hook_name is not None:
+            if getattr(function, "__instance_hook__", False):
+                return hook_name
+            return None
+        hook_name = f"hook_{id(function)}"
+        wrapped_f = Hook(hook_name)(function)
+        wrapped_f.__setattr__("__instance_hook__", True)
+        try:
+            setattr(cls, key, wrapped_f)
+        except (AttributeError, TypeError):
+            return None
+        return hook_name
+
     @staticmethod
     def get_anonymous_hook_name(obj: typing.Any, key: str) -> str:
         if isinstance(obj, dict):
@@ -351,7 +4439,7 @@ class Hook:
         else:
             f = getattr(obj, key)
         hook_name = Hook.get_hook_name(f)
-        if hook_name is not None:
+        if hook_name is not None and not getattr(f, "__instance_hook__", False):
             # already hooked
             return hook_name
         hook_name = f"hook_{id(f)}"
@@ -361,3 +4449,9 @@ class Hook:
         else:
             setattr(obj, key, wrapped_f)
         return hook_name
+
+
+# run the queued deferred PostHook callbacks before exit
+atexit.register(Hook.DEFERRED_EXECUTOR.shutdown)
+# wait for the process callbacks before exit
+atexit.register(Hook.PROCESS_EXECUTOR.shutdown)